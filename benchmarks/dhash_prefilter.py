@@ -0,0 +1,99 @@
+"""
+Benchmark of the difference hash prefilter of the memory backend.
+
+The labelled duplicate set is a directory containing one subdirectory per
+group of duplicate images (like tests/images/). All images are analysed into
+a temporary memory store, which is padded with random "filler" entries to get
+realistic query times. All labelled images are then queried with different
+maximum hamming distances between the hashes.
+
+Usage:
+    python benchmarks/dhash_prefilter.py --images tests/images/ --values 8,12,16,20 --filler-count 100000
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+
+from min_should_match import load_labelled_images, precision_recall
+from py_image_dedup.persistence.memorystorebackend import MemoryStoreBackend
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util import echo
+
+
+def create_filler_records(count: int, seed: int) -> list:
+    """
+    :param count: number of records
+    :param seed: random seed
+    :return: records with random signatures and hashes
+    """
+    random = np.random.default_rng(seed)
+    signatures = random.integers(-2, 3, size=(count, MemoryStoreBackend.SIGNATURE_LENGTH), dtype=np.int8)
+    hashes = random.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=count, dtype=np.int64)
+    return [
+        {
+            MetadataKey.PATH.value: f"/filler/{i}.jpg",
+            MetadataKey.SIGNATURE.value: signature,
+            MetadataKey.METADATA.value: {MetadataKey.DHASH.value: dhash},
+        }
+        for i, (signature, dhash) in enumerate(zip(signatures, hashes.tolist()))
+    ]
+
+
+@click.command()
+@click.option('--images', 'images_directory', type=click.Path(exists=True, file_okay=False), default="tests/images/",
+              help='Directory containing one subdirectory per group of duplicate images.')
+@click.option('--values', default="4,8,12,16,20,24", help='Comma separated list of hamming distances to compare.')
+@click.option('--filler-count', default=100000, help='Number of random entries to add to the store.')
+@click.option('--max-dist', default=0.1)
+@click.option('--seed', default=0)
+def benchmark(images_directory: str, values: str, filler_count: int, max_dist: float, seed: int):
+    labels = load_labelled_images(Path(images_directory))
+    paths = list(labels.keys())
+
+    with tempfile.TemporaryDirectory() as directory:
+        # hashes are only computed if the prefilter is enabled
+        store = MemoryStoreBackend(Path(directory), max_dist=max_dist, dhash_max_distance=0)
+        for file_path in paths:
+            store.add(file_path)
+        store.import_records(create_filler_records(filler_count, seed))
+
+        hashes = store._columns[MetadataKey.DHASH.value][:store._row_count]
+        has_hash = store._has_dhash[:store._row_count]
+        reference_hashes = [store.get(path)[MetadataKey.METADATA.value].get(MetadataKey.DHASH.value)
+                            for path in paths]
+        has_reference_hash = np.array([dhash is not None for dhash in reference_hashes], dtype=np.bool_)
+        reference_hashes = np.array([dhash if dhash is not None else 0 for dhash in reference_hashes], dtype=np.int64)
+
+        echo(f"{len(labels)} images in {len(set(labels.values()))} groups, {store._row_count} entries")
+        echo("dhash_max_distance | precision | recall | avg. candidates | avg. query time (ms)", color='cyan')
+        for value in [None] + list(map(int, values.split(","))):
+            store._dhash_max_distance = value
+            if value is None:
+                candidate_count = store._row_count * len(paths)
+            else:
+                candidate_count = int(store._shortlist(hashes, has_hash, reference_hashes, has_reference_hash).sum())
+
+            start = time.perf_counter()
+            similar = store.find_similar_batch(paths)
+            query_time = time.perf_counter() - start
+
+            found_pairs = set()
+            for file_path, candidates in similar.items():
+                for candidate in candidates:
+                    candidate_path = candidate[MetadataKey.PATH.value]
+                    if candidate_path != file_path and candidate_path in labels:
+                        found_pairs.add(tuple(sorted((file_path, candidate_path))))
+
+            precision, recall = precision_recall(labels, found_pairs)
+            echo(f"{str(value):>18} | {precision:>9.3f} | {recall:>6.3f} | {candidate_count / len(paths):>15.1f} | "
+                 f"{query_time * 1000 / len(paths):>20.2f}")
+
+        store._dhash_max_distance = None
+        store.remove_all()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,142 @@
+"""
+Benchmark of the indices of the memory backend.
+
+Compares the number of signatures each query has to be compared to, the query
+time and the recall of the radius queries of each index to a brute force search.
+Signatures are either read from a database snapshot (see "py-image-dedup export")
+or generated as clusters of slightly modified random signatures.
+
+Usage:
+    python benchmarks/memory_index.py --count 20000 --queries 200
+    python benchmarks/memory_index.py --snapshot images.npz --indices hnsw --ef 16,32,64
+"""
+import time
+
+import click
+import numpy as np
+
+from py_image_dedup.persistence.hnsw import HNSW
+from py_image_dedup.persistence.snapshot import iter_snapshot_chunks
+from py_image_dedup.persistence.vptree import VPTree, euclidean_radius
+from py_image_dedup.util import echo
+from py_image_dedup.util.signature import normalized_distances
+
+
+def generate_signatures(count: int, cluster_size: int, noise: float, seed: int) -> np.ndarray:
+    """
+    :param count: number of signatures
+    :param cluster_size: number of signatures per cluster of similar images
+    :param noise: fraction of values to modify in each member of a cluster
+    :param seed: random seed
+    :return: count x 648 matrix of signatures
+    """
+    random = np.random.default_rng(seed)
+    centers = random.integers(-2, 3, size=(-(-count // cluster_size), 648), dtype=np.int8)
+    signatures = np.repeat(centers, cluster_size, axis=0)[:count]
+    is_modified = random.random(signatures.shape) < noise
+    signatures[is_modified] = random.integers(-2, 3, size=int(is_modified.sum()), dtype=np.int8)
+    return signatures
+
+
+def load_signatures(snapshot: str) -> np.ndarray:
+    """
+    :param snapshot: snapshot file
+    :return: matrix of all signatures in the snapshot
+    """
+    return np.concatenate([chunk["signature"] for chunk in iter_snapshot_chunks(snapshot)])
+
+
+def benchmark_index(name: str, index, signatures: np.ndarray, references: np.ndarray, expected: list,
+                    max_dist: float):
+    """
+    Queries the given index and prints a result line
+    :param name: name to print
+    :param index: index to query
+    :param signatures: matrix of all signatures
+    :param references: rows to query
+    :param expected: rows within max_dist of each reference
+    :param max_dist: maximum normalized distance
+    """
+    vectors = signatures.astype(np.float32)
+    visited_count = 0
+    found_count = 0
+    query_time = 0.0
+    for reference, expected_rows in zip(references, expected):
+        start = time.perf_counter()
+        radius = euclidean_radius(max_dist, float(np.linalg.norm(vectors[reference])))
+        rows, visited = index.query_radius(vectors[reference], radius)
+        distances = normalized_distances(signatures[rows], np.repeat(signatures[reference][None, :], len(rows), axis=0))
+        found = rows[distances < max_dist]
+        query_time += time.perf_counter() - start
+
+        visited_count += visited
+        found_count += len(np.intersect1d(found, expected_rows))
+
+    expected_count = sum(map(len, expected))
+    echo(f"{name:<16} | {visited_count / len(references):>24.1f} | {query_time * 1000 / len(references):>20.3f} | "
+         f"{found_count / expected_count if expected_count > 0 else 1.0:.3f}")
+
+
+@click.command()
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Database snapshot to read signatures from, synthetic signatures are used if unset.')
+@click.option('--count', default=20000, help='Number of synthetic signatures.')
+@click.option('--cluster-size', default=4, help='Number of similar synthetic signatures per cluster.')
+@click.option('--noise', default=0.02, help='Fraction of modified values within a synthetic cluster.')
+@click.option('--queries', default=200, help='Number of (random) signatures to query.')
+@click.option('--indices', default="vptree,hnsw", help='Comma separated list of indices to compare.')
+@click.option('--leaf-size', default=64, help='Leaf size of the vptree.')
+@click.option('--m', default=16, help='Number of neighbours per image of the hnsw graph.')
+@click.option('--ef-construction', default=100, help='Size of the candidate list when building the hnsw graph.')
+@click.option('--ef', default="16,32,64", help='Comma separated list of hnsw query candidate list sizes to compare.')
+@click.option('--max-dist', default=0.1)
+@click.option('--seed', default=0)
+def benchmark(snapshot: str, count: int, cluster_size: int, noise: float, queries: int, indices: str,
+              leaf_size: int, m: int, ef_construction: int, ef: str, max_dist: float, seed: int):
+    if snapshot is not None:
+        signatures = load_signatures(snapshot)
+    else:
+        signatures = generate_signatures(count, cluster_size, noise, seed)
+    vectors = signatures.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    echo(f"{len(signatures)} signatures")
+
+    random = np.random.default_rng(seed)
+    references = random.choice(len(signatures), size=min(queries, len(signatures)), replace=False)
+
+    expected = []
+    brute_force_time = 0.0
+    for reference in references:
+        start = time.perf_counter()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.linalg.norm(vectors - vectors[reference], axis=1) / (norms + norms[reference])
+        expected.append(np.flatnonzero(distances < max_dist))
+        brute_force_time += time.perf_counter() - start
+
+    indices = indices.split(",")
+    built = {}
+    if "vptree" in indices:
+        tree = VPTree(lambda rows: vectors[rows], leaf_size=leaf_size, seed=seed)
+        start = time.perf_counter()
+        tree.build(np.arange(len(signatures)))
+        echo(f"Built vptree with {len(tree)} nodes in {time.perf_counter() - start:.2f} s")
+        built["vptree"] = tree
+    if "hnsw" in indices:
+        graph = HNSW(lambda rows: vectors[rows], m=m, ef_construction=ef_construction, seed=seed)
+        start = time.perf_counter()
+        graph.build(np.arange(len(signatures)))
+        echo(f"Built hnsw graph in {time.perf_counter() - start:.2f} s")
+        built["hnsw"] = graph
+
+    echo("index            | avg. compared signatures | avg. query time (ms) | recall", color='cyan')
+    echo(f"{'brute force':<16} | {len(signatures):>24} | {brute_force_time * 1000 / len(references):>20.3f} | 1.000")
+    if "vptree" in built:
+        benchmark_index("vptree", built["vptree"], signatures, references, expected, max_dist)
+    if "hnsw" in built:
+        for value in map(int, ef.split(",")):
+            built["hnsw"]._ef = value
+            benchmark_index(f"hnsw (ef={value})", built["hnsw"], signatures, references, expected, max_dist)
+
+
+if __name__ == '__main__':
+    benchmark()
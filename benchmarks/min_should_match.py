@@ -0,0 +1,104 @@
+"""
+Recall/precision benchmark for the elasticsearch "min_should_match" setting.
+
+The labelled duplicate set is a directory containing one subdirectory per
+group of duplicate images (like tests/images/). All images are analysed into
+a separate index, which is then queried with different min_should_match values.
+
+Usage:
+    python benchmarks/min_should_match.py --images tests/images/ --values 1,2,4,8,16
+"""
+import itertools
+import time
+from pathlib import Path
+
+import click
+
+from py_image_dedup.persistence.elasticsearchstorebackend import ElasticSearchStoreBackend
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util import echo
+
+
+def load_labelled_images(images_directory: Path) -> dict:
+    """
+    :param images_directory: directory with one subdirectory per duplicate group
+    :return: map of image file path -> label
+    """
+    labels = {}
+    for group_directory in sorted(filter(lambda x: x.is_dir(), images_directory.iterdir())):
+        for file_path in sorted(filter(lambda x: x.is_file(), group_directory.iterdir())):
+            labels[str(file_path.absolute())] = group_directory.name
+    return labels
+
+
+def precision_recall(labels: dict, found_pairs: set) -> (float, float):
+    """
+    :param labels: map of image file path -> label
+    :param found_pairs: set of (sorted) path tuples that were found to be duplicates
+    :return: precision, recall
+    """
+    expected_pairs = set()
+    for a, b in itertools.combinations(sorted(labels.keys()), 2):
+        if labels[a] == labels[b]:
+            expected_pairs.add((a, b))
+
+    true_positives = len(found_pairs & expected_pairs)
+    precision = true_positives / len(found_pairs) if len(found_pairs) > 0 else 1.0
+    recall = true_positives / len(expected_pairs) if len(expected_pairs) > 0 else 1.0
+    return precision, recall
+
+
+@click.command()
+@click.option('--images', 'images_directory', type=click.Path(exists=True, file_okay=False), default="tests/images/",
+              help='Directory containing one subdirectory per group of duplicate images.')
+@click.option('--values', default="1,2,4,8,16", help='Comma separated list of min_should_match values to compare.')
+@click.option('--host', default="127.0.0.1")
+@click.option('--port', default=9200)
+@click.option('--index', default="py-image-dedup-benchmark")
+@click.option('--max-dist', default=0.1)
+def benchmark(images_directory: str, values: str, host: str, port: int, index: str, max_dist: float):
+    labels = load_labelled_images(Path(images_directory))
+
+    store = ElasticSearchStoreBackend(
+        host=host,
+        port=port,
+        connections_per_node=1,
+        el_index=index,
+        max_dist=max_dist,
+    )
+    store.remove_all()
+    for file_path in labels.keys():
+        store.add(file_path)
+    store._store.es.indices.refresh(index=index)
+
+    echo(f"{len(labels)} images in {len(set(labels.values()))} groups")
+    echo("min_should_match | precision | recall | avg. candidates | avg. query time (ms)", color='cyan')
+    for value in map(int, values.split(",")):
+        store._min_should_match = value
+
+        found_pairs = set()
+        candidate_count = 0
+        query_time = 0.0
+        for file_path in labels.keys():
+            entry = store.get(file_path)
+            query = store._create_similarity_query(entry)
+            candidate_count += store._store.es.count(index=index, body={'query': query['query']})['count']
+
+            start = time.perf_counter()
+            similar = store.find_similar(file_path)
+            query_time += time.perf_counter() - start
+
+            for candidate in similar:
+                candidate_path = candidate[MetadataKey.PATH.value]
+                if candidate_path != file_path:
+                    found_pairs.add(tuple(sorted((file_path, candidate_path))))
+
+        precision, recall = precision_recall(labels, found_pairs)
+        echo(f"{value:>16} | {precision:>9.3f} | {recall:>6.3f} | {candidate_count / len(labels):>15.1f} | "
+             f"{query_time * 1000 / len(labels):>20.2f}")
+
+    store.remove_all()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,131 @@
+"""
+Benchmark of the memory needed to hold the state of a deduplication run.
+
+A synthetic run over --file-count files is simulated: the files form groups of
+--group-size similar images, every file is marked as processed and each group
+is added to the result, like the reference strategy does. This is done once
+with the dictionaries keyed by pathlib.Path holding complete candidate dictionaries
+(like before the compact representation) and once with the current path table,
+bitset and candidate records. Each variant runs in its own process, whose peak
+resident set size is reported.
+
+Usage:
+    python benchmarks/result_memory.py --file-count 1000000
+"""
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+import click
+
+from py_image_dedup.library import ActionEnum
+from py_image_dedup.library.deduplication_result import DeduplicationResult
+from py_image_dedup.library.path_table import PathTable, PathSet
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util import echo
+
+
+def create_candidate(i: int) -> dict:
+    """
+    :param i: number of the file
+    :return: a candidate like the ones found by the elasticsearch backend
+    """
+    return {
+        'id': f"{i:020d}",
+        MetadataKey.SCORE.value: 63.0,
+        MetadataKey.PATH.value: f"/home/user/pictures/{i // 1000:04d}/IMG_{i:08d}.jpg",
+        MetadataKey.NAMESPACE.value: None,
+        MetadataKey.METADATA.value: {
+            MetadataKey.FILE_SIZE.value: 2000000 + i,
+            MetadataKey.FILE_MODIFICATION_DATE.value: 1500000000.0 + i,
+            MetadataKey.PIXELCOUNT.value: 12000000,
+            MetadataKey.EXIF_DATA_COUNT.value: 40,
+        },
+        MetadataKey.DISTANCE.value: 0.01 * (i % 10),
+    }
+
+
+class DictResult:
+    """
+    The state of a run as it was held before: dictionaries keyed by paths, holding complete candidates
+    """
+
+    def __init__(self):
+        self.processed_files = {}
+        self.item_actions = {}
+        self.reference_files = {}
+        self.file_duplicates = {}
+
+    def add_group(self, candidates: [dict]):
+        for candidate in candidates:
+            self.processed_files[Path(candidate[MetadataKey.PATH.value])] = True
+        reference_file_path = Path(candidates[0][MetadataKey.PATH.value])
+        self.reference_files[reference_file_path] = candidates[0]
+        self.file_duplicates[reference_file_path] = candidates[1:]
+        self.item_actions[reference_file_path] = ActionEnum.NONE
+        for candidate in candidates[1:]:
+            self.item_actions[Path(candidate[MetadataKey.PATH.value])] = ActionEnum.DELETE
+
+
+class CompactResult:
+    """
+    The state of a run as it is held now
+    """
+
+    def __init__(self):
+        paths = PathTable()
+        self.processed_files = PathSet(paths)
+        self.result = DeduplicationResult(paths)
+
+    def add_group(self, candidates: [dict]):
+        for candidate in candidates:
+            self.processed_files.add(candidate[MetadataKey.PATH.value])
+        self.result.set_file_duplicates(candidates[:1], candidates[1:])
+        self.result.add_file_action(Path(candidates[0][MetadataKey.PATH.value]), ActionEnum.NONE)
+        for candidate in candidates[1:]:
+            self.result.add_file_action(Path(candidate[MetadataKey.PATH.value]), ActionEnum.DELETE)
+
+
+VARIANTS = {
+    "dict": DictResult,
+    "compact": CompactResult,
+}
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_variant(variant: str, file_count: int, group_size: int, results):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    state = VARIANTS[variant]()
+    for first in range(0, file_count, group_size):
+        state.add_group([create_candidate(i) for i in range(first, min(first + group_size, file_count))])
+    results.put((variant, baseline, peak_rss_mb(), time.perf_counter() - start))
+
+
+@click.command()
+@click.option('--file-count', default=1000000, help='Number of files of the simulated run.')
+@click.option('--group-size', default=3, help='Number of files per group of duplicates.')
+def benchmark(file_count: int, group_size: int):
+    echo(f"{file_count} files in groups of {group_size}")
+    echo("variant | baseline (MB) | peak (MB) | run state (MB) | time (s)", color='cyan')
+    results = multiprocessing.Queue()
+    for variant in VARIANTS.keys():
+        process = multiprocessing.Process(target=run_variant, args=(variant, file_count, group_size, results))
+        process.start()
+        variant, baseline, peak, duration = results.get()
+        process.join()
+        echo(f"{variant:>7} | {baseline:>13.1f} | {peak:>9.1f} | {peak - baseline:>14.1f} | {duration:>8.2f}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,86 @@
+"""
+Benchmark of the similarity join compared to querying every entry of the memory backend.
+
+The labelled duplicate set is a directory containing one subdirectory per
+group of duplicate images (like tests/images/). All images are analysed into
+a temporary memory store, which is padded with random "filler" entries.
+All similar pairs are then found once by querying each entry and once by
+the similarity join, using --processes worker processes.
+
+Usage:
+    python benchmarks/similarity_join.py --images tests/images/ --filler-count 20000 --processes 8
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+from dhash_prefilter import create_filler_records
+from min_should_match import load_labelled_images, precision_recall
+from py_image_dedup.library.similarity_join import read_entries, similarity_join, ENTRY_FIELDS
+from py_image_dedup.persistence.memorystorebackend import MemoryStoreBackend
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util import echo
+
+
+def labelled_pairs(labels: dict, pairs) -> set:
+    """
+    :param labels: map of image path -> group label
+    :param pairs: (path, path) tuples
+    :return: pairs of labelled images, sorted within each pair
+    """
+    return {
+        tuple(sorted((a, b))) for a, b in pairs
+        if a != b and a in labels and b in labels
+    }
+
+
+@click.command()
+@click.option('--images', 'images_directory', type=click.Path(exists=True, file_okay=False), default="tests/images/",
+              help='Directory containing one subdirectory per group of duplicate images.')
+@click.option('--filler-count', default=20000, help='Number of random entries to add to the store.')
+@click.option('--max-dist', default=0.1)
+@click.option('--max-bucket-size', default=1000)
+@click.option('--batch-size', default=64)
+@click.option('--processes', default=1, help='Number of worker processes of the similarity join.')
+@click.option('--seed', default=0)
+def benchmark(images_directory: str, filler_count: int, max_dist: float, max_bucket_size: int, batch_size: int,
+              processes: int, seed: int):
+    labels = load_labelled_images(Path(images_directory))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = MemoryStoreBackend(Path(directory), max_dist=max_dist)
+        for file_path in labels.keys():
+            store.add(file_path)
+        store.import_records(create_filler_records(filler_count, seed))
+        count, entries = store.get_all()
+        paths = [entry['_source'][MetadataKey.PATH.value] for entry in entries]
+        echo(f"{len(labels)} images in {len(set(labels.values()))} groups, {count} entries")
+        echo("method | precision | recall | similar pairs | time (s)", color='cyan')
+
+        start = time.perf_counter()
+        pairs = set()
+        for i in range(0, len(paths), batch_size):
+            for path, similar in store.find_similar_batch(paths[i:i + batch_size]).items():
+                pairs.update(tuple(sorted((path, hit[MetadataKey.PATH.value]))) for hit in similar
+                             if hit[MetadataKey.PATH.value] != path)
+        query_time = time.perf_counter() - start
+        precision, recall = precision_recall(labels, labelled_pairs(labels, pairs))
+        echo(f"queries | {precision:>9.3f} | {recall:>6.3f} | {len(pairs):>13} | {query_time:>8.2f}")
+
+        start = time.perf_counter()
+        records, signatures = read_entries(store.get_all(fields=ENTRY_FIELDS)[1])
+        join_pairs, _, _ = similarity_join(signatures, max_dist, max_bucket_size=max_bucket_size,
+                                           processes=processes)
+        join_time = time.perf_counter() - start
+        pairs = {(records[a][MetadataKey.PATH.value], records[b][MetadataKey.PATH.value])
+                 for a, b in join_pairs.tolist()}
+        precision, recall = precision_recall(labels, labelled_pairs(labels, pairs))
+        echo(f"join    | {precision:>9.3f} | {recall:>6.3f} | {len(pairs):>13} | {join_time:>8.2f}")
+
+        store.remove_all()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -28,5 +28,6 @@ deduplicator = ImageMatchDeduplicator()
 result = deduplicator.deduplicate_all(
     skip_analyze_phase=False,
 )
+deduplicator.close()
 
 result.print_to_console()
@@ -1,4 +1,5 @@
 import time
+from pathlib import Path
 
 import click
 
@@ -11,10 +12,20 @@ IMAGE_HASH_MAP = {}
 
 PARAM_SKIP_ANALYSE_PHASE = "skip-analyse-phase"
 PARAM_DRY_RUN = "dry-run"
+PARAM_COUNT = "count"
+PARAM_ALL_NAMESPACES = "all-namespaces"
+PARAM_CHUNK_SIZE = "chunk-size"
+PARAM_INCREMENTAL = "incremental"
+PARAM_STREAMING = "streaming"
 
 CMD_OPTION_NAMES = {
     PARAM_SKIP_ANALYSE_PHASE: ['--skip-analyse-phase', '-sap'],
-    PARAM_DRY_RUN: ['--dry-run', '-dr']
+    PARAM_DRY_RUN: ['--dry-run', '-dr'],
+    PARAM_COUNT: ['--count', '-c'],
+    PARAM_ALL_NAMESPACES: ['--all-namespaces', '-a'],
+    PARAM_CHUNK_SIZE: ['--chunk-size', '-cs'],
+    PARAM_INCREMENTAL: ['--incremental', '-i'],
+    PARAM_STREAMING: ['--streaming', '-st']
 }
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
@@ -37,8 +48,8 @@ def get_option_names(parameter: str) -> list:
 
 @cli.command(name="analyse")
 def c_analyse():
-    deduplicator = ImageMatchDeduplicator(interactive=True)
-    deduplicator.analyse_all()
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        deduplicator.analyse_all()
 
 
 @cli.command(name="deduplicate")
@@ -47,20 +58,63 @@ def c_analyse():
 @click.option(*get_option_names(PARAM_DRY_RUN), required=False, default=None, is_flag=True,
               help='When set no files or folders will actually be deleted but a preview of '
                    'what WOULD be done will be printed.')
+@click.option(*get_option_names(PARAM_INCREMENTAL), required=False, default=False, is_flag=True,
+              help='When set only duplicates of new or changed files will be searched for. '
+                   'Useful for regular runs after a complete one.')
+@click.option(*get_option_names(PARAM_STREAMING), required=False, default=False, is_flag=True,
+              help='When set files are analysed and searched for duplicates in a single pass, '
+                   'so duplicates are found while the analysis is still running.')
 def c_deduplicate(skip_analyse_phase: bool,
-                  dry_run: bool):
+                  dry_run: bool,
+                  incremental: bool,
+                  streaming: bool):
     config = DeduplicatorConfig()
     if dry_run is not None:
         config.DRY_RUN.value = dry_run
-    deduplicator = ImageMatchDeduplicator(interactive=True)
-    result = deduplicator.deduplicate_all(
-        skip_analyze_phase=skip_analyse_phase,
-    )
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        result = deduplicator.deduplicate_all(
+            skip_analyze_phase=skip_analyse_phase,
+            incremental=incremental,
+            streaming=streaming,
+        )
 
     echo()
     result.print_to_console()
 
 
+@cli.command(name="hot-words")
+@click.option(*get_option_names(PARAM_COUNT), required=False, default=20, type=int,
+              help='The number of signature words to show.')
+def c_hot_words(count: int):
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        deduplicator.print_hot_words(count)
+
+
+@cli.command(name="find-similar")
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option(*get_option_names(PARAM_ALL_NAMESPACES), required=False, default=False, is_flag=True,
+              help='When set images analysed by other hosts sharing the database are included.')
+def c_find_similar(file: str, all_namespaces: bool):
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        deduplicator.print_similar(Path(file), all_namespaces)
+
+
+@cli.command(name="export")
+@click.argument('file', type=click.Path(dir_okay=False, writable=True))
+@click.option(*get_option_names(PARAM_CHUNK_SIZE), required=False, default=10000, type=click.IntRange(min=1),
+              help='The maximum number of entries per chunk, only a single chunk is held in memory at once.')
+def c_export(file: str, chunk_size: int):
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        deduplicator.export_database(Path(file), chunk_size)
+
+
+@cli.command(name="import")
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def c_import(file: str):
+    with ImageMatchDeduplicator(interactive=True) as deduplicator:
+        deduplicator.import_database(Path(file))
+
+
 @cli.command(name="daemon")
 @click.option(*get_option_names(PARAM_DRY_RUN), required=False, default=None, is_flag=True,
               help='When set no files or folders will actually be deleted but a preview of '
@@ -88,6 +142,7 @@ def c_daemon(dry_run: bool):
             time.sleep(1)
     except KeyboardInterrupt:
         processing_manager.stop()
+        deduplicator.close()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,11 @@
 import os
+import re
 from datetime import timedelta
 
 from container_app_conf import ConfigBase
 from container_app_conf.entry.bool import BoolConfigEntry
 from container_app_conf.entry.dict import DictConfigEntry
-from container_app_conf.entry.file import DirectoryConfigEntry
+from container_app_conf.entry.file import DirectoryConfigEntry, FileConfigEntry
 from container_app_conf.entry.float import FloatConfigEntry
 from container_app_conf.entry.int import IntConfigEntry
 from container_app_conf.entry.list import ListConfigEntry
@@ -26,12 +27,43 @@ FILE_OBSERVER_TYPE_INOTIFY = "inotify"
 
 NODE_DRY_RUN = "dry_run"
 
+NODE_BACKEND = "backend"
+BACKEND_TYPE_ELASTICSEARCH = "elasticsearch"
+BACKEND_TYPE_SQLITE = "sqlite"
+BACKEND_TYPE_MEMORY = "memory"
+
+NODE_SQLITE = "sqlite"
+NODE_FILE = "file"
+NODE_MAX_CANDIDATES = "max_candidates"
+
+NODE_MEMORY = "memory"
+NODE_DIRECTORY = "directory"
+INDEX_TYPE_NONE = "none"
+INDEX_TYPE_VPTREE = "vptree"
+INDEX_TYPE_HNSW = "hnsw"
+NODE_HNSW = "hnsw"
+NODE_M = "m"
+NODE_EF_CONSTRUCTION = "ef_construction"
+NODE_EF = "ef"
+NODE_DHASH_MAX_DISTANCE = "dhash_max_distance"
+NODE_CLUSTER_MARGIN = "cluster_margin"
+
 NODE_ELASTICSEARCH = "elasticsearch"
 
 NODE_HOST = "host"
 NODE_MAX_DISTANCE = "max_distance"
+NODE_MIN_SHOULD_MATCH = "min_should_match"
+NODE_HOT_WORD_THRESHOLD = "hot_word_threshold"
+NODE_MAX_PAGES = "max_pages"
+NODE_ASYNC = "async"
+NODE_MAX_CONCURRENT_REQUESTS = "max_concurrent_requests"
+NODE_WRITE_BEHIND = "write_behind"
+NODE_SPILL_FILE = "spill_file"
+NODE_MEMORY_LIMIT = "memory_limit"
 NODE_AUTO_CREATE_INDEX = "auto_create_index"
 NODE_INDEX = "index"
+NODE_NAMESPACE = "namespace"
+NODE_CANONICAL_ORIENTATION = "canonical_orientation"
 
 NODE_ANALYSIS = "analysis"
 
@@ -49,12 +81,31 @@ NODE_PRIORITIZATION_RULES = "prioritization_rules"
 NODE_MAX_FILE_MODIFICATION_TIME_DIFF = "max_file_modification_time_diff"
 NODE_REMOVE_EMPTY_FOLDERS = "remove_empty_folders"
 NODE_DUPLICATES_TARGET_DIRECTORY = "duplicates_target_directory"
+NODE_BATCH_SIZE = "batch_size"
+NODE_STRATEGY = "strategy"
+STRATEGY_REFERENCE = "reference"
+STRATEGY_CLUSTERING = "clustering"
+STRATEGY_JOIN = "join"
+NODE_JOIN_MAX_BUCKET_SIZE = "join_max_bucket_size"
+NODE_JOIN_PROCESSES = "join_processes"
+NODE_MAX_GROUP_SIZE = "max_group_size"
+NODE_LINKAGE = "linkage"
+LINKAGE_SINGLE = "single"
+LINKAGE_COMPLETE = "complete"
 
 NODE_STATS = "stats"
 NODE_ENABLED = "enabled"
 NODE_PORT = "port"
 
 
+def _one_of(values: [str]) -> str:
+    """
+    :param values: allowed values
+    :return: regex matching exactly one of the given values
+    """
+    return "^({})$".format("|".join(map(re.escape, values)))
+
+
 class DeduplicatorConfig(ConfigBase):
 
     def __new__(cls, *args, **kwargs):
@@ -74,6 +125,138 @@ class DeduplicatorConfig(ConfigBase):
         default=True
     )
 
+    BACKEND = StringConfigEntry(
+        description="Type of database backend to use. "
+                    "The sqlite backend uses an embedded database file and doesn't need any server. "
+                    "The memory backend keeps all signatures in memory (memory mapped files) and "
+                    "compares them by brute force, which is the fastest option if they fit into memory.",
+        key_path=[
+            NODE_MAIN,
+            NODE_BACKEND
+        ],
+        regex=_one_of([BACKEND_TYPE_ELASTICSEARCH, BACKEND_TYPE_SQLITE, BACKEND_TYPE_MEMORY]),
+        default=BACKEND_TYPE_ELASTICSEARCH,
+        required=True
+    )
+
+    SQLITE_FILE = FileConfigEntry(
+        description="Database file of the sqlite backend, created if it does not exist.",
+        key_path=[
+            NODE_MAIN,
+            NODE_SQLITE,
+            NODE_FILE
+        ],
+        default=os.path.join(os.path.expanduser("~"), ".py_image_dedup", "images.sqlite")
+    )
+
+    SQLITE_MAX_CANDIDATES = IntConfigEntry(
+        description="Maximum number of candidates (the ones sharing the most signature words) the distance "
+                    "is computed for, per query of the sqlite backend. Queries that might have left out "
+                    "similar images because of this limit are listed as truncated groups.",
+        key_path=[
+            NODE_MAIN,
+            NODE_SQLITE,
+            NODE_MAX_CANDIDATES
+        ],
+        range=Range(1, 1000000),
+        default=100
+    )
+
+    MEMORY_DIRECTORY = DirectoryConfigEntry(
+        description="Directory of the memory mapped files of the memory backend, created if it does not exist.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_DIRECTORY
+        ],
+        default=os.path.join(os.path.expanduser("~"), ".py_image_dedup", "memory")
+    )
+
+    MEMORY_INDEX = StringConfigEntry(
+        description="Type of index used by the memory backend. "
+                    "Without an index every query is compared to all signatures. "
+                    "A vptree (vantage point tree) finds exactly the same images while "
+                    "comparing fewer signatures, if similar images form tight clusters. "
+                    "A hnsw graph compares even fewer signatures, but may miss some images.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_INDEX
+        ],
+        regex=_one_of([INDEX_TYPE_NONE, INDEX_TYPE_VPTREE, INDEX_TYPE_HNSW]),
+        default=INDEX_TYPE_NONE,
+        required=True
+    )
+
+    MEMORY_DHASH_MAX_DISTANCE = IntConfigEntry(
+        description="Maximum number of differing bits between the 64 bit difference hashes of two images "
+                    "for them to be compared by signature, when no index is used. "
+                    "Lower values result in faster queries, at the cost of a lower recall. Disabled if unset.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_DHASH_MAX_DISTANCE
+        ],
+        range=Range(0, 64),
+        required=False,
+        default=None,
+        example=16
+    )
+
+    MEMORY_CLUSTER_MARGIN = FloatConfigEntry(
+        description="When set, new images are compared to the kept copy (representative) of each group "
+                    "of duplicates found in earlier runs, and only to the other members of a group if the "
+                    "distance to its representative is within this margin of max_distance. Disabled if unset.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_CLUSTER_MARGIN
+        ],
+        range=Range(0.0, 1.0),
+        required=False,
+        default=None,
+        example=0.05
+    )
+
+    MEMORY_HNSW_M = IntConfigEntry(
+        description="Number of neighbours of each image in the hnsw graph. "
+                    "Higher values increase recall, memory usage and insert time.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_HNSW,
+            NODE_M
+        ],
+        range=Range(2, 128),
+        default=16
+    )
+
+    MEMORY_HNSW_EF_CONSTRUCTION = IntConfigEntry(
+        description="Number of candidates considered when inserting an image into the hnsw graph. "
+                    "Higher values result in a better graph at the cost of a slower analysis.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_HNSW,
+            NODE_EF_CONSTRUCTION
+        ],
+        range=Range(1, 10000),
+        default=100
+    )
+
+    MEMORY_HNSW_EF = IntConfigEntry(
+        description="Number of candidates considered when querying the hnsw graph. "
+                    "Higher values increase recall and query time.",
+        key_path=[
+            NODE_MAIN,
+            NODE_MEMORY,
+            NODE_HNSW,
+            NODE_EF
+        ],
+        range=Range(1, 10000),
+        default=64
+    )
+
     ELASTICSEARCH_HOST = StringConfigEntry(
         description="Hostname of the elasticsearch backend instance to use.",
         key_path=[
@@ -105,6 +288,109 @@ class DeduplicatorConfig(ConfigBase):
         default=0.10
     )
 
+    ELASTICSEARCH_MIN_SHOULD_MATCH = IntConfigEntry(
+        description="Minimum number of signature words an image has to share with the reference image "
+                    "to be considered a duplicate candidate. Higher values result in smaller candidate sets "
+                    "and faster queries, at the cost of a lower recall.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_MIN_SHOULD_MATCH
+        ],
+        range=Range(1, 63),
+        default=1
+    )
+
+    ELASTICSEARCH_HOT_WORD_THRESHOLD = FloatConfigEntry(
+        description="Document frequency (0..1) above which a signature word is left out of similarity queries. "
+                    "Words like these (f.ex. from flat skies or black borders) occur in a large share of all "
+                    "images and only inflate the candidate set. Disabled if unset.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_HOT_WORD_THRESHOLD
+        ],
+        # 0 would leave out all words, 1 none of them
+        range=Range(0.0, 1.0, start_inclusive=False, end_inclusive=False),
+        required=False,
+        default=None,
+        example=0.05
+    )
+
+    ELASTICSEARCH_MAX_PAGES = IntConfigEntry(
+        description="Maximum number of result pages fetched per similarity query. Further pages are "
+                    "fetched as long as a page is full and contains similar images, queries cut off by "
+                    "this limit are listed as truncated groups.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_MAX_PAGES
+        ],
+        range=Range(1, 1000),
+        default=10
+    )
+
+    ELASTICSEARCH_ASYNC = BoolConfigEntry(
+        description="Whether to use an asynchronous client that keeps multiple requests "
+                    "to the elasticsearch backend in flight at once. Requires aiohttp.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_ASYNC
+        ],
+        default=False
+    )
+
+    ELASTICSEARCH_MAX_CONCURRENT_REQUESTS = IntConfigEntry(
+        description="Maximum number of requests in flight at once when using the asynchronous client.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_MAX_CONCURRENT_REQUESTS
+        ],
+        range=Range(1, 1024),
+        default=16
+    )
+
+    ELASTICSEARCH_WRITE_BEHIND_ENABLED = BoolConfigEntry(
+        description="Whether to queue writes to the elasticsearch backend, so the analysis phase doesn't "
+                    "have to wait for it. Analysed files that don't fit into memory are spilled to a local "
+                    "file while the backend is slow or unavailable, and are written once it recovers.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_WRITE_BEHIND,
+            NODE_ENABLED
+        ],
+        default=False
+    )
+
+    ELASTICSEARCH_WRITE_BEHIND_SPILL_FILE = FileConfigEntry(
+        description="File to spill queued writes to. Defaults to a file named after the index "
+                    "in the temporary directory.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_WRITE_BEHIND,
+            NODE_SPILL_FILE
+        ],
+        required=False,
+        default=None,
+        example="/var/lib/py-image-dedup/images.spill"
+    )
+
+    ELASTICSEARCH_WRITE_BEHIND_MEMORY_LIMIT = IntConfigEntry(
+        description="Maximum number of queued writes to hold in memory before spilling them to disk.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_WRITE_BEHIND,
+            NODE_MEMORY_LIMIT
+        ],
+        range=Range(1, 1000000),
+        default=1000
+    )
+
     ELASTICSEARCH_AUTO_CREATE_INDEX = BoolConfigEntry(
         description="Whether to automatically create an index in the target database.",
         key_path=[
@@ -125,6 +411,31 @@ class DeduplicatorConfig(ConfigBase):
         default="images"
     )
 
+    ELASTICSEARCH_NAMESPACE = StringConfigEntry(
+        description="An id (f.ex. the hostname) to tag all entries of this instance with. "
+                    "When set, cleanup, queries and duplicate search are limited to entries with the same id, "
+                    "so multiple hosts can share a single index without processing each other's entries.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_NAMESPACE
+        ],
+        required=False,
+        default=None,
+        example="my-host"
+    )
+
+    ELASTICSEARCH_CANONICAL_ORIENTATION = BoolConfigEntry(
+        description="Whether to store signatures in a canonical orientation, so rotated and mirrored copies "
+                    "of an image are found by a single query. Changing this causes all images to be analysed again.",
+        key_path=[
+            NODE_MAIN,
+            NODE_ELASTICSEARCH,
+            NODE_CANONICAL_ORIENTATION
+        ],
+        default=False
+    )
+
     ANALYSIS_USE_EXIF_DATA = BoolConfigEntry(
         description="Whether to scan for EXIF data or not.",
         key_path=[
@@ -244,6 +555,99 @@ class DeduplicatorConfig(ConfigBase):
         ]
     )
 
+    DEDUPLICATION_BATCH_SIZE = IntConfigEntry(
+        description="Number of files to query the backend for similar images at once while finding duplicates.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_BATCH_SIZE
+        ],
+        range=Range(1, 10000),
+        default=64
+    )
+
+    DEDUPLICATION_THREADS = IntConfigEntry(
+        description="Number of batches of similarity queries to run at once while finding duplicates. "
+                    "Duplicates are still selected one file after another, so the result doesn't depend on it.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_THREADS
+        ],
+        range=Range(1, 256),
+        default=1
+    )
+
+    DEDUPLICATION_STRATEGY = StringConfigEntry(
+        description="How duplicates are grouped. "
+                    "'reference' queries each file and then the best of its candidates again, "
+                    "the groups depend on the order in which files are visited. "
+                    "'clustering' queries each file only once and groups all files that are "
+                    "(transitively) similar to each other. "
+                    "'join' finds the same groups, but reads all signatures at once and compares them locally "
+                    "instead of querying the backend for each file.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_STRATEGY
+        ],
+        regex=_one_of([STRATEGY_REFERENCE, STRATEGY_CLUSTERING, STRATEGY_JOIN]),
+        default=STRATEGY_REFERENCE,
+    )
+
+    DEDUPLICATION_JOIN_MAX_BUCKET_SIZE = IntConfigEntry(
+        description="Signature words shared by more images than this are ignored when looking for "
+                    "candidate pairs with the join strategy. Higher values find more duplicates of "
+                    "featureless images, at the cost of (quadratically) more candidate pairs.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_JOIN_MAX_BUCKET_SIZE
+        ],
+        range=Range(2, 1000000),
+        default=1000
+    )
+
+    DEDUPLICATION_JOIN_PROCESSES = IntConfigEntry(
+        description="Number of worker processes computing the similarity join. "
+                    "The signatures are shared with them using shared memory.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_JOIN_PROCESSES
+        ],
+        range=Range(1, 1024),
+        default=1
+    )
+
+    DEDUPLICATION_MAX_GROUP_SIZE = IntConfigEntry(
+        description="Maximum number of files in a group of duplicates. "
+                    "Larger groups only keep the files closest to their reference "
+                    "and are reported in the summary. Unlimited if unset.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_MAX_GROUP_SIZE
+        ],
+        range=Range(2, 1000000),
+        required=False,
+        default=None,
+        example=100
+    )
+
+    DEDUPLICATION_LINKAGE = StringConfigEntry(
+        description="When to merge two groups of duplicates with the clustering strategy. "
+                    "'single' merges them if any two of their files are similar, "
+                    "'complete' only if all of their files are similar to each other.",
+        key_path=[
+            NODE_MAIN,
+            NODE_DEDUPLICATION,
+            NODE_LINKAGE
+        ],
+        regex=_one_of([LINKAGE_SINGLE, LINKAGE_COMPLETE]),
+        default=LINKAGE_SINGLE,
+    )
+
     REMOVE_EMPTY_FOLDERS = BoolConfigEntry(
         description="Whether to remove empty folders or not.",
         key_path=[
@@ -282,7 +686,7 @@ class DeduplicatorConfig(ConfigBase):
             NODE_DAEMON,
             NODE_FILE_OBSERVER_TYPE
         ],
-        regex="|".join([FILE_OBSERVER_TYPE_POLLING, FILE_OBSERVER_TYPE_INOTIFY]),
+        regex=_one_of([FILE_OBSERVER_TYPE_POLLING, FILE_OBSERVER_TYPE_INOTIFY]),
         default=FILE_OBSERVER_TYPE_POLLING,
         required=True
     )
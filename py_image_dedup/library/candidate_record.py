@@ -0,0 +1,85 @@
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+# metadata needed to rank candidates and to print the summary, by attribute name
+_METADATA_KEYS = {
+    "file_size": MetadataKey.FILE_SIZE.value,
+    "file_modification_date": MetadataKey.FILE_MODIFICATION_DATE.value,
+    "pixel_count": MetadataKey.PIXELCOUNT.value,
+    "exif_data_count": MetadataKey.EXIF_DATA_COUNT.value,
+}
+
+
+class CandidateRecord:
+    """
+    The fields of a duplicate candidate (as returned by ImageSignatureStore.find_similar) that are needed
+    to rank it, without the remaining metadata (like exif data) and the elasticsearch hit.
+    Supports read access like the candidate dictionary it has been created from.
+    """
+    __slots__ = ("path", "distance", "score") + tuple(_METADATA_KEYS.keys())
+
+    def __init__(self, path: str, distance: float = None, score: float = None, file_size: int = None,
+                 file_modification_date: float = None, pixel_count: int = None, exif_data_count: int = None):
+        self.path = path
+        self.distance = distance
+        self.score = score
+        self.file_size = file_size
+        self.file_modification_date = file_modification_date
+        self.pixel_count = pixel_count
+        self.exif_data_count = exif_data_count
+
+    @classmethod
+    def of(cls, candidate: dict) -> 'CandidateRecord':
+        """
+        :param candidate: a candidate dictionary, or a record
+        :return: record of the ranking fields of the candidate
+        """
+        if isinstance(candidate, CandidateRecord):
+            return candidate
+        metadata = candidate.get(MetadataKey.METADATA.value, {})
+        return cls(
+            path=candidate[MetadataKey.PATH.value],
+            distance=candidate.get(MetadataKey.DISTANCE.value),
+            score=candidate.get(MetadataKey.SCORE.value),
+            **{attribute: metadata.get(key) for attribute, key in _METADATA_KEYS.items()}
+        )
+
+    def to_dict(self, **fields) -> dict:
+        """
+        :param fields: values overriding the ones of this record, by metadata key
+        :return: candidate dictionary of this record
+        """
+        return {
+            MetadataKey.PATH.value: self.path,
+            MetadataKey.DISTANCE.value: self.distance,
+            MetadataKey.SCORE.value: self.score,
+            MetadataKey.METADATA.value: self.metadata,
+            **fields
+        }
+
+    @property
+    def metadata(self) -> dict:
+        """
+        :return: metadata dictionary of the ranking fields that are known
+        """
+        return {
+            key: getattr(self, attribute) for attribute, key in _METADATA_KEYS.items()
+            if getattr(self, attribute) is not None
+        }
+
+    def __getitem__(self, key: str):
+        if key == MetadataKey.PATH.value:
+            return self.path
+        if key == MetadataKey.DISTANCE.value:
+            return self.distance
+        if key == MetadataKey.SCORE.value:
+            return self.score
+        if key == MetadataKey.METADATA.value:
+            return self.metadata
+        raise KeyError(key)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CandidateRecord) and all(
+            getattr(self, attribute) == getattr(other, attribute) for attribute in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"CandidateRecord(path={self.path!r}, distance={self.distance})"
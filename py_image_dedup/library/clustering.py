@@ -0,0 +1,132 @@
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+LINKAGE_SINGLE = "single"
+LINKAGE_COMPLETE = "complete"
+
+
+class DisjointSet:
+    """
+    Union-find structure with path compression and union by size
+    """
+
+    def __init__(self):
+        self._parents = {}
+        self._sizes = {}
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._parents
+
+    def __iter__(self):
+        return iter(self._parents)
+
+    def add(self, item: Hashable):
+        """
+        Adds an item as its own set, if it isn't known yet
+        :param item: the item to add
+        """
+        if item not in self._parents:
+            self._parents[item] = item
+            self._sizes[item] = 1
+
+    def find(self, item: Hashable) -> Hashable:
+        """
+        :param item: a known item
+        :return: the representative of the set containing the item
+        """
+        root = item
+        while self._parents[root] != root:
+            root = self._parents[root]
+        # point all items on the way directly to the root
+        while self._parents[item] != root:
+            self._parents[item], item = root, self._parents[item]
+        return root
+
+    def size(self, item: Hashable) -> int:
+        """
+        :param item: a known item
+        :return: the number of items in the set containing the item
+        """
+        return self._sizes[self.find(item)]
+
+    def union(self, a: Hashable, b: Hashable) -> Hashable:
+        """
+        Merges the sets containing both items
+        :param a: a known item
+        :param b: a known item
+        :return: the representative of the merged set
+        """
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self._sizes[root_a] < self._sizes[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parents[root_b] = root_a
+        self._sizes[root_a] += self._sizes.pop(root_b)
+        return root_a
+
+    def sets(self) -> List[List[Hashable]]:
+        """
+        :return: all sets, each one in insertion order of its items
+        """
+        sets = {}
+        for item in self._parents:
+            sets.setdefault(self.find(item), []).append(item)
+        return list(sets.values())
+
+
+def cluster(items: Iterable[Hashable], edges: Iterable[Tuple[Hashable, Hashable, float]],
+            max_size: int = None, linkage: str = LINKAGE_SINGLE,
+            size_limited_edges: List[Tuple[Hashable, Hashable]] = None) -> List[List[Hashable]]:
+    """
+    Groups items into connected components of the given similarity edges.
+    Edges are merged in the order of ascending distance, so the result doesn't depend
+    on the order in which they were found.
+
+    :param items: all items, including those without any edges
+    :param edges: (item, item, distance) tuples, in any direction
+    :param max_size: (optional) maximum number of items per component,
+                     edges that would create bigger components are ignored
+    :param linkage: "single" merges two components if any of their items are similar,
+                    "complete" only if all of their items are similar to each other,
+                    which prevents chaining of (slightly) different images
+    :param size_limited_edges: (optional) list that the (item, item) edges which are only ignored
+                               because of max_size are appended to
+    :return: components, each one in insertion order of its items
+    """
+    if linkage not in [LINKAGE_SINGLE, LINKAGE_COMPLETE]:
+        raise ValueError(f"Unsupported linkage: {linkage}")
+
+    disjoint_set = DisjointSet()
+    for item in items:
+        disjoint_set.add(item)
+
+    neighbours: Dict[Hashable, Set[Hashable]] = {}
+    distances = {}
+    for a, b, distance in edges:
+        if a == b:
+            continue
+        disjoint_set.add(a)
+        disjoint_set.add(b)
+        key = (a, b) if str(a) <= str(b) else (b, a)
+        distances[key] = min(distance, distances.get(key, distance))
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+
+    # items of each component, by representative, to check complete linkage
+    members = {item: [item] for item in disjoint_set}
+    for (a, b), _ in sorted(distances.items(), key=lambda entry: (entry[1], str(entry[0][0]), str(entry[0][1]))):
+        root_a, root_b = disjoint_set.find(a), disjoint_set.find(b)
+        if root_a == root_b:
+            continue
+        if linkage == LINKAGE_COMPLETE and not all(
+                neighbours[member].issuperset(members[root_b]) for member in members[root_a]):
+            continue
+        if max_size is not None and disjoint_set.size(root_a) + disjoint_set.size(root_b) > max_size:
+            if size_limited_edges is not None:
+                size_limited_edges.append((a, b))
+            continue
+        root = disjoint_set.union(a, b)
+        other = root_b if root == root_a else root_a
+        members[root] += members.pop(other)
+
+    return disjoint_set.sets()
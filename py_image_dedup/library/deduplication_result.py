@@ -5,40 +5,60 @@ import click
 from tabulate import tabulate
 
 from py_image_dedup.library import ActionEnum
-from py_image_dedup.persistence import MetadataKey
+from py_image_dedup.library.candidate_record import CandidateRecord
+from py_image_dedup.library.path_table import PathTable
 from py_image_dedup.util import echo
 
 BYTE_IN_A_MB = 1048576
+# actions by their code in DeduplicationResult._actions, 0 means no action has been set
+_ACTIONS = [None, ActionEnum.NONE, ActionEnum.DELETE, ActionEnum.MOVE]
 
 
 class DeduplicationResult:
-    def __init__(self):
-        self.item_actions = {}
+    def __init__(self, paths: PathTable = None):
+        """
+        :param paths: table identifying all files of the result, which can be shared with other state of a run
+        """
+        self._paths = paths if paths is not None else PathTable()
+        # action code of each file, by id
+        self._actions = bytearray()
         self._removed_folders = set()
+        # records of the reference file and of the other files of each group, by id of the reference file
         self._reference_files = {}
         self._file_duplicates = {}
+        self._truncated_groups = {}
+
+    @property
+    def item_actions(self) -> dict:
+        """
+        :return: map of file path -> action, for all files with an action
+        """
+        return {
+            Path(self._paths.path(path_id)): _ACTIONS[code]
+            for path_id, code in enumerate(self._actions) if code > 0
+        }
 
     def add_file_action(self, file_path: Path, action: ActionEnum):
-        if file_path in self.item_actions and self.item_actions[file_path] != action:
+        path_id = self._paths.add(file_path)
+        if path_id >= len(self._actions):
+            self._actions.extend(bytes(path_id + 1 - len(self._actions)))
+        current_code = self._actions[path_id]
+        if current_code > 0 and _ACTIONS[current_code] != action:
             raise ValueError("File path already in result "
                              "but with different action: {}, {}, {}".format(file_path,
-                                                                            self.item_actions[file_path],
+                                                                            _ACTIONS[current_code],
                                                                             action))
-        self.item_actions[file_path] = action
+        self._actions[path_id] = _ACTIONS.index(action)
 
     def get_file_with_action(self, action: ActionEnum) -> []:
-        return list({k: v for k, v in self.item_actions.items() if v == action}.keys())
+        code = _ACTIONS.index(action)
+        return [Path(self._paths.path(path_id)) for path_id, c in enumerate(self._actions) if c == code]
 
     def get_duplicate_count(self) -> int:
         """
         :return: amount of files that have at least one duplicate
         """
-        count = 0
-        for key, value in self._file_duplicates.items():
-            if len(value) > 0:
-                count += 1
-
-        return count
+        return sum(1 for duplicates in self._file_duplicates.values() if len(duplicates) > 0)
 
     def get_removed_or_moved_files(self):
         return self.get_file_with_action(ActionEnum.MOVE) + self.get_file_with_action(ActionEnum.DELETE)
@@ -62,16 +82,49 @@ class DeduplicationResult:
         :param reference_files: the file that is used as a baseline
         :param duplicate_files: duplicates of the reference_file
         """
-        reference_file = reference_files[0]
-        reference_file_path = Path(reference_file[MetadataKey.PATH.value])
-        self._reference_files[reference_file_path] = reference_file
-        self._file_duplicates[reference_file_path] = reference_files[1:] + duplicate_files
+        # only the fields needed for the summary are kept
+        reference_file = CandidateRecord.of(reference_files[0])
+        reference_id = self._paths.add(reference_file.path)
+        self._reference_files[reference_id] = reference_file
+        self._file_duplicates[reference_id] = [CandidateRecord.of(f) for f in reference_files[1:] + duplicate_files]
 
     def get_file_duplicates(self) -> {}:
         """
         Get a list of files that are duplicates of other files
+        :return: map of reference file path -> candidate dictionaries of its duplicates.
+                 Only the metadata needed to rank the candidates is kept (not f.ex. the exif data).
+        """
+        return {
+            reference_file_path: [record.to_dict() for record in records]
+            for reference_file_path, records in self.get_duplicate_records().items()
+        }
+
+    def get_duplicate_records(self) -> {}:
+        """
+        Like get_file_duplicates, without creating a dictionary for every candidate
+        :return: map of reference file path -> candidate records of its duplicates
         """
-        return self._file_duplicates
+        return {
+            Path(self._paths.path(reference_id)): records
+            for reference_id, records in self._file_duplicates.items()
+        }
+
+    def add_truncated_group(self, reference_file_path: Path, dropped_file_count: int or None):
+        """
+        Remembers a group of duplicates that exceeded the maximum group size
+        :param reference_file_path: the reference file of the group
+        :param dropped_file_count: number of similar files that have been left out of the group.
+                                   Backends limiting the number of similar files of a query only report a part of them.
+                                   None if the similarity query of the reference file has been cut off by the backend,
+                                   so the number is unknown.
+        """
+        self._truncated_groups[reference_file_path] = dropped_file_count
+
+    def get_truncated_groups(self) -> {}:
+        """
+        :return: map of reference file path -> number of similar files left out, for all truncated groups
+        """
+        return self._truncated_groups
 
     def print_to_console(self):
         title = "" * 7 + "Summary"
@@ -80,24 +133,29 @@ class DeduplicationResult:
         echo(f"Files with duplicates: {self.get_duplicate_count()}")
         echo(f"Files moved: {len(self.get_file_with_action(ActionEnum.MOVE))}")
         echo(f"Files deleted: {len(self.get_file_with_action(ActionEnum.DELETE))}")
+        if len(self._truncated_groups) > 0:
+            echo(f"Truncated groups: {len(self._truncated_groups)}", color='yellow')
+            for reference_file_path, dropped_file_count in self._truncated_groups.items():
+                if dropped_file_count is None:
+                    echo(f"  '{reference_file_path}' (query cut off, similar files might be left out)", color='yellow')
+                else:
+                    echo(f"  '{reference_file_path}' ({dropped_file_count} similar files left out)", color='yellow')
 
         headers = ("Action", "File path", "Dist", "Filesize", "Pixels")
 
-        for reference_file_path, folder in self.get_file_duplicates().items():
+        for reference_id, folder in self._file_duplicates.items():
             duplicate_count = len(folder)
             if duplicate_count > 0:
                 columns = []
                 echo()
 
-                for item in [self._reference_files[reference_file_path]] + folder:
-                    file_path = Path(item[MetadataKey.PATH.value])
-                    distance = item[MetadataKey.DISTANCE.value]
-                    distance_rounded = round(distance, 3)
-                    file_size = item[MetadataKey.METADATA.value][MetadataKey.FILE_SIZE.value]
-                    file_size_mb = round(file_size / BYTE_IN_A_MB, 3)
-                    pixel_count = item[MetadataKey.METADATA.value][MetadataKey.PIXELCOUNT.value]
+                for item in [self._reference_files[reference_id]] + folder:
+                    file_path = Path(item.path)
+                    distance_rounded = round(item.distance, 3)
+                    file_size_mb = round(item.file_size / BYTE_IN_A_MB, 3)
+                    pixel_count = item.pixel_count
 
-                    action = self.item_actions.get(file_path, ActionEnum.NONE)
+                    action = self._get_action(item.path)
                     row = [
                         action.name,
                         file_path,
@@ -118,6 +176,16 @@ class DeduplicationResult:
         for folder in self.get_removed_empty_folders():
             echo(f"{folder}", color='red')
 
+    def _get_action(self, file_path: str) -> ActionEnum:
+        """
+        :param file_path: a file of the result
+        :return: the action of the file
+        """
+        path_id = self._paths.get(file_path)
+        if path_id is None or path_id >= len(self._actions) or self._actions[path_id] == 0:
+            return ActionEnum.NONE
+        return _ACTIONS[self._actions[path_id]]
+
     @staticmethod
     def _echo_table(table: str):
         lines = table.splitlines()
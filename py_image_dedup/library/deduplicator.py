@@ -1,40 +1,63 @@
 import datetime
 import filecmp
+import heapq
 import logging
 import os
+import queue
 import shutil
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Iterator
 
 import click
 from ordered_set import OrderedSet
+from tabulate import tabulate
 
 from py_image_dedup import util
-from py_image_dedup.config import DeduplicatorConfig
+from py_image_dedup.config import DeduplicatorConfig, BACKEND_TYPE_SQLITE, BACKEND_TYPE_MEMORY, \
+    INDEX_TYPE_NONE, INDEX_TYPE_HNSW, STRATEGY_CLUSTERING, STRATEGY_JOIN
 from py_image_dedup.library import ActionEnum
+from py_image_dedup.library.candidate_record import CandidateRecord
+from py_image_dedup.library.clustering import cluster
+from py_image_dedup.library.similarity_join import read_entries, similarity_join, ENTRY_FIELDS
 from py_image_dedup.library.deduplication_result import DeduplicationResult
+from py_image_dedup.library.duplicate_group import DuplicateGroup
+from py_image_dedup.library.prioritization import Prioritization
+from py_image_dedup.library.path_table import PathTable, PathSet
 from py_image_dedup.library.progress_manager import ProgressManager
 from py_image_dedup.persistence import ImageSignatureStore
 from py_image_dedup.persistence.elasticsearchstorebackend import ElasticSearchStoreBackend
 from py_image_dedup.persistence.metadata_key import MetadataKey
 from py_image_dedup.stats import DUPLICATE_ACTION_MOVE_COUNT, DUPLICATE_ACTION_DELETE_COUNT, ANALYSIS_TIME, \
     FIND_DUPLICATES_TIME
-from py_image_dedup.util import file, echo
+from py_image_dedup.util import echo
 from py_image_dedup.util.file import get_files_count, file_has_extension
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
 
+class _GroupIterationClosed(Exception):
+    """
+    Raised in the thread finding duplicates when the consumer of iter_duplicate_groups stopped iterating
+    """
+
+
 class ImageMatchDeduplicator:
     EXECUTOR = ThreadPoolExecutor()
+    # maximum number of groups found ahead of the consumer of iter_duplicate_groups
+    GROUP_QUEUE_SIZE = 64
+    # number of groups to store at once while iterating groups
+    CLUSTER_BATCH_SIZE = 1000
 
     _config: DeduplicatorConfig
     _progress_manager: ProgressManager
 
-    _processed_files: dict = {}
     _deduplication_result: DeduplicationResult = None
 
     def __init__(self, interactive: bool):
@@ -43,22 +66,105 @@ class ImageMatchDeduplicator:
         :param interactive: whether cli output should be interactive or not
         """
         self.interactive = interactive
+        # files that already are part of a duplicate group (or known to be unique), only
+        # written by the thread selecting duplicates, so query threads can read it without locking
+        self._processed_files = PathSet()
+        # when set, final groups of duplicates are passed to this function instead of being collected in the result
+        self._group_sink = None
 
         self._progress_manager = ProgressManager()
         self._config = DeduplicatorConfig()
-        self._persistence: ImageSignatureStore = ElasticSearchStoreBackend(
+        self._prioritization = Prioritization(self._config.PRIORITIZATION_RULES.value)
+        self._persistence: ImageSignatureStore = self._create_persistence()
+
+    def _create_persistence(self) -> ImageSignatureStore:
+        """
+        :return: the persistence backend selected by the configuration
+        """
+        if self._config.BACKEND.value == BACKEND_TYPE_SQLITE:
+            from py_image_dedup.persistence.sqlitestorebackend import SQLiteStoreBackend
+            return SQLiteStoreBackend(
+                file_path=self._config.SQLITE_FILE.value,
+                use_exif_data=self._config.ANALYSIS_USE_EXIF_DATA.value,
+                max_dist=self._config.ELASTICSEARCH_MAX_DISTANCE.value,
+                min_should_match=self._config.ELASTICSEARCH_MIN_SHOULD_MATCH.value,
+                max_candidates=self._config.SQLITE_MAX_CANDIDATES.value,
+            )
+        if self._config.BACKEND.value == BACKEND_TYPE_MEMORY:
+            from py_image_dedup.persistence.memorystorebackend import MemoryStoreBackend
+            index_options = None
+            if self._config.MEMORY_INDEX.value == INDEX_TYPE_HNSW:
+                index_options = {
+                    "m": self._config.MEMORY_HNSW_M.value,
+                    "ef_construction": self._config.MEMORY_HNSW_EF_CONSTRUCTION.value,
+                    "ef": self._config.MEMORY_HNSW_EF.value,
+                }
+            return MemoryStoreBackend(
+                directory=self._config.MEMORY_DIRECTORY.value,
+                use_exif_data=self._config.ANALYSIS_USE_EXIF_DATA.value,
+                max_dist=self._config.ELASTICSEARCH_MAX_DISTANCE.value,
+                index=None if self._config.MEMORY_INDEX.value == INDEX_TYPE_NONE else self._config.MEMORY_INDEX.value,
+                index_options=index_options,
+                dhash_max_distance=self._config.MEMORY_DHASH_MAX_DISTANCE.value,
+                cluster_margin=self._config.MEMORY_CLUSTER_MARGIN.value,
+            )
+
+        write_behind_spill_file = None
+        if self._config.ELASTICSEARCH_WRITE_BEHIND_ENABLED.value:
+            write_behind_spill_file = self._config.ELASTICSEARCH_WRITE_BEHIND_SPILL_FILE.value
+            if write_behind_spill_file is None:
+                write_behind_spill_file = Path(
+                    tempfile.gettempdir(), f"py-image-dedup-{self._config.ELASTICSEARCH_INDEX.value}.spill")
+
+        max_group_size = self._config.DEDUPLICATION_MAX_GROUP_SIZE.value
+        backend_args = dict(
             host=self._config.ELASTICSEARCH_HOST.value,
             port=self._config.ELASTICSEARCH_PORT.value,
             connections_per_node=self._config.ANALYSIS_THREADS.value,
             el_index=self._config.ELASTICSEARCH_INDEX.value,
             use_exif_data=self._config.ANALYSIS_USE_EXIF_DATA.value,
             max_dist=self._config.ELASTICSEARCH_MAX_DISTANCE.value,
-            setup_database=self._config.ELASTICSEARCH_AUTO_CREATE_INDEX.value
+            min_should_match=self._config.ELASTICSEARCH_MIN_SHOULD_MATCH.value,
+            hot_word_threshold=self._config.ELASTICSEARCH_HOT_WORD_THRESHOLD.value,
+            namespace=self._config.ELASTICSEARCH_NAMESPACE.value,
+            canonical_orientation=self._config.ELASTICSEARCH_CANONICAL_ORIENTATION.value,
+            setup_database=self._config.ELASTICSEARCH_AUTO_CREATE_INDEX.value,
+            write_behind_spill_file=write_behind_spill_file,
+            write_behind_memory_limit=self._config.ELASTICSEARCH_WRITE_BEHIND_MEMORY_LIMIT.value,
+            # one more than the group size limit, so truncated groups can still be detected and reported
+            max_results=None if max_group_size is None else max_group_size + 1,
+            max_pages=self._config.ELASTICSEARCH_MAX_PAGES.value,
         )
 
+        if self._config.ELASTICSEARCH_ASYNC.value:
+            from py_image_dedup.persistence.asyncelasticsearchstorebackend import AsyncElasticSearchStoreBackend
+            return AsyncElasticSearchStoreBackend(
+                max_concurrent_requests=self._config.ELASTICSEARCH_MAX_CONCURRENT_REQUESTS.value,
+                **backend_args
+            )
+
+        return ElasticSearchStoreBackend(**backend_args)
+
+    def close(self):
+        """
+        Persists all pending changes and closes the connections of the persistence.
+        The deduplicator can't be used anymore afterwards.
+        """
+        self._persistence.close()
+
+    def __enter__(self) -> 'ImageMatchDeduplicator':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def reset_result(self):
-        self._deduplication_result = DeduplicationResult()
-        self._processed_files = {}
+        # all state of a run identifies files by their id in the same table
+        paths = PathTable()
+        self._deduplication_result = DeduplicationResult(paths)
+        self._processed_files = PathSet(paths)
+        # queries of earlier runs don't belong to this result
+        self._persistence.pop_truncated_queries()
 
     def analyse_all(self):
         """
@@ -72,10 +178,14 @@ class ImageMatchDeduplicator:
         echo("Phase 2/2: Analyzing files ...", color='cyan')
         self.analyze_directories(directory_map)
 
-    def deduplicate_all(self, skip_analyze_phase: bool = False) -> DeduplicationResult:
+    def deduplicate_all(self, skip_analyze_phase: bool = False, incremental: bool = False,
+                        streaming: bool = False) -> DeduplicationResult:
         """
         Runs the full 6 deduplication phases.
         :param skip_analyze_phase: useful if you already did a dry run and want to do a real run afterwards
+        :param incremental: only find duplicates of files that have been (re)analysed in this run,
+                            or in the latest analysis if skip_analyze_phase is set
+        :param streaming: analyze files and find their duplicates in a single pass (phase 3 and 4 at once)
         :return: result of the operation
         """
         # see: https://stackoverflow.com/questions/14861891/runtimewarning-invalid-value-encountered-in-divide
@@ -86,6 +196,8 @@ class ImageMatchDeduplicator:
         directories = self._config.SOURCE_DIRECTORIES.value
         if len(directories) <= 0:
             raise ValueError("No root directories to scan")
+        if streaming and (skip_analyze_phase or incremental):
+            raise ValueError("Streaming can't be combined with skipping the analysis phase or incremental runs")
 
         if self._config.DRY_RUN.value:
             echo("==> DRY RUN! No files or folders will actually be deleted! <==", color='yellow')
@@ -96,15 +208,23 @@ class ImageMatchDeduplicator:
         echo("Phase 2/6: Counting files ...", color='cyan')
         directory_map = self._count_files(directories)
 
-        phase_3_text = "Phase 3/6: Analyzing files"
-        if skip_analyze_phase:
-            echo(phase_3_text + " - Skipping", color='yellow')
+        if streaming:
+            echo("Phase 3+4/6: Analyzing files and finding duplicates ...", color='cyan')
+            self.analyze_and_find_duplicates_in_directories(directory_map)
         else:
-            echo(phase_3_text, color='cyan')
-            self.analyze_directories(directory_map)
+            phase_3_text = "Phase 3/6: Analyzing files"
+            if skip_analyze_phase:
+                echo(phase_3_text + " - Skipping", color='yellow')
+            else:
+                echo(phase_3_text, color='cyan')
+                self.analyze_directories(directory_map)
 
-        echo("Phase 4/6: Finding duplicate files ...", color='cyan')
-        self.find_duplicates_in_directories(directory_map)
+            echo("Phase 4/6: Finding duplicate files ...", color='cyan')
+            changed_files = None
+            if incremental:
+                generation = None if skip_analyze_phase else self._persistence.generation
+                changed_files = self._get_changed_files(directory_map, generation)
+            self.find_duplicates_in_directories(directory_map, changed_files)
 
         # Phase 5/6: Move or Delete duplicate files
         self.process_duplicates()
@@ -118,6 +238,8 @@ class ImageMatchDeduplicator:
         Analyzes all files, generates identifiers (if necessary) and stores them for later access
         """
         threads = self._config.ANALYSIS_THREADS.value
+        # new or changed files are stamped with the start time of this analysis
+        self._persistence.generation = time.time_ns() // 1000000
 
         # load truncated images too
         # TODO: this causes an infinite loop on some (truncated) images
@@ -129,29 +251,479 @@ class ImageMatchDeduplicator:
                 root_directory=directory,
                 threads=threads,
                 command=lambda root_dir, file_dir, file_path: self.analyze_file(file_path))
+            self._persistence.flush()
             self._progress_manager.clear()
 
-    def find_duplicates_in_directories(self, directory_map: dict):
+    def analyze_and_find_duplicates_in_directories(self, directory_map: dict):
+        """
+        Analyzes all files and finds their duplicates in a single pass: each batch of files is queried
+        right after it has been analysed, while the next batches are analysed already.
+        Every file claims all pairs with files that have been claimed before it, so each pair is
+        seen exactly once, independent of the order of the files. The groups of duplicates are
+        the same as with the clustering strategy.
+        :param directory_map: map of directory path -> file count
+        """
+        self.reset_result()
+
+        batch_size = self._config.DEDUPLICATION_BATCH_SIZE.value
+        analysis_threads = self._config.ANALYSIS_THREADS.value
+        query_threads = self._config.DEDUPLICATION_THREADS.value
+        root_directories = self._config.SOURCE_DIRECTORIES.value
+        # new or changed files are stamped with the start time of this analysis
+        self._persistence.generation = time.time_ns() // 1000000
+
+        # claim number (id) of each file, in the order in which the files became visible to queries
+        claims = PathTable()
+        # any record of each file, for the metadata used to rank duplicates
+        records = {}
+        edges = []
+
+        def query(root_directory: Path, batch: List[Path]):
+            return root_directory, batch, self._persistence.find_similar_batch(list(map(str, batch)))
+
+        def collect(query_future):
+            root_directory, batch, similar_files = query_future.result()
+            for reference_file_path in map(str, batch):
+                claim = claims.get(reference_file_path)
+                duplicate_candidates = self._filter_candidates(
+                    root_directories, root_directory, similar_files[reference_file_path])
+                for candidate in duplicate_candidates:
+                    candidate_path = candidate[MetadataKey.PATH.value]
+                    if candidate_path not in records:
+                        records[candidate_path] = CandidateRecord.of(candidate)
+                    # files that haven't been claimed yet will find this pair themselves
+                    candidate_claim = claims.get(candidate_path)
+                    if candidate_claim is None or candidate_claim >= claim:
+                        continue
+                    edges.append((reference_file_path, candidate_path, candidate[MetadataKey.DISTANCE.value]))
+                    echo(f"Found duplicate: '{reference_file_path}' ~ '{candidate_path}'")
+
+        def claim_and_query(root_directory: Path, batch: List[Path], analysis_futures: list):
+            for future in analysis_futures:
+                future.result()
+            # the whole batch has to be visible to queries before it can be claimed
+            self._persistence.refresh()
+            for file_path in batch:
+                claims.add(file_path)
+            pending_queries.append(query_executor.submit(util.reraise_with_stack(query), root_directory, batch))
+            while len(pending_queries) > query_threads or (len(pending_queries) > 0 and pending_queries[0].done()):
+                collect(pending_queries.popleft())
+
+        with ThreadPoolExecutor(max_workers=analysis_threads,
+                                thread_name_prefix="py-image-dedup-walker") as analysis_executor, \
+                ThreadPoolExecutor(max_workers=query_threads,
+                                   thread_name_prefix="py-image-dedup-finder") as query_executor:
+            pending_analyses = deque()
+            pending_queries = deque()
+            for directory, file_count in directory_map.items():
+                self._progress_manager.start(f"Analyzing and finding duplicates in '{directory}'", file_count,
+                                             "Files", self.interactive)
+                for batch in self._iter_batches(self._iter_directory_files(directory), batch_size):
+                    pending_analyses.append((directory, batch, [
+                        analysis_executor.submit(util.reraise_with_stack(self.analyze_file), file_path)
+                        for file_path in batch
+                    ]))
+                    # the next batch is analysed while the previous one is queried
+                    if len(pending_analyses) > 1:
+                        claim_and_query(*pending_analyses.popleft())
+                while len(pending_analyses) > 0:
+                    claim_and_query(*pending_analyses.popleft())
+                while len(pending_queries) > 0:
+                    collect(pending_queries.popleft())
+                self._progress_manager.clear()
+
+        self._select_duplicates_of_clusters(list(claims), records, edges)
+        self._report_truncated_queries()
+        if self._stores_clusters():
+            self._save_clusters(self._result_clusters())
+
+    def _get_changed_files(self, directory_map: dict, generation: int = None) -> Dict[Path, List[Path]]:
+        """
+        :param directory_map: map of directory path -> file count
+        :param generation: minimum generation, the latest generation of the persistence if None
+        :return: map of directory path -> files in it that have been (re)analysed in the given generation or later
+        """
+        changed_files = {directory: [] for directory in directory_map.keys()}
+        for file_path in map(Path, self._persistence.get_paths_of_generation(generation)):
+            for directory in directory_map.keys():
+                if directory in file_path.parents:
+                    changed_files[directory].append(file_path)
+                    break
+        echo(f"{sum(map(len, changed_files.values()))} new or changed files")
+        return changed_files
+
+    def find_duplicates_in_directories(self, directory_map: dict, changed_files: Dict[Path, List[Path]] = None):
         """
         Finds duplicates in the given directories
         :param directory_map: map of directory path -> file count
+        :param changed_files: (optional) map of directory path -> files to find duplicates of,
+                              files that didn't change have already been deduplicated in an earlier run
         """
         self.reset_result()
 
+        def directory_files(directory: Path):
+            if changed_files is None:
+                return self._iter_directory_files(directory)
+            return [(file_path.parent, file_path) for file_path in changed_files[directory]]
+
+        if changed_files is not None:
+            directory_map = {directory: len(changed_files[directory]) for directory in directory_map.keys()}
+
+        batch_size = self._config.DEDUPLICATION_BATCH_SIZE.value
+        threads = self._config.DEDUPLICATION_THREADS.value
+        root_directories = self._config.SOURCE_DIRECTORIES.value
+
+        if self._config.DEDUPLICATION_STRATEGY.value == STRATEGY_CLUSTERING:
+            self._find_duplicate_clusters(root_directories, directory_map, directory_files, batch_size, threads)
+        elif self._config.DEDUPLICATION_STRATEGY.value == STRATEGY_JOIN:
+            changed_file_paths = None
+            if changed_files is not None:
+                changed_file_paths = {str(file_path) for files in changed_files.values() for file_path in files}
+            self._find_duplicates_by_join(root_directories, changed_file_paths)
+        else:
+            for directory, file_count in directory_map.items():
+                self._progress_manager.start(f"Finding duplicates in '{directory}' ...", file_count, "Files",
+                                             self.interactive)
+                batches = self._iter_batches(directory_files(directory), batch_size)
+                if threads <= 1:
+                    for batch in batches:
+                        self.find_duplicates_of_files(root_directories, directory, batch)
+                else:
+                    self._find_duplicates_of_batches_parallel(root_directories, directory, batches, threads)
+                self._progress_manager.clear()
+
+        self._report_truncated_queries()
+        if self._stores_clusters():
+            self._save_clusters(self._result_clusters())
+
+    def iter_duplicate_groups(self, directory_map: dict = None,
+                              changed_files: Dict[Path, List[Path]] = None) -> Iterator[DuplicateGroup]:
+        """
+        Finds duplicates like find_duplicates_in_directories, but yields each group as soon as it is final,
+        instead of collecting all groups (and the metadata of their files) in the result.
+        With the reference strategy, groups are final as soon as they have been selected,
+        the other strategies group all files at once. Files have to be analysed already
+        and nothing is moved or deleted, this is up to the caller.
+        :param directory_map: map of directory path -> file count, all source directories if unset
+        :param changed_files: see find_duplicates_in_directories
+        :return: generator of groups of duplicates
+        """
+        if directory_map is None:
+            directory_map = self._count_files(self._config.SOURCE_DIRECTORIES.value)
+
+        groups = queue.Queue(maxsize=self.GROUP_QUEUE_SIZE)
+        closed = threading.Event()
+        stores_clusters = self._stores_clusters()
+        clusters = {}
+
+        def put(item):
+            # waits for the consumer, unless it stopped iterating
+            while not closed.is_set():
+                try:
+                    groups.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise _GroupIterationClosed()
+
+        def sink(group: DuplicateGroup):
+            if stores_clusters:
+                clusters[str(group.reference)] = [
+                    str(file_path) for file_path in group.files_to_keep[1:] + group.duplicates
+                ]
+                if len(clusters) >= self.CLUSTER_BATCH_SIZE:
+                    self._save_clusters(clusters)
+                    clusters.clear()
+            put(group)
+
+        def find():
+            try:
+                self.find_duplicates_in_directories(directory_map, changed_files)
+                self._save_clusters(clusters)
+                put(None)
+            except _GroupIterationClosed:
+                self._progress_manager.clear()
+            except Exception as e:
+                try:
+                    put(e)
+                except _GroupIterationClosed:
+                    pass
+
+        self._group_sink = sink
+        thread = threading.Thread(target=find, name="py-image-dedup-groups", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = groups.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            closed.set()
+            thread.join()
+            self._group_sink = None
+
+    def _result_clusters(self) -> Dict[str, List[str]]:
+        """
+        :return: map of reference path -> paths of its duplicates, for all groups of the result
+        """
+        return {
+            str(reference_file_path): [duplicate.path for duplicate in duplicates]
+            for reference_file_path, duplicates in self._deduplication_result.get_duplicate_records().items()
+            if len(duplicates) > 0
+        }
+
+    def _stores_clusters(self) -> bool:
+        """
+        :return: True if groups of duplicates are stored, which is only the case if the persistence
+                 makes use of them and the run isn't a dry run (whose groups might change)
+        """
+        return not self._config.DRY_RUN.value and self._persistence.uses_clusters()
+
+    def _save_clusters(self, clusters: Dict[str, List[str]]):
+        """
+        Stores the groups of duplicates that have been found, with the copy to keep as their representative
+        :param clusters: map of representative path -> paths of the other files of its group
+        """
+        if len(clusters) <= 0:
+            return
+        try:
+            self._persistence.set_clusters(clusters)
+        except Exception as e:
+            logging.exception(e)
+            echo(f"Error saving groups of duplicates: {e}", color='red')
+
+    def _find_duplicate_clusters(self, root_directories: List[Path], directory_map: dict, directory_files,
+                                 batch_size: int, threads: int):
+        """
+        Queries every file exactly once, groups all files that are connected by similarity
+        and selects the duplicates of each group. Unlike find_duplicates_of_file, the groups
+        don't depend on the order in which files are visited.
+        :param root_directories: valid root directories
+        :param directory_map: map of directory path -> file count
+        :param directory_files: function returning the (containing directory, file path) tuples
+                                of the files to query in a directory
+        :param batch_size: number of files to query at once
+        :param threads: number of batches to query at once
+        """
+        file_paths = []
+        # any record of each file, for the metadata used to rank duplicates
+        records = {}
+        edges = []
         for directory, file_count in directory_map.items():
             self._progress_manager.start(f"Finding duplicates in '{directory}' ...", file_count, "Files",
                                          self.interactive)
-            self.__walk_directory_files(
-                root_directory=directory,
-                threads=1,  # there seems to be no performance advantage in using multiple threads here
-                command=lambda root_dir, _, file_path: self.find_duplicates_of_file(
-                    root_directories=self._config.SOURCE_DIRECTORIES.value,
-                    root_directory=root_dir,
-                    reference_file_path=file_path
-                )
-            )
+            batches = self._iter_batches(directory_files(directory), batch_size)
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="py-image-dedup-finder") as executor:
+                queries = executor.map(
+                    lambda batch: (batch, self._persistence.find_similar_batch(list(map(str, batch)))), batches)
+                for batch, similar_files in queries:
+                    for reference_file_path in batch:
+                        self._progress_manager.inc()
+                        self._progress_manager.set_postfix(self._truncate_middle(reference_file_path))
+                        file_paths.append(str(reference_file_path))
+
+                        duplicate_candidates = self._filter_candidates(
+                            root_directories, directory, similar_files[str(reference_file_path)])
+                        if len(duplicate_candidates) <= 0:
+                            echo(f"No duplication candidates found in database for '{reference_file_path}'. "
+                                 "This is an indication that the file has not been analysed yet or "
+                                 "there was an issue analysing it.",
+                                 color='yellow')
+                        for candidate in duplicate_candidates:
+                            candidate_path = candidate[MetadataKey.PATH.value]
+                            if candidate_path not in records:
+                                records[candidate_path] = CandidateRecord.of(candidate)
+                            edges.append((str(reference_file_path), candidate_path,
+                                          candidate[MetadataKey.DISTANCE.value]))
             self._progress_manager.clear()
 
+        self._select_duplicates_of_clusters(file_paths, records, edges)
+
+    def _find_duplicates_by_join(self, root_directories: List[Path], changed_file_paths: set = None):
+        """
+        Reads all entries of the persistence at once and finds all pairs of similar files locally,
+        instead of querying the persistence for every single file.
+        The resulting groups are the same as with _find_duplicate_clusters.
+        :param root_directories: valid root directories
+        :param changed_file_paths: (optional) only pairs including one of these files are considered
+        """
+        count, entries = self._persistence.get_all(fields=ENTRY_FIELDS)
+        self._progress_manager.start("Reading signatures ...", count, "Entries", self.interactive)
+
+        def counted(items):
+            for item in items:
+                self._progress_manager.inc()
+                yield item
+
+        records, signatures = read_entries(counted(entries))
+        self._progress_manager.clear()
+
+        echo(f"Joining {len(records)} signatures ...")
+        pairs, distances, _ = similarity_join(
+            signatures,
+            max_dist=self._config.ELASTICSEARCH_MAX_DISTANCE.value,
+            min_should_match=self._config.ELASTICSEARCH_MIN_SHOULD_MATCH.value,
+            max_bucket_size=self._config.DEDUPLICATION_JOIN_MAX_BUCKET_SIZE.value,
+            processes=self._config.DEDUPLICATION_JOIN_PROCESSES.value,
+        )
+
+        # the persistence might hold entries of other paths, which are not interesting to us
+        record_root_directories = [
+            next((root_dir for root_dir in root_directories
+                  if root_dir in Path(record[MetadataKey.PATH.value]).parents), None)
+            for record in records
+        ]
+        across_root_directories = self._config.SEARCH_ACROSS_ROOT_DIRS.value
+
+        edges = []
+        for (a, b), distance in zip(pairs.tolist(), distances.tolist()):
+            root_a, root_b = record_root_directories[a], record_root_directories[b]
+            if root_a is None or root_b is None or (not across_root_directories and root_a != root_b):
+                continue
+            if changed_file_paths is not None and records[a][MetadataKey.PATH.value] not in changed_file_paths \
+                    and records[b][MetadataKey.PATH.value] not in changed_file_paths:
+                continue
+            edges.append((records[a][MetadataKey.PATH.value], records[b][MetadataKey.PATH.value], distance))
+
+        file_paths = [
+            record[MetadataKey.PATH.value]
+            for record, root_dir in zip(records, record_root_directories) if root_dir is not None
+        ]
+        # without a query, there is no query score: use the same one as the memory backend
+        records_by_path = {}
+        for record in records:
+            record = CandidateRecord.of(record)
+            record.score = 1.0
+            records_by_path[record.path] = record
+        # the complete entries aren't needed anymore
+        del records
+        for a, b, distance in edges:
+            for file_path in [a, b]:
+                record = records_by_path[file_path]
+                record.score = min(record.score, 1.0 - distance)
+        self._select_duplicates_of_clusters(file_paths, records_by_path, edges)
+
+    def _select_duplicates_of_clusters(self, file_paths: List[str], records: Dict[str, CandidateRecord],
+                                       edges: list):
+        """
+        Groups all files that are connected by similarity and selects the duplicates of each group
+        :param file_paths: all files to group
+        :param records: a record (path, metadata and score) of each file
+        :param edges: (file path, file path, distance) tuples of similar files
+        """
+        max_group_size = self._config.DEDUPLICATION_MAX_GROUP_SIZE.value
+        size_limited_edges = []
+        components = cluster(file_paths, edges,
+                             max_size=max_group_size,
+                             linkage=self._config.DEDUPLICATION_LINKAGE.value,
+                             size_limited_edges=size_limited_edges)
+        component_indices = {file_path: i for i, component in enumerate(components) for file_path in component}
+
+        # distance of each file to its most similar file in the same group
+        distances = {}
+        for a, b, distance in edges:
+            if a != b and component_indices[a] == component_indices[b]:
+                for file_path in [a, b]:
+                    distances[file_path] = min(distance, distances.get(file_path, distance))
+
+        # similar files outside of each group, which are only left out because of the group size limit
+        outside_files = {}
+        for a, b in size_limited_edges:
+            if component_indices[a] != component_indices[b]:
+                outside_files.setdefault(component_indices[a], set()).add(b)
+                outside_files.setdefault(component_indices[b], set()).add(a)
+
+        for i, component in enumerate(components):
+            duplicate_candidates = [
+                records[file_path].to_dict(**{MetadataKey.DISTANCE.value: distances[file_path]})
+                for file_path in component if file_path in records and file_path in distances
+            ]
+            if len(duplicate_candidates) <= 1:
+                continue
+            candidates_to_keep, candidates_to_delete = self._select_images_to_delete(duplicate_candidates)
+            self._save_duplicates_for_result(candidates_to_keep, candidates_to_delete)
+
+            if i in outside_files:
+                reference_file_path = candidates_to_keep[0][MetadataKey.PATH.value]
+                echo(f"The group of '{reference_file_path}' has more than {max_group_size} similar files, "
+                     f"only {len(component)} of them are used", color='yellow')
+                self._deduplication_result.add_truncated_group(Path(reference_file_path), len(outside_files[i]))
+
+    @staticmethod
+    def _iter_batches(directory_files, batch_size: int):
+        """
+        :param directory_files: generator of (containing directory, file path) tuples
+        :param batch_size: maximum number of files per batch
+        :return: generator of lists of file paths
+        """
+        batch = []
+        for _, file_path in directory_files:
+            batch.append(file_path)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _find_duplicates_of_batches_parallel(self, root_directories: List[Path], root_directory: Path,
+                                             batches, threads: int):
+        """
+        Queries the persistence for multiple batches at once, while duplicates are selected
+        on the calling thread, one batch after another and in order. Since the queries don't change
+        anything, the result is the same as when processing one batch after another.
+        :param root_directories: valid root directories
+        :param root_directory: root directory of all files
+        :param batches: generator of lists of file paths
+        :param threads: maximum number of batches to query at once
+        """
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="py-image-dedup-finder") as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(
+                    util.reraise_with_stack(self._query_similar_files), root_directories, root_directory, batch)))
+                # keep one batch queued per thread, so no thread waits for the next one
+                if len(pending) > threads:
+                    self._select_duplicates_of_batch(root_directories, root_directory, *pending.popleft())
+            while len(pending) > 0:
+                self._select_duplicates_of_batch(root_directories, root_directory, *pending.popleft())
+
+    def _select_duplicates_of_batch(self, root_directories: List[Path], root_directory: Path,
+                                    batch: List[Path], similar_files_future):
+        """
+        :param root_directories: valid root directories
+        :param root_directory: root directory of all files
+        :param batch: the files to check for duplicates
+        :param similar_files_future: future of the similar files, by reference file path
+        """
+        similar_files = similar_files_future.result()
+        for reference_file_path in batch:
+            self.find_duplicates_of_file(root_directories, root_directory, reference_file_path, similar_files)
+
+    def _query_similar_files(self, root_directories: List[Path], root_directory: Path,
+                             reference_file_paths: List[Path]) -> Dict[str, list]:
+        """
+        Queries the similar files of all given files and of the best candidate of each of them,
+        which is used as the reference when selecting duplicates.
+        :param root_directories: valid root directories
+        :param root_directory: root directory of all reference_file_paths
+        :param reference_file_paths: the files to check for duplicates
+        :return: similar files, by reference file path
+        """
+        unprocessed_file_paths = [str(path) for path in reference_file_paths if path not in self._processed_files]
+        similar_files = self._persistence.find_similar_batch(unprocessed_file_paths)
+
+        best_candidate_paths = set()
+        for file_path in unprocessed_file_paths:
+            candidates = self._filter_candidates(root_directories, root_directory, similar_files[file_path])
+            if len(candidates) > 1:
+                best_candidate_paths.add(self._best_candidate(candidates)[MetadataKey.PATH.value])
+        best_candidate_paths -= similar_files.keys()
+        similar_files.update(self._persistence.find_similar_batch(sorted(best_candidate_paths)))
+        return similar_files
+
     def cleanup_database(self, directories: List[Path]):
         """
         Removes database entries of files that don't exist on disk.
@@ -160,8 +732,8 @@ class ImageMatchDeduplicator:
         might have been added on other machines.
         :param directories: directories in this run
         """
-        # TODO: This iterates through all db entries - even the ones we are ignoring.
-        # The db query should be improved to speed this up
+        # NOTE: Only entries of the configured namespace are returned, without a namespace
+        # this iterates through all db entries - even the ones we are ignoring.
 
         count, entries = self._persistence.get_all()
         if count <= 0:
@@ -210,6 +782,84 @@ class ImageMatchDeduplicator:
                 self._progress_manager.inc()
         self._progress_manager.clear()
 
+    def export_database(self, file_path: Path, chunk_size: int):
+        """
+        Exports all database entries to a snapshot file
+        :param file_path: target file
+        :param chunk_size: maximum number of entries per chunk of the snapshot
+        """
+        from py_image_dedup.persistence.snapshot import export_snapshot
+
+        self._persistence.flush()
+        count, _ = self._persistence.get_all()
+        self._progress_manager.start(f"Exporting database to '{file_path}'", count, "entries", self.interactive)
+        try:
+            exported = export_snapshot(self._persistence, file_path, chunk_size, progress=self._progress_manager.inc)
+        finally:
+            self._progress_manager.clear()
+        echo(f"Exported {exported} entries to '{file_path}'", color='green')
+
+    def import_database(self, file_path: Path):
+        """
+        Imports all entries of a snapshot file into the database
+        :param file_path: snapshot file
+        """
+        from py_image_dedup.persistence.snapshot import import_snapshot, read_snapshot_header
+
+        header = read_snapshot_header(file_path)
+        if header["datamodel_version"] != self._persistence.DATAMODEL_VERSION:
+            echo(f"Snapshot datamodel version ({header['datamodel_version']}) does not match the current "
+                 f"version ({self._persistence.DATAMODEL_VERSION}), affected files will be analysed again.",
+                 color='yellow')
+
+        self._progress_manager.start(f"Importing '{file_path}'", header["entry_count"], "entries", self.interactive)
+        try:
+            imported = import_snapshot(self._persistence, file_path, progress=self._progress_manager.inc)
+        finally:
+            self._progress_manager.clear()
+        echo(f"Imported {imported} entries from '{file_path}'", color='green')
+
+    def print_similar(self, file_path: Path, across_namespaces: bool):
+        """
+        Prints the database entries similar to the given file
+        :param file_path: the reference file
+        :param across_namespaces: whether to include entries of other namespaces
+        """
+        similar = self._persistence.find_similar(str(file_path.absolute()), across_namespaces)
+        similar = sorted(similar, key=lambda x: x[MetadataKey.DISTANCE.value])
+
+        rows = [
+            (
+                candidate.get(MetadataKey.NAMESPACE.value) or "",
+                candidate[MetadataKey.PATH.value],
+                f"{candidate[MetadataKey.DISTANCE.value]:.4f}",
+                candidate[MetadataKey.SCORE.value]
+            )
+            for candidate in similar
+        ]
+        echo(tabulate(rows, headers=("Namespace", "Path", "Distance", "Score"),
+                      colalign=['left', 'left', 'right', 'right']))
+
+    def print_hot_words(self, count: int):
+        """
+        Prints the signature words that occur in the largest share of all database entries
+        :param count: number of words to print
+        """
+        item_count, statistics = self._persistence.get_word_statistics(count)
+        echo(f"Database entries: {item_count}")
+        if item_count <= 0:
+            return
+
+        words = [(field, value, doc_count) for field, buckets in statistics.items() for value, doc_count in buckets]
+        words = sorted(words, key=lambda x: x[2], reverse=True)[:count]
+
+        rows = [
+            (field, value, doc_count, f"{doc_count / item_count * 100:.2f}%")
+            for field, value, doc_count in words
+        ]
+        echo(tabulate(rows, headers=("Word", "Value", "Documents", "Frequency"),
+                      colalign=['left', 'right', 'right', 'right']))
+
     def _remove_empty_folders(self, directories: List[Path], recursive: bool):
         """
         Searches for empty folders and removes them
@@ -254,36 +904,45 @@ class ImageMatchDeduplicator:
         :return: file_path -> identifier
         """
         with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="py-image-dedup-walker") as self.EXECUTOR:
-            for (root, dirs, files) in os.walk(str(root_directory)):
-                # root is the place you're listing
-                # dirs is a list of directories directly under root
-                # files is a list of files directly under root
-                root = Path(root)
+            for root, file_path in self._iter_directory_files(root_directory):
+                try:
+                    self.EXECUTOR.submit(util.reraise_with_stack(command), root_directory, root, file_path)
+                except Exception as e:
+                    click.echo(e, err=True)
+                    sys.exit(1)
 
-                for file in files:
-                    file_path = Path(root, file)
+    def _iter_directory_files(self, root_directory: Path):
+        """
+        Iterates over the files of the given directory that match the current file filter
+        :param root_directory: the directory to start with
+        :return: generator of (containing directory, file path) tuples
+        """
+        for (root, dirs, files) in os.walk(str(root_directory)):
+            # root is the place you're listing
+            # dirs is a list of directories directly under root
+            # files is a list of files directly under root
+            root = Path(root)
 
-                    # skip file in exclusion
-                    if any(list(map(lambda x: x.search(str(file_path.absolute())), self._config.EXCLUSIONS.value))):
-                        continue
+            for file in files:
+                file_path = Path(root, file)
 
-                    # skip file with unwanted file extension
-                    if not file_has_extension(file_path, self._config.FILE_EXTENSION_FILTER.value):
-                        continue
+                # skip file in exclusion
+                if any(list(map(lambda x: x.search(str(file_path.absolute())), self._config.EXCLUSIONS.value))):
+                    continue
 
-                    # skip if not existent (probably already deleted)
-                    if not file_path.exists():
-                        self._progress_manager.inc()
-                        continue
+                # skip file with unwanted file extension
+                if not file_has_extension(file_path, self._config.FILE_EXTENSION_FILTER.value):
+                    continue
 
-                    try:
-                        self.EXECUTOR.submit(util.reraise_with_stack(command), root_directory, root, file_path)
-                    except Exception as e:
-                        click.echo(e, err=True)
-                        sys.exit(1)
+                # skip if not existent (probably already deleted)
+                if not file_path.exists():
+                    self._progress_manager.inc()
+                    continue
 
-                if not self._config.RECURSIVE.value:
-                    return
+                yield root, file_path
+
+            if not self._config.RECURSIVE.value:
+                return
 
     @ANALYSIS_TIME.time()
     def analyze_file(self, file_path: Path):
@@ -301,13 +960,29 @@ class ImageMatchDeduplicator:
         finally:
             self._progress_manager.inc()
 
+    def find_duplicates_of_files(self, root_directories: List[Path], root_directory: Path,
+                                 reference_file_paths: List[Path]):
+        """
+        Finds duplicates of multiple files, querying the persistence for all of them at once.
+        :param root_directories: valid root directories
+        :param root_directory: root directory of all reference_file_paths
+        :param reference_file_paths: the files to check for duplicates
+        """
+        unprocessed_file_paths = [str(path) for path in reference_file_paths if path not in self._processed_files]
+        similar_files = self._persistence.find_similar_batch(unprocessed_file_paths)
+
+        for reference_file_path in reference_file_paths:
+            self.find_duplicates_of_file(root_directories, root_directory, reference_file_path, similar_files)
+
     @FIND_DUPLICATES_TIME.time()
-    def find_duplicates_of_file(self, root_directories: List[Path], root_directory: Path, reference_file_path: Path):
+    def find_duplicates_of_file(self, root_directories: List[Path], root_directory: Path, reference_file_path: Path,
+                                similar_files: Dict[str, list] = None):
         """
         Finds duplicates and marks all but the best copy as "to-be-deleted".
         :param root_directories: valid root directories
         :param root_directory: root directory of reference_file_path
         :param reference_file_path: the file to check for duplicates
+        :param similar_files: (optional) already known similar files, by reference file path
         """
         self._progress_manager.inc()
         self._progress_manager.set_postfix(self._truncate_middle(reference_file_path))
@@ -317,22 +992,8 @@ class ImageMatchDeduplicator:
             # already found a better candidate for this file
             return
 
-        duplicate_candidates = self._persistence.find_similar(str(reference_file_path))
-
-        if self._config.SEARCH_ACROSS_ROOT_DIRS.value:
-            # filter by files in at least one of the specified root directories
-            # this is necessary because the database might hold items for other paths already
-            # and those are not interesting to us
-            duplicate_candidates = [
-                candidate for candidate in duplicate_candidates if
-                any(root_dir in Path(candidate[MetadataKey.PATH.value]).parents for root_dir in root_directories)
-            ]
-        else:
-            # filter by files in the same root directory
-            duplicate_candidates = [
-                candidate for candidate in duplicate_candidates if
-                root_directory in Path(candidate[MetadataKey.PATH.value]).parents
-            ]
+        duplicate_candidates = self._find_similar(str(reference_file_path), similar_files)
+        duplicate_candidates = self._filter_candidates(root_directories, root_directory, duplicate_candidates)
 
         if len(duplicate_candidates) <= 0:
             echo(f"No duplication candidates found in database for '{reference_file_path}'. "
@@ -348,19 +1009,84 @@ class ImageMatchDeduplicator:
                     echo(f"Unexpected unique duplication candidate '{candidate_path}' for "
                          f"reference file '{reference_file_path}'", color='yellow')
 
-                self._processed_files[candidate_path] = True
+                self._processed_files.add(candidate_path)
 
             # nothing to do here since the result is unique
             return
 
-        # sort by quality criteria and redo the search to use the best candidate as the reference image
-        sorted_duplicate_candidates = self._sort_by_quality_descending(duplicate_candidates)
-        new_reference_file_path = sorted_duplicate_candidates[0][MetadataKey.PATH.value]
-        duplicate_candidates = self._persistence.find_similar(new_reference_file_path)
+        # redo the search to use the best candidate (by quality criteria) as the reference image
+        new_reference_file_path = self._best_candidate(duplicate_candidates)[MetadataKey.PATH.value]
+        duplicate_candidates = self._find_similar(new_reference_file_path, similar_files)
+        duplicate_candidates = self._limit_group_size(new_reference_file_path, duplicate_candidates)
 
         candidates_to_keep, candidates_to_delete = self._select_images_to_delete(duplicate_candidates)
         self._save_duplicates_for_result(candidates_to_keep, candidates_to_delete)
 
+    def _report_truncated_queries(self):
+        """
+        Reports the files whose similarity queries have been cut off by a limit of the persistence
+        as truncated groups, unless their group has been truncated already
+        """
+        truncated_groups = self._deduplication_result.get_truncated_groups()
+        for reference_file_path in map(Path, self._persistence.pop_truncated_queries()):
+            if reference_file_path not in truncated_groups:
+                echo(f"The similarity query of '{reference_file_path}' has been cut off, "
+                     f"similar files might be missing from its group", color='yellow')
+                self._deduplication_result.add_truncated_group(reference_file_path, None)
+
+    def _limit_group_size(self, reference_file_path: str, duplicate_candidates: List[dict]) -> List[dict]:
+        """
+        Keeps only the files closest to the reference file, if there are more than the maximum group size.
+        Truncated groups are reported, the dropped files can still be found as duplicates of each other.
+        :param reference_file_path: the reference file of the group
+        :param duplicate_candidates: similar files, including the reference file itself
+        :return: at most the maximum group size of the given files
+        """
+        max_group_size = self._config.DEDUPLICATION_MAX_GROUP_SIZE.value
+        if max_group_size is None or len(duplicate_candidates) <= max_group_size:
+            return duplicate_candidates
+
+        echo(f"Found more than {max_group_size} similar files of '{reference_file_path}', "
+             f"only the {max_group_size} closest ones are used", color='yellow')
+        limited_candidates = heapq.nsmallest(max_group_size, duplicate_candidates,
+                                             key=lambda candidate: candidate[MetadataKey.DISTANCE.value])
+        self._deduplication_result.add_truncated_group(
+            Path(reference_file_path), len(duplicate_candidates) - len(limited_candidates))
+        return limited_candidates
+
+    def _filter_candidates(self, root_directories: List[Path], root_directory: Path,
+                           duplicate_candidates: List[dict]) -> List[dict]:
+        """
+        :param root_directories: valid root directories
+        :param root_directory: root directory of the reference file
+        :param duplicate_candidates: similar files
+        :return: the similar files that are part of the deduplication
+        """
+        if self._config.SEARCH_ACROSS_ROOT_DIRS.value:
+            # filter by files in at least one of the specified root directories
+            # this is necessary because the database might hold items for other paths already
+            # and those are not interesting to us
+            return [
+                candidate for candidate in duplicate_candidates if
+                any(root_dir in Path(candidate[MetadataKey.PATH.value]).parents for root_dir in root_directories)
+            ]
+        else:
+            # filter by files in the same root directory
+            return [
+                candidate for candidate in duplicate_candidates if
+                root_directory in Path(candidate[MetadataKey.PATH.value]).parents
+            ]
+
+    def _find_similar(self, reference_file_path: str, similar_files: Dict[str, list] = None) -> []:
+        """
+        :param reference_file_path: the reference file
+        :param similar_files: (optional) already known similar files, by reference file path
+        :return: list of files that are similar to the reference file
+        """
+        if similar_files is not None and reference_file_path in similar_files:
+            return similar_files[reference_file_path]
+        return self._persistence.find_similar(reference_file_path)
+
     def _save_duplicates_for_result(self, files_to_keep: List[dict], duplicates: List[dict]) -> None:
         """
         Saves the comparison result for the final summary
@@ -368,6 +1094,10 @@ class ImageMatchDeduplicator:
         :param files_to_keep: list of image that shall be kept
         :param duplicates: less good duplicates
         """
+        if self._group_sink is not None:
+            self._group_sink(DuplicateGroup.of(files_to_keep, duplicates))
+            return
+
         self._deduplication_result.set_file_duplicates(files_to_keep, duplicates)
 
         for file_to_keep in files_to_keep:
@@ -411,12 +1141,11 @@ class ImageMatchDeduplicator:
 
         # remember that we have processed these files
         for candidate in duplicate_candidates:
-            self._processed_files[candidate[MetadataKey.PATH.value]] = True
+            self._processed_files.add(candidate[MetadataKey.PATH.value])
 
         return keep, dont_keep
 
-    @staticmethod
-    def _sort_by_quality_descending(duplicate_candidates) -> []:
+    def _sort_by_quality_descending(self, duplicate_candidates) -> []:
         """
         Sorts images according to the desired priorities.
         The first item in the list will be the most preferred one of all found duplicates.
@@ -424,86 +1153,16 @@ class ImageMatchDeduplicator:
         :param duplicate_candidates: the images to analyze
         :return: duplicate candidates sorted by given criteria
         """
+        return self._prioritization.sort(duplicate_candidates)
+
+    def _best_candidate(self, duplicate_candidates) -> dict:
+        """
+        Finds the most preferred image in a single pass, without sorting all of them.
 
-        def sort_criteria(candidate: dict) -> ():
-            criteria = []
-
-            for rule in DeduplicatorConfig.PRIORITIZATION_RULES.value:
-                rule_name = rule.get("name")
-                if rule_name == "more-exif-data":
-                    if MetadataKey.EXIF_DATA.value in candidate[MetadataKey.METADATA.value]:
-                        # more exif data is better
-                        criteria.append(len(candidate[MetadataKey.METADATA.value][MetadataKey.EXIF_DATA.value]) * -1)
-                elif rule_name == "less-exif-data":
-                    if MetadataKey.EXIF_DATA.value in candidate[MetadataKey.METADATA.value]:
-                        # more exif data is better
-                        criteria.append(len(candidate[MetadataKey.METADATA.value][MetadataKey.EXIF_DATA.value]) * 1)
-                elif rule_name == "bigger-file-size":
-                    # reverse, bigger is better
-                    criteria.append(candidate[MetadataKey.METADATA.value][MetadataKey.FILE_SIZE.value] * -1)
-                elif rule_name == "smaller-file-size":
-                    # smaller is better
-                    criteria.append(candidate[MetadataKey.METADATA.value][MetadataKey.FILE_SIZE.value] * 1)
-                elif rule_name == "newer-file-modification-date":
-                    # reverse, bigger (later time) is better
-                    criteria.append(
-                        candidate[MetadataKey.METADATA.value][MetadataKey.FILE_MODIFICATION_DATE.value] * -1)
-                elif rule_name == "older-file-modification-date":
-                    # smaller (earlier time) is better
-                    criteria.append(
-                        candidate[MetadataKey.METADATA.value][MetadataKey.FILE_MODIFICATION_DATE.value] * 1)
-                elif rule_name == "smaller-distance":
-                    # smaller distance is better
-                    criteria.append(candidate[MetadataKey.DISTANCE.value])
-                elif rule_name == "bigger-distance":
-                    # bigger distance is better
-                    criteria.append(candidate[MetadataKey.DISTANCE.value] * -1)
-                # elif rule_name == "longer-path":
-                # elif rule_name == "shorter-path":
-                elif rule_name == "contains-copy-in-file-name":
-                    # if the filename contains "copy" it is less good
-                    criteria.append("copy" in file.get_file_name(candidate[MetadataKey.PATH.value]).lower())
-                elif rule_name == "doesnt-contain-copy-in-file-name":
-                    # if the filename contains "copy" it is better
-                    criteria.append("copy" not in file.get_file_name(candidate[MetadataKey.PATH.value]).lower())
-                elif rule_name == "longer-file-name":
-                    # longer filename is better (for "edited" versions)
-                    criteria.append(len(file.get_file_name(candidate[MetadataKey.PATH.value])) * -1)
-
-                elif rule_name == "shorter-file-name":
-                    # shorter filename is better (for "edited" versions)
-                    criteria.append(len(file.get_file_name(candidate[MetadataKey.PATH.value])) * 1)
-
-                elif rule_name == "longer-folder-path":
-                    # shorter folder path is better
-                    criteria.append(len(file.get_containing_folder(candidate[MetadataKey.PATH.value])) * -1)
-                elif rule_name == "shorter-folder-path":
-                    # shorter folder path is better
-                    criteria.append(len(file.get_containing_folder(candidate[MetadataKey.PATH.value])))
-                elif rule_name == "higher-score":
-                    # reverse, bigger is better
-                    criteria.append(candidate[MetadataKey.SCORE.value] * -1)
-                elif rule_name == "lower-score":
-                    # lower is better
-                    criteria.append(candidate[MetadataKey.SCORE.value] * 1)
-                elif rule_name == "higher-pixel-count":
-                    # higher pixel count is better
-                    criteria.append(candidate[MetadataKey.METADATA.value][MetadataKey.PIXELCOUNT.value] * -1)
-                elif rule_name == "lower-pixel-count":
-                    # lower pixel count is better
-                    criteria.append(candidate[MetadataKey.METADATA.value][MetadataKey.PIXELCOUNT.value] * 1)
-
-            # just to assure the order in the result is the same
-            # if all other criteria (above) are equal
-            # and recurring runs will result in the same order
-            # (although they shouldn't be compared twice to begin with)
-            criteria.append(candidate[MetadataKey.PATH.value])
-
-            return tuple(criteria)
-
-        duplicate_candidates = sorted(duplicate_candidates, key=sort_criteria)
-
-        return duplicate_candidates
+        :param duplicate_candidates: the images to analyze
+        :return: the duplicate candidate that would be first when sorted by quality
+        """
+        return self._prioritization.best(duplicate_candidates)
 
     def process_duplicates(self):
         """
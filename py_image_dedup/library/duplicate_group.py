@@ -0,0 +1,49 @@
+from pathlib import Path
+from typing import List, Dict
+
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+
+class DuplicateGroup:
+    """
+    A group of similar files, without their metadata
+    """
+
+    def __init__(self, files_to_keep: List[Path], duplicates: List[Path], distances: Dict[Path, float]):
+        """
+        :param files_to_keep: files that shall be kept, the best one first
+        :param duplicates: less good duplicates, which shall be removed
+        :param distances: distance of each file to its most similar file of the group
+        """
+        self.files_to_keep = files_to_keep
+        self.duplicates = duplicates
+        self.distances = distances
+
+    @classmethod
+    def of(cls, files_to_keep: List[dict], duplicates: List[dict]) -> 'DuplicateGroup':
+        """
+        :param files_to_keep: candidates that shall be kept, the best one first
+        :param duplicates: less good candidates
+        :return: group of the paths and distances of the given candidates
+        """
+        return cls(
+            files_to_keep=[Path(candidate[MetadataKey.PATH.value]) for candidate in files_to_keep],
+            duplicates=[Path(candidate[MetadataKey.PATH.value]) for candidate in duplicates],
+            distances={
+                Path(candidate[MetadataKey.PATH.value]): candidate[MetadataKey.DISTANCE.value]
+                for candidate in files_to_keep + duplicates
+            }
+        )
+
+    @property
+    def reference(self) -> Path:
+        """
+        :return: the best file of the group
+        """
+        return self.files_to_keep[0]
+
+    def __len__(self) -> int:
+        return len(self.files_to_keep) + len(self.duplicates)
+
+    def __repr__(self) -> str:
+        return f"DuplicateGroup(reference={self.reference}, duplicates={len(self.duplicates)})"
@@ -0,0 +1,90 @@
+from pathlib import Path
+from typing import Dict, List, Iterator
+
+
+class PathTable:
+    """
+    Interns file paths: each distinct path is stored once, as a string, and identified by an integer id.
+    Ids are assigned in the order in which paths are added, starting at 0.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._paths: List[str] = []
+
+    def add(self, path: Path or str) -> int:
+        """
+        :param path: the path to add, if it isn't known already
+        :return: id of the path
+        """
+        path = str(path)
+        path_id = self._ids.get(path)
+        if path_id is None:
+            path_id = len(self._paths)
+            self._paths.append(path)
+            self._ids[path] = path_id
+        return path_id
+
+    def get(self, path: Path or str) -> int or None:
+        """
+        :param path: the path to look up
+        :return: id of the path, None if it hasn't been added
+        """
+        return self._ids.get(str(path))
+
+    def path(self, path_id: int) -> str:
+        """
+        :param path_id: id of a path
+        :return: the path
+        """
+        return self._paths[path_id]
+
+    def __contains__(self, path: Path or str) -> bool:
+        return str(path) in self._ids
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+
+class PathSet:
+    """
+    Set of paths, stored as a bitset over the ids of a path table
+    """
+
+    def __init__(self, paths: PathTable = None):
+        """
+        :param paths: table of the paths, which can be shared with other sets
+        """
+        self.paths = paths if paths is not None else PathTable()
+        self._bits = bytearray()
+        self._count = 0
+
+    def add(self, path: Path or str):
+        """
+        :param path: the path to add
+        """
+        path_id = self.paths.add(path)
+        index, mask = path_id >> 3, 1 << (path_id & 7)
+        if index >= len(self._bits):
+            # grow by at least half, so adding n paths takes linear time
+            self._bits.extend(bytes(max(index + 1 - len(self._bits), len(self._bits) // 2)))
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._count += 1
+
+    def __contains__(self, path: Path or str) -> bool:
+        path_id = self.paths.get(path)
+        if path_id is None or path_id >> 3 >= len(self._bits):
+            return False
+        return bool(self._bits[path_id >> 3] & (1 << (path_id & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for path_id in range(min(len(self.paths), len(self._bits) * 8)):
+            if self._bits[path_id >> 3] & (1 << (path_id & 7)):
+                yield self.paths.path(path_id)
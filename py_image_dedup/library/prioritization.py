@@ -0,0 +1,169 @@
+import os
+from typing import List, Callable, Dict, Tuple
+
+import numpy as np
+
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+
+class _GroupColumns:
+    """
+    Columns of the values of a group of candidates, each one read from the candidates only once
+    """
+
+    def __init__(self, candidates: List[dict]):
+        self._candidates = candidates
+        self._columns = {}
+
+    def _column(self, name: str, create: Callable[[], np.ndarray]) -> np.ndarray:
+        if name not in self._columns:
+            self._columns[name] = create()
+        return self._columns[name]
+
+    def value(self, key: MetadataKey) -> np.ndarray:
+        """
+        :param key: a value of the candidates
+        :return: the value of each candidate
+        """
+        return self._column(key.value, lambda: np.fromiter(
+            (candidate[key.value] for candidate in self._candidates), dtype=float, count=len(self._candidates)))
+
+    def metadata(self, key: MetadataKey, default=0) -> np.ndarray:
+        """
+        :param key: a metadata value of the candidates
+        :param default: value of candidates without it
+        :return: the metadata value of each candidate
+        """
+        return self._column(f"{MetadataKey.METADATA.value}.{key.value}", lambda: np.fromiter(
+            (candidate[MetadataKey.METADATA.value].get(key.value, default) for candidate in self._candidates),
+            dtype=float, count=len(self._candidates)))
+
+    def paths(self) -> np.ndarray:
+        """
+        :return: the path of each candidate
+        """
+        return self._column(MetadataKey.PATH.value, lambda: np.array(
+            [candidate[MetadataKey.PATH.value] for candidate in self._candidates], dtype=str))
+
+    def file_names(self) -> np.ndarray:
+        """
+        :return: the file name of each candidate
+        """
+        return self._column("file-name", lambda: np.char.rpartition(self.paths(), os.sep)[:, 2])
+
+    def containing_folders(self) -> np.ndarray:
+        """
+        :return: the path of the folder containing each candidate, without a trailing separator
+        """
+        return self._column("containing-folder", lambda: np.char.rstrip(
+            np.char.rpartition(self.paths(), os.sep)[:, 0], os.sep))
+
+
+# features used for ranking, by name, as columns of a group of candidates
+FEATURES: Dict[str, Callable[[_GroupColumns], np.ndarray]] = {
+    "pixel-count": lambda columns: columns.metadata(MetadataKey.PIXELCOUNT),
+    # precomputed at analysis time, missing if exif data isn't used
+    "exif-data-count": lambda columns: columns.metadata(MetadataKey.EXIF_DATA_COUNT),
+    "file-size": lambda columns: columns.metadata(MetadataKey.FILE_SIZE),
+    "file-modification-date": lambda columns: columns.metadata(MetadataKey.FILE_MODIFICATION_DATE),
+    "distance": lambda columns: columns.value(MetadataKey.DISTANCE),
+    "score": lambda columns: columns.value(MetadataKey.SCORE),
+    "copy-in-file-name": lambda columns: np.char.find(np.char.lower(columns.file_names()), "copy") >= 0,
+    "file-name-length": lambda columns: np.char.str_len(columns.file_names()),
+    "folder-path-length": lambda columns: np.char.str_len(columns.containing_folders()),
+}
+
+# rule name -> (feature name, direction), candidates are ranked by direction * feature ascending
+RULES = {
+    "more-exif-data": ("exif-data-count", -1),
+    "less-exif-data": ("exif-data-count", 1),
+    "bigger-file-size": ("file-size", -1),
+    "smaller-file-size": ("file-size", 1),
+    "newer-file-modification-date": ("file-modification-date", -1),
+    "older-file-modification-date": ("file-modification-date", 1),
+    "smaller-distance": ("distance", 1),
+    "bigger-distance": ("distance", -1),
+    # if the filename contains "copy" it is less good
+    "contains-copy-in-file-name": ("copy-in-file-name", 1),
+    "doesnt-contain-copy-in-file-name": ("copy-in-file-name", -1),
+    # longer filename is better (for "edited" versions)
+    "longer-file-name": ("file-name-length", -1),
+    "shorter-file-name": ("file-name-length", 1),
+    "longer-folder-path": ("folder-path-length", -1),
+    "shorter-folder-path": ("folder-path-length", 1),
+    "higher-score": ("score", -1),
+    "lower-score": ("score", 1),
+    "higher-pixel-count": ("pixel-count", -1),
+    "lower-pixel-count": ("pixel-count", 1),
+}
+
+
+class Prioritization:
+    """
+    Prioritization rules, compiled once into feature columns that candidates are ranked by
+    """
+
+    def __init__(self, rules: List[dict]):
+        """
+        :param rules: prioritization rules (dicts with a "name"), most important first.
+                      Unknown rules are ignored.
+        """
+        self._features = []
+        self._directions = []
+        for rule in rules:
+            if rule.get("name") not in RULES:
+                continue
+            feature, direction = RULES[rule["name"]]
+            self._features.append(FEATURES[feature])
+            self._directions.append(direction)
+        self._directions = np.array(self._directions, dtype=float)
+
+    def _key_columns(self, candidates: List[dict]) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        :param candidates: a group of images
+        :return: the paths of the images and their feature columns, most important first
+        """
+        columns = _GroupColumns(candidates)
+        return columns.paths(), [direction * feature(columns).astype(float)
+                                 for feature, direction in zip(self._features, self._directions.tolist())]
+
+    def key(self, candidate: dict) -> tuple:
+        """
+        :param candidate: an image
+        :return: sort key of the image, smaller is better
+        """
+        paths, feature_columns = self._key_columns([candidate])
+        # the path assures the same order in recurring runs if all other criteria are equal
+        return tuple(column.item() for column in feature_columns) + (paths.item(),)
+
+    def rank(self, candidates: List[dict]) -> np.ndarray:
+        """
+        Ranks all candidates at once: each feature is built once as a column of the group,
+        and all columns are sorted by a single lexsort.
+
+        :param candidates: the images to rank
+        :return: indices of the candidates, best first
+        """
+        if len(candidates) <= 0:
+            return np.zeros(0, dtype=np.int64)
+        paths, feature_columns = self._key_columns(candidates)
+        # the last key of lexsort is the primary one
+        return np.lexsort([paths] + feature_columns[::-1])
+
+    def sort(self, candidates: List[dict]) -> List[dict]:
+        """
+        :param candidates: the images to sort
+        :return: the images, best first
+        """
+        candidates = list(candidates)
+        return [candidates[i] for i in self.rank(candidates).tolist()]
+
+    def best(self, candidates: List[dict]) -> dict:
+        """
+        :param candidates: the images to choose from
+        :return: the image that would be first when sorted
+        """
+        candidates = list(candidates)
+        if len(candidates) <= 0:
+            raise ValueError("No candidates to choose from")
+        return candidates[int(self.rank(candidates)[0])]
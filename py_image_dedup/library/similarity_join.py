@@ -0,0 +1,267 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, List, Tuple, Dict
+
+import numpy as np
+
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util.signature import signature_words, normalized_distances
+
+# number of entries to convert into a signature matrix at once while reading
+_READ_BLOCK_SIZE = 10000
+# fields of the stored entries that are read for a join: the signature, and the path and metadata to rank a file
+ENTRY_FIELDS = [MetadataKey.PATH.value, MetadataKey.SIGNATURE.value] + [
+    f"{MetadataKey.METADATA.value}.{key.value}" for key in [
+        MetadataKey.FILE_SIZE,
+        MetadataKey.FILE_MODIFICATION_DATE,
+        MetadataKey.PIXELCOUNT,
+        MetadataKey.EXIF_DATA_COUNT,
+    ]
+]
+# number of row slices per worker process, so slow slices don't leave the other workers idle
+_SLICES_PER_PROCESS = 4
+
+
+class SharedArray:
+    """
+    A numpy array in a shared memory block, which can be attached to by other processes using its handle
+    """
+
+    def __init__(self, shape: tuple, dtype, name: str = None):
+        """
+        :param shape: shape of the array
+        :param dtype: data type of the array
+        :param name: name of an existing block to attach to, a new block is created if unset
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self._memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self._owner = name is None
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._memory.buf)
+
+    @classmethod
+    def copy_of(cls, array: np.ndarray) -> 'SharedArray':
+        """
+        :param array: the array to copy
+        :return: a new shared array with the same content
+        """
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def handle(self) -> tuple:
+        """
+        :return: picklable (name, shape, dtype) tuple to attach to this array from another process
+        """
+        return self._memory.name, self.shape, self.dtype.str
+
+    def close(self):
+        """
+        Detaches from the shared memory block, which is released too if it has been created by this instance
+        """
+        del self.array
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# shared arrays attached to by a worker process, by name
+_attached_arrays: Dict[str, SharedArray] = {}
+
+
+def _attach(handle: tuple) -> np.ndarray:
+    """
+    :param handle: handle of a shared array
+    :return: the array, attached to only once per worker process
+    """
+    name, shape, dtype = handle
+    if name not in _attached_arrays:
+        _attached_arrays[name] = SharedArray(shape, dtype, name=name)
+    return _attached_arrays[name].array
+
+
+def _words_of_rows(signatures_handle: tuple, words_handle: tuple, start: int, end: int, k: int, n: int):
+    """
+    Computes the words of a slice of the shared signature matrix into the shared word matrix
+    """
+    signatures, words = _attach(signatures_handle), _attach(words_handle)
+    words[start:end] = signature_words(signatures[start:end], k, n)
+
+
+def _distances_of_pairs(signatures_handle: tuple, pairs_handle: tuple, start: int, end: int,
+                        chunk_size: int) -> np.ndarray:
+    """
+    :return: distances of a slice of the shared candidate pairs, looked up in the shared signature matrix
+    """
+    signatures, pairs = _attach(signatures_handle), _attach(pairs_handle)
+    return _pair_distances(signatures, pairs[start:end], chunk_size)
+
+
+def _pair_distances(signatures: np.ndarray, pairs: np.ndarray, chunk_size: int) -> np.ndarray:
+    """
+    :param signatures: N x m signature matrix
+    :param pairs: N' x 2 matrix of row pairs
+    :param chunk_size: number of pairs to compare at once
+    :return: normalized distance of each pair
+    """
+    return np.concatenate([np.zeros(0)] + [
+        normalized_distances(signatures[pairs[start:start + chunk_size, 0]],
+                             signatures[pairs[start:start + chunk_size, 1]])
+        for start in range(0, len(pairs), chunk_size)
+    ])
+
+
+def read_entries(entries: Iterable[dict]) -> Tuple[List[dict], np.ndarray]:
+    """
+    Reads stored entries (as returned by ImageSignatureStore.get_all, ENTRY_FIELDS are sufficient)
+    into a signature matrix
+
+    :param entries: stored entries
+    :return: records (path and metadata) and N x m signature matrix, one row per record
+    """
+    records = []
+    blocks = []
+    block = []
+    for entry in entries:
+        source = entry['_source']
+        records.append({
+            MetadataKey.PATH.value: source[MetadataKey.PATH.value],
+            MetadataKey.METADATA.value: source.get(MetadataKey.METADATA.value, {}),
+        })
+        block.append(source[MetadataKey.SIGNATURE.value])
+        if len(block) >= _READ_BLOCK_SIZE:
+            blocks.append(np.array(block, dtype=np.int8))
+            block = []
+    if len(block) > 0:
+        blocks.append(np.array(block, dtype=np.int8))
+    if len(blocks) <= 0:
+        return records, np.zeros((0, 0), dtype=np.int8)
+    return records, np.concatenate(blocks)
+
+
+def candidate_pairs(words: np.ndarray, min_should_match: int = 1,
+                    max_bucket_size: int = 1000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds all pairs of rows that share at least min_should_match words at the same position,
+    using an inverted index (word value -> rows) per word position.
+
+    :param words: N x n matrix of signature words
+    :param min_should_match: minimum number of shared words
+    :param max_bucket_size: words shared by more rows than this are ignored, they carry little
+                            information (f.ex. uniform image regions) and would produce a quadratic
+                            number of pairs
+    :return: N' x 2 matrix of row pairs (first < second) and the number of shared words of each pair
+    """
+    row_count = len(words)
+    # sorted keys (first * row_count + second) of all pairs found so far, and their number of shared words
+    keys = np.zeros(0, dtype=np.int64)
+    matches = np.zeros(0, dtype=np.int64)
+    for position in range(words.shape[1]):
+        # buckets of rows with the same word at this position
+        order = np.argsort(words[:, position], kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(words[order, position]) != 0])
+        sizes = np.diff(np.r_[starts, row_count])
+
+        # pairs of all buckets of the same size at once
+        position_keys = []
+        for size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket_size)]).tolist():
+            buckets = np.sort(order[starts[sizes == size, None] + np.arange(size)], axis=1).astype(np.int64)
+            first, second = np.triu_indices(size, 1)
+            position_keys.append((buckets[:, first] * row_count + buckets[:, second]).ravel())
+        if len(position_keys) <= 0:
+            continue
+
+        # a pair shares at most one word per position, so the keys of a single position are unique
+        # and can be merged into the ones of the previous positions without holding all of them at once
+        position_keys = np.sort(np.concatenate(position_keys))
+        indices = np.searchsorted(keys, position_keys)
+        is_known = indices < len(keys)
+        is_known[is_known] = keys[indices[is_known]] == position_keys[is_known]
+        matches[indices[is_known]] += 1
+        keys = np.insert(keys, indices[~is_known], position_keys[~is_known])
+        matches = np.insert(matches, indices[~is_known], 1)
+
+    keys, matches = keys[matches >= min_should_match], matches[matches >= min_should_match]
+    return np.stack([keys // row_count, keys % row_count], axis=1), matches
+
+
+def similarity_join(signatures: np.ndarray, max_dist: float, min_should_match: int = 1,
+                    max_bucket_size: int = 1000, chunk_size: int = 100000,
+                    k: int = 16, n: int = 63, processes: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds all pairs of similar signatures at once. Candidates are pairs sharing signature words,
+    like the ones a similarity query of each signature would find, which are then verified by
+    their normalized distance.
+
+    :param signatures: N x m signature matrix
+    :param max_dist: maximum normalized distance of similar signatures
+    :param min_should_match: minimum number of shared words of candidate pairs
+    :param max_bucket_size: see candidate_pairs
+    :param chunk_size: number of candidate pairs to verify at once
+    :param k: word length
+    :param n: number of words per signature
+    :param processes: number of worker processes computing the words and distances of a slice of the rows each,
+                      the signatures are shared with them (instead of being copied) using shared memory
+    :return: N' x 2 matrix of row pairs (first < second), their distances and number of shared words
+    """
+    if len(signatures) <= 1:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+    if processes > 1:
+        return _similarity_join_parallel(signatures, max_dist, min_should_match, max_bucket_size, chunk_size,
+                                         k, n, processes)
+
+    words = np.concatenate([
+        signature_words(signatures[start:start + _READ_BLOCK_SIZE], k, n)
+        for start in range(0, len(signatures), _READ_BLOCK_SIZE)
+    ])
+    pairs, matches = candidate_pairs(words, min_should_match, max_bucket_size)
+
+    distances = _pair_distances(signatures, pairs, chunk_size)
+    is_hit = distances < max_dist
+    return pairs[is_hit], distances[is_hit], matches[is_hit]
+
+
+def _similarity_join_parallel(signatures: np.ndarray, max_dist: float, min_should_match: int,
+                              max_bucket_size: int, chunk_size: int, k: int, n: int,
+                              processes: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as similarity_join, but the words and distances are computed by a pool of worker processes.
+    Only handles of the shared arrays and slice bounds are sent to the workers.
+    """
+    row_count = len(signatures)
+    row_bounds = np.unique(np.linspace(0, row_count, processes * _SLICES_PER_PROCESS + 1).astype(np.int64))
+
+    with SharedArray.copy_of(np.ascontiguousarray(signatures, dtype=np.int8)) as shared_signatures, \
+            SharedArray((row_count, n), np.int64) as shared_words, \
+            ProcessPoolExecutor(max_workers=processes) as executor:
+        for future in [
+            executor.submit(_words_of_rows, shared_signatures.handle, shared_words.handle, start, end, k, n)
+            for start, end in zip(row_bounds[:-1].tolist(), row_bounds[1:].tolist())
+        ]:
+            future.result()
+
+        pairs, matches = candidate_pairs(shared_words.array, min_should_match, max_bucket_size)
+        if len(pairs) <= 0:
+            return pairs, np.zeros(0), matches
+
+        # pairs are sorted by their first row, so each slice of reference rows is a slice of pairs
+        pair_bounds = np.searchsorted(pairs[:, 0], row_bounds).tolist()
+        with SharedArray.copy_of(pairs) as shared_pairs:
+            distances = np.concatenate([np.zeros(0)] + [
+                future.result() for future in [
+                    executor.submit(_distances_of_pairs, shared_signatures.handle, shared_pairs.handle,
+                                    start, end, chunk_size)
+                    for start, end in zip(pair_bounds[:-1], pair_bounds[1:]) if end > start
+                ]
+            ])
+
+    is_hit = distances < max_dist
+    return pairs[is_hit], distances[is_hit], matches[is_hit]
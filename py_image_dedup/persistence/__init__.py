@@ -1,5 +1,8 @@
+import hashlib
 import logging
 import os
+import threading
+from typing import List, Dict
 
 from PIL import TiffImagePlugin
 
@@ -11,10 +14,16 @@ class ImageSignatureStore:
     Base class for Persistence implementations
     """
 
-    DATAMODEL_VERSION = 5
+    DATAMODEL_VERSION = 6
+
+    # run generation stamped on all entries that are (re)analysed, see get_paths_of_generation
+    generation: int = None
 
     def __init__(self, use_exif_data: bool = True):
         self._use_exif_data = use_exif_data
+        # reference files of similarity queries that have been cut off by a limit of the backend
+        self._truncated_queries = set()
+        self._truncated_queries_lock = threading.Lock()
 
     def add(self, image_file_path: str):
         """
@@ -25,7 +34,15 @@ class ImageSignatureStore:
         image_data = self._create_metadata_dict(image_file_path)
 
         # check if the file has already been analyzed (and didn't change in the meantime)
-        existing_entity = self.get(image_file_path)
+        try:
+            existing_entity = self.get(image_file_path)
+        except Exception as ex:
+            if not self._queues_writes():
+                raise
+            # the store is unavailable, treat the file as not analyzed:
+            # the queued write replaces the existing entry once the store is back
+            logging.exception(ex)
+            existing_entity = None
         if existing_entity is not None:
             is_data_version_ok = False
             try:
@@ -38,7 +55,10 @@ class ImageSignatureStore:
                     MetadataKey.FILE_SIZE.value] and \
                     existing_entity[MetadataKey.METADATA.value][
                         MetadataKey.FILE_MODIFICATION_DATE.value] == image_data[
-                    MetadataKey.FILE_MODIFICATION_DATE.value]:
+                    MetadataKey.FILE_MODIFICATION_DATE.value] and \
+                    existing_entity[MetadataKey.METADATA.value].get(
+                        MetadataKey.CANONICAL_ORIENTATION.value, False) == image_data.get(
+                    MetadataKey.CANONICAL_ORIENTATION.value, False):
                     # print("File is the same, not adding again")
                     return
             except Exception as ex:
@@ -49,6 +69,8 @@ class ImageSignatureStore:
                     logging.exception(ex)
                     return
 
+        if self.generation is not None:
+            image_data[MetadataKey.GENERATION.value] = self.generation
         self._add(image_file_path, image_data)
 
     def _create_metadata_dict(self, image_file_path: str) -> dict:
@@ -72,14 +94,28 @@ class ImageSignatureStore:
         image_data[MetadataKey.FILE_MODIFICATION_DATE.value] = file_modification_date
 
         image_data[MetadataKey.PIXELCOUNT.value] = image.get_pixel_count(image_file_path)
+        if self.uses_dhash():
+            dhash = image.get_dhash(image_file_path)
+            if dhash is not None:
+                image_data[MetadataKey.DHASH.value] = dhash
 
         if self._use_exif_data:
             exif_data = image.get_exif_data(image_file_path)
             exif_data = self._normalize_meta_data_for_db(exif_data)
             image_data[MetadataKey.EXIF_DATA.value] = exif_data
+            # precomputed, so ranking doesn't have to fetch the whole exif dictionary
+            image_data[MetadataKey.EXIF_DATA_COUNT.value] = len(exif_data)
 
         return image_data
 
+    def uses_dhash(self) -> bool:
+        """
+        Implementations whose queries make use of the difference hash of an image must override this.
+
+        :return: True if the difference hash of an image has to be computed when it is analysed
+        """
+        return False
+
     def _normalize_meta_data_for_db(self, dictionary: dict) -> dict:
         """
         :param dictionary:
@@ -113,6 +149,23 @@ class ImageSignatureStore:
         """
         raise NotImplementedError()
 
+    def _queues_writes(self) -> bool:
+        """
+        Implementations that queue writes until the store is available must override this.
+
+        :return: True if _add and remove don't need the store to be available
+        """
+        return False
+
+    def import_records(self, records: List[dict]) -> None:
+        """
+        Saves already analysed image_match records (path, signature, words and metadata),
+        replacing existing entries of the same files
+
+        :param records: the records to save
+        """
+        raise NotImplementedError()
+
     def get(self, image_file_path: str) -> dict or None:
         """
         Get a store entry by it's file_path
@@ -121,21 +174,131 @@ class ImageSignatureStore:
         """
         raise NotImplementedError()
 
-    def get_all(self) -> (int, object):
+    def get_all(self, fields: List[str] = None) -> (int, object):
         """
+        :param fields: (optional) fields of the entries to read (like "metadata.file_size"),
+                       implementations might return more than these. All fields if None.
         :return: item count, stored entries as a generator function
         """
         raise NotImplementedError()
 
-    def find_similar(self, reference_image_file_path: str) -> []:
+    def get_paths_of_generation(self, generation: int = None) -> List[str]:
+        """
+        Implementations should override this if they can filter entries
+        without reading all of them.
+
+        :param generation: minimum generation, the latest generation of the store if None
+        :return: paths of all entries that have been (re)analysed in the given generation or later
+        """
+        _, entries = self.get_all()
+        generations = {}
+        for entry in entries:
+            entry_generation = entry['_source'][MetadataKey.METADATA.value].get(MetadataKey.GENERATION.value)
+            if entry_generation is not None:
+                generations[entry['_source'][MetadataKey.PATH.value]] = entry_generation
+
+        if generation is None:
+            if len(generations) <= 0:
+                return []
+            generation = max(generations.values())
+        return [path for path, entry_generation in generations.items() if entry_generation >= generation]
+
+    def uses_clusters(self) -> bool:
+        """
+        Implementations whose queries make use of the stored clusters must override this.
+
+        :return: True if set_clusters is worth calling
+        """
+        return False
+
+    def set_clusters(self, clusters: Dict[str, List[str]]) -> None:
+        """
+        Stores groups of duplicates, so later queries can compare new images to their representative
+        (the copy that has been kept) only. Entries that are (re)analysed lose their cluster.
+
+        :param clusters: map of representative path -> paths of the other members of its cluster
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def cluster_id(representative_path: str) -> int:
+        """
+        :param representative_path: path of the representative of a cluster
+        :return: signed 64 bit id of the cluster
+        """
+        digest = hashlib.blake2b(representative_path.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, byteorder='big', signed=True)
+
+    def get_word_statistics(self, count: int) -> (int, Dict[str, List[tuple]]):
+        """
+        Computes the most frequent values of each signature word position
+
+        :param count: maximum number of values to return per word position
+        :return: item count, map of word field -> list of (word value, document count) tuples, most frequent first
+        """
+        raise NotImplementedError()
+
+    def find_similar(self, reference_image_file_path: str, across_namespaces: bool = False) -> []:
         """
         Search for similar images to the specified one
 
         :param reference_image_file_path: the reference image file
+        :param across_namespaces: whether to include images of other namespaces (hosts) sharing this store,
+                                  ignored by backends without namespaces
         :return: list of images that are similar to the reference file
         """
         raise NotImplementedError()
 
+    def find_similar_batch(self, reference_image_file_paths: List[str]) -> Dict[str, list]:
+        """
+        Search for similar images of multiple reference images at once.
+        Implementations should override this if they can answer multiple queries
+        more efficiently than one after another.
+
+        :param reference_image_file_paths: the reference image files
+        :return: map of reference image file path -> list of images that are similar to it
+        """
+        return {path: self.find_similar(path) for path in reference_image_file_paths}
+
+    def pop_truncated_queries(self) -> List[str]:
+        """
+        :return: reference files of all similarity queries since the last call that have been cut off
+                 by a limit of the backend, so they might have more similar files than have been returned
+        """
+        with self._truncated_queries_lock:
+            truncated_queries = sorted(self._truncated_queries)
+            self._truncated_queries.clear()
+        return truncated_queries
+
+    def _add_truncated_query(self, reference_image_file_path: str) -> None:
+        """
+        Remembers a similarity query that has been cut off by a limit of the backend
+        :param reference_image_file_path: the reference file of the query
+        """
+        with self._truncated_queries_lock:
+            self._truncated_queries.add(reference_image_file_path)
+
+    def flush(self) -> None:
+        """
+        Waits until all pending changes have been persisted.
+        Implementations that write asynchronously must override this.
+        """
+        pass
+
+    def refresh(self) -> None:
+        """
+        Waits until all pending changes have been persisted and are visible to queries.
+        Implementations whose changes become visible asynchronously must override this.
+        """
+        self.flush()
+
+    def close(self) -> None:
+        """
+        Persists all pending changes and releases all resources (like connections) of this store.
+        Implementations holding such resources must override this.
+        """
+        self.flush()
+
     def remove(self, image_file_path: str) -> None:
         """
         Remove all entries with the given file path
@@ -0,0 +1,218 @@
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import threading
+from typing import List, Dict, Callable
+
+from py_image_dedup.persistence.elasticsearchstorebackend import ElasticSearchStoreBackend
+from py_image_dedup.util import echo
+
+
+class _SynchronousClient:
+    """
+    Synchronous view of an AsyncElasticsearch client (or one of its namespaces, like "indices"),
+    waiting for the result of each request
+    """
+
+    def __init__(self, client, run: Callable):
+        """
+        :param client: the asynchronous client
+        :param run: function running a coroutine on the event loop of the client, returning its result
+        """
+        self._client = client
+        self._run = run
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return _SynchronousClient(attribute, self._run)
+
+        def request(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self._run(result) if inspect.isawaitable(result) else result
+
+        return request
+
+
+class AsyncElasticSearchStoreBackend(ElasticSearchStoreBackend):
+    """
+    Elasticsearch backend that keeps multiple requests in flight at once.
+
+    All requests are issued by a single AsyncElasticsearch client (using a single pooled session)
+    running on an asyncio event loop in a background thread, until the backend is closed.
+    The synchronous API of ImageSignatureStore is kept, so this backend can be used from any thread,
+    f.ex. by the batch phases as well as the daemon.
+    """
+
+    # number of similarity queries per multi search request
+    MSEARCH_CHUNK_SIZE = 16
+    # number of paths per request when getting multiple entries
+    GET_CHUNK_SIZE = 100
+
+    def __init__(self, host: str, port: int, max_concurrent_requests: int = 16, **kwargs):
+        """
+        :param host: host address of the elasticsearch server
+        :param port: port of the elasticsearch server
+        :param max_concurrent_requests: maximum number of requests in flight at once
+        :param kwargs: see ElasticSearchStoreBackend
+        """
+        self._max_concurrent_requests = max_concurrent_requests
+        # limits the number of writes that have been accepted but not yet persisted
+        self._write_slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._pending_writes = set()
+        self._pending_writes_lock = threading.Lock()
+
+        # the event loop has to be running before the base class is set up,
+        # since a write-behind queue might start replaying records right away
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="py-image-dedup-elasticsearch",
+            daemon=True
+        )
+        self._loop_thread.start()
+        self._run(self._setup_async_client(host, port))
+
+        super().__init__(host=host, port=port, **kwargs)
+
+    async def _setup_async_client(self, host: str, port: int):
+        # the client session is bound to the event loop it is created on
+        from elasticsearch import AsyncElasticsearch
+
+        self._async_es = AsyncElasticsearch(
+            hosts=[
+                {'host': host, 'port': port}
+            ],
+            maxsize=self._max_concurrent_requests,
+        )
+        self._request_slots = asyncio.Semaphore(self._max_concurrent_requests)
+
+    def _create_client(self) -> '_SynchronousClient':
+        # the asynchronous client is used for all requests, also the ones
+        # of image_match and the scan helper, which expect a synchronous client
+        return _SynchronousClient(self._async_es, lambda coroutine: self._run(self._limited(coroutine)))
+
+    def close(self) -> None:
+        self._close_write_queue()
+        self._wait_for_pending_writes()
+        self._run(self._async_es.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    def _run(self, coroutine):
+        """
+        Runs the given coroutine on the event loop and waits for its result
+        :param coroutine: the coroutine to run
+        :return: the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _gather(self, coroutines: list) -> list:
+        """
+        Runs the given requests concurrently and waits for all of them
+        :param coroutines: the requests to run
+        :return: the results of the requests, in the given order
+        """
+        async def gather():
+            return await asyncio.gather(*[self._limited(coroutine) for coroutine in coroutines])
+
+        return self._run(gather())
+
+    async def _limited(self, coroutine):
+        """
+        Awaits the given coroutine, respecting the maximum number of concurrent requests
+        :param coroutine: the request to await
+        :return: the result of the request
+        """
+        async with self._request_slots:
+            return await coroutine
+
+    async def _index_async(self, record: dict):
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        return await self._limited(self._async_es.index(
+            index=self._el_index,
+            body=record,
+            **(el6_params if self._el_version < 7 else {})
+        ))
+
+    async def _delete_by_query_async(self, body: dict):
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        return await self._limited(self._async_es.delete_by_query(
+            index=self._el_index,
+            body=body,
+            conflicts="proceed",
+            **(el6_params if self._el_version < 7 else {})
+        ))
+
+    def _get_many(self, image_file_paths: List[str], source_excludes: [str] = None) -> Dict[str, dict]:
+        chunks = [image_file_paths[i:i + self.GET_CHUNK_SIZE]
+                  for i in range(0, len(image_file_paths), self.GET_CHUNK_SIZE)]
+        responses = self._gather([
+            self._async_es.search(index=self._el_index, body=self._create_get_many_query(chunk, source_excludes))
+            for chunk in chunks
+        ])
+
+        result = {}
+        for response in responses:
+            result.update(self._get_unique_entries(response['hits']['hits']))
+        return result
+
+    def _search_similar_hits(self, queries: List[dict]) -> List[List[dict]]:
+        chunks = [queries[i:i + self.MSEARCH_CHUNK_SIZE] for i in range(0, len(queries), self.MSEARCH_CHUNK_SIZE)]
+        responses = self._gather([
+            self._async_es.msearch(body=self._create_msearch_body(chunk), index=self._el_index)
+            for chunk in chunks
+        ])
+
+        result = []
+        for response in responses:
+            for chunk_response in response['responses']:
+                if 'error' in chunk_response:
+                    raise AssertionError(f"Similarity search failed: {chunk_response['error']}")
+                result.append(chunk_response['hits']['hits'])
+        return result
+
+    def _add(self, image_file_path: str, image_data: dict) -> None:
+        if self._write_queue is not None:
+            super()._add(image_file_path, image_data)
+            return
+
+        # analysis happens on the calling thread, only the write itself is pipelined
+        record = self._create_record(image_file_path, image_data)
+
+        self._write_slots.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._add_async(record), self._loop)
+        with self._pending_writes_lock:
+            self._pending_writes.add(future)
+        future.add_done_callback(self._on_write_done)
+
+    async def _add_async(self, record: dict):
+        # remove existing entries
+        await self._delete_by_query_async(self._create_path_query(record['path']))
+        await self._index_async(record)
+
+    def _on_write_done(self, future: concurrent.futures.Future):
+        with self._pending_writes_lock:
+            self._pending_writes.discard(future)
+        self._write_slots.release()
+
+        try:
+            future.result()
+        except Exception as e:
+            logging.exception(e)
+            echo(f"Error writing database entry: {e}", color="red")
+
+    def flush(self) -> None:
+        super().flush()
+        self._wait_for_pending_writes()
+
+    def _wait_for_pending_writes(self) -> None:
+        with self._pending_writes_lock:
+            pending_writes = list(self._pending_writes)
+        concurrent.futures.wait(pending_writes)
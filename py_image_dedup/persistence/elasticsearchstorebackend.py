@@ -1,18 +1,65 @@
+import heapq
 import logging
+import math
 import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict
 
-import requests
+import numpy as np
 from elasticsearch import Elasticsearch
 from image_match.elasticsearch_driver import SignatureES
+from image_match.signature_database_base import make_record
 
 from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.persistence.write_behind_queue import WriteBehindQueue
 from py_image_dedup.util import echo
+from py_image_dedup.util.signature import normalized_distances, canonical_orientations, ORIENTATION_PERMUTATIONS, \
+    signature_words
+
+
+def _metadata_field(key: MetadataKey) -> str:
+    return f"{MetadataKey.METADATA.value}.{key.value}"
 
 
 class ElasticSearchStoreBackend(ImageSignatureStore):
     DEFAULT_EL_DOC_TYPE_EL_6 = 'image'
     DEFAULT_EL_DOC_TYPE_EL_7 = '_doc'
 
+    # fields needed to compute the distance to, and rank, a similarity search hit
+    SIMILARITY_SEARCH_FIELDS = [
+        MetadataKey.PATH.value,
+        MetadataKey.NAMESPACE.value,
+        MetadataKey.SIGNATURE.value,
+        _metadata_field(MetadataKey.FILE_SIZE),
+        _metadata_field(MetadataKey.FILE_MODIFICATION_DATE),
+        _metadata_field(MetadataKey.PIXELCOUNT),
+        _metadata_field(MetadataKey.EXIF_DATA_COUNT),
+    ]
+    # maximum number of records per bulk request
+    BULK_SIZE = 500
+    # maximum time in seconds to wait for queued writes, so an unavailable database doesn't block forever
+    WRITE_BEHIND_FLUSH_TIMEOUT = 60
+    # key of queued records that only remove the entries of their path
+    REMOVAL_RECORD_KEY = "remove"
+    # script setting the cluster of all documents of an update by query request, params.clusters maps
+    # paths to (cluster id, representative) tuples
+    SET_CLUSTER_SCRIPT = (
+        f"def cluster = params.clusters[ctx._source.{MetadataKey.PATH.value}]; "
+        f"ctx._source.{MetadataKey.METADATA.value}.{MetadataKey.CLUSTER.value} = cluster[0]; "
+        f"ctx._source.{MetadataKey.METADATA.value}.{MetadataKey.REPRESENTATIVE.value} = cluster[1];"
+    )
+    # maximum age of the cached hot word statistics
+    HOT_WORDS_MAX_AGE = timedelta(hours=1)
+    # orientations whose gradient is within this share of its length of the canonical octant are searched as well
+    ORIENTATION_MARGIN = 0.1
+
+    # fields that are never needed when using an entry as a search reference
+    REFERENCE_EXCLUDED_FIELDS = [
+        _metadata_field(MetadataKey.EXIF_DATA),
+    ]
+
     def __init__(self,
                  host: str,
                  port: int,
@@ -21,8 +68,16 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
                  el_version: int = None,
                  el_doctype: str = None,
                  max_dist: float = 0.03,
+                 min_should_match: int = 1,
+                 hot_word_threshold: float = None,
+                 namespace: str = None,
+                 canonical_orientation: bool = False,
                  use_exif_data: bool = True,
                  setup_database: bool = True,
+                 write_behind_spill_file: Path = None,
+                 write_behind_memory_limit: int = 1000,
+                 max_results: int = None,
+                 max_pages: int = 10,
                  ):
         """
         Image signature persistence backed by image_match and elasticsearch
@@ -33,13 +88,37 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
         :param el_index: elasticsearch index where the data is stored
         :param el_doctype: elasticsearch document type of the stored data
         :param max_dist: maximum "difference" allowed, ranging from [0 .. 1] where 0.2 is still a pretty similar image
+        :param min_should_match: minimum number of signature words a candidate has to share with the reference image
+        :param hot_word_threshold: document frequency [0..1] above which a signature word is ignored in queries
+        :param namespace: when set, entries are tagged with this id and all queries are limited to entries
+                          with the same id, so multiple hosts can share a single index
+        :param canonical_orientation: when set, signatures are stored in a canonical orientation,
+                                      so rotated and mirrored copies of an image are found by a single query
+        :param write_behind_spill_file: when set, writes are queued and records that don't fit into memory
+                                        are spilled to this file while the database is slow or unavailable
+        :param write_behind_memory_limit: maximum number of queued records to hold in memory
+        :param max_results: maximum number of similar entries returned by a query, only the closest ones are kept
+        :param max_pages: maximum number of pages fetched per query, queries cut off by this limit are reported
+                          by pop_truncated_queries
         """
         super().__init__(use_exif_data)
 
+        self._min_should_match = min_should_match
+        self._hot_word_threshold = hot_word_threshold
+        self._hot_words = None
+        self._hot_words_time = None
+        self._namespace = namespace
+        self._canonical_orientation = canonical_orientation
+        self._max_results = max_results
+        self._max_pages = max_pages
+
         self.host = host
         self.port = port
         self._connections_per_node = connections_per_node
 
+        # a single client (and connection pool) is used for all requests
+        self._es = self._create_client()
+
         detected_version = None
         while detected_version is None:
             time.sleep(2)
@@ -74,23 +153,51 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
 
         # noinspection PyTypeChecker
         self._store = SignatureES(
-            es=Elasticsearch(
-                hosts=[
-                    {'host': self.host, 'port': self.port}
-                ],
-                maxsize=self._connections_per_node,
-            ),
+            es=self._es,
             # el_version=self._el_version,
             index=self._el_index,
             doc_type=self._el_doctype,
             distance_cutoff=max_dist,
         )
 
+        self._write_queue = None
+        if write_behind_spill_file is not None:
+            self._write_queue = WriteBehindQueue(
+                write=self._write_records,
+                spill_file=write_behind_spill_file,
+                max_memory_items=write_behind_memory_limit,
+                batch_size=self.BULK_SIZE,
+            )
+
+    def _create_client(self) -> Elasticsearch:
+        """
+        :return: the client used for all requests
+        """
+        return Elasticsearch(
+            hosts=[
+                {'host': self.host, 'port': self.port}
+            ],
+            maxsize=self._connections_per_node,
+        )
+
+    def close(self) -> None:
+        self._close_write_queue()
+        self._es.close()
+
+    def _close_write_queue(self) -> None:
+        """
+        Writes all queued records, spilling the ones that can't be written while the database is unavailable
+        """
+        if self._write_queue is None:
+            return
+        if not self._write_queue.close(timeout=self.WRITE_BEHIND_FLUSH_TIMEOUT):
+            echo(f"Database unavailable, {len(self._write_queue)} records have been spilled "
+                 f"and will be written on the next start", color='yellow')
+
     def _detect_db_version(self) -> int or None:
         try:
-            response = requests.get('http://{}:{}'.format(self.host, self.port))
-            response.raise_for_status()
-            return int(str(response.json()["version"]['number']).split(".")[0])
+            response = self._es.info()
+            return int(str(response["version"]['number']).split(".")[0])
         except Exception as ex:
             logging.exception(ex)
             return None
@@ -99,50 +206,217 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
         """
         Creates the expected index, if it does not exist
         """
-        response = requests.get('http://{}:{}/{}'.format(self.host, self.port, self._el_index))
-        if response.status_code == 200:
+        if self._es.indices.exists(index=self._el_index):
+            self._setup_namespace_mapping()
             return
-        elif response.status_code == 404:
 
-            properties = {
-                "properties": {
-                    "path": {
-                        "type": "keyword",
-                        "ignore_above": 256
-                    }
+        properties = {
+            "properties": {
+                "path": {
+                    "type": "keyword",
+                    "ignore_above": 256
+                },
+                "namespace": {
+                    "type": "keyword"
                 }
             }
+        }
 
-            if self._el_version == 7:
-                json_data = {
-                    "mappings": properties
-                }
-            else:
-                json_data = {
-                    "mappings": {
-                        self._el_doctype: properties
-                    }
+        if self._el_version == 7:
+            json_data = {
+                "mappings": properties
+            }
+        else:
+            json_data = {
+                "mappings": {
+                    self._el_doctype: properties
                 }
+            }
 
-            response = requests.put(
-                url='http://{}:{}/{}'.format(self.host, self.port, self._el_index),
-                json=json_data
-            )
+        self._es.indices.create(index=self._el_index, body=json_data)
 
-            response.raise_for_status()
-        else:
-            response.raise_for_status()
+    def _setup_namespace_mapping(self):
+        """
+        Adds the namespace field to the mapping of an index created by an earlier version
+        """
+        if self._namespace is None:
+            return
+
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        try:
+            self._es.indices.put_mapping(
+                index=self._el_index,
+                body={"properties": {"namespace": {"type": "keyword"}}},
+                **(el6_params if self._el_version < 7 else {})
+            )
+        except Exception as e:
+            logging.exception(e)
+            echo(f"Could not add the namespace field to the mapping of index '{self._el_index}', "
+                 f"namespace queries might not work as expected: {e}", color='yellow')
 
     def _clear_database(self):
         """
         Removes the index and all data it contains
         """
-        requests.delete('http://{}:{}/{}'.format(self.host, self.port, self._el_index))
+        self._es.indices.delete(index=self._el_index, ignore_unavailable=True)
 
     def _add(self, image_file_path: str, image_data: dict) -> None:
+        record = self._create_record(image_file_path, image_data)
+        if self._write_queue is not None:
+            self._write_queue.put(record)
+            return
+
         # remove existing entries
         self.remove(image_file_path)
-        self._store.add_image(image_file_path, metadata=image_data)
+        self._index(record)
+
+    def _queues_writes(self) -> bool:
+        return self._write_queue is not None
+
+    def import_records(self, records: List[dict]) -> None:
+        timestamp = datetime.now()
+        for i in range(0, len(records), self.BULK_SIZE):
+            batch = []
+            for record in records[i:i + self.BULK_SIZE]:
+                record = dict(record)
+                record['timestamp'] = timestamp
+                if self._namespace is not None:
+                    record[MetadataKey.NAMESPACE.value] = self._namespace
+                batch.append(record)
+            self._write_records(batch)
+
+    def _write_records(self, records: List[dict]) -> None:
+        """
+        Writes multiple records at once, replacing existing entries of the same files.
+        Records marked with REMOVAL_RECORD_KEY only remove the entries of their file.
+        :param records: the records to write
+        """
+        # only the last record of each file counts
+        latest_records = {record[MetadataKey.PATH.value]: record for record in records}
+        self._delete_by_query({
+            'query': self._create_filter_query({"terms": {'path': list(latest_records.keys())}})
+        })
+
+        el6_params = {
+            "_type": self._el_doctype
+        }
+        body = []
+        for record in latest_records.values():
+            if record.get(self.REMOVAL_RECORD_KEY, False):
+                continue
+            body.append({'index': {'_index': self._el_index, **(el6_params if self._el_version < 7 else {})}})
+            body.append(record)
+        if len(body) <= 0:
+            return
+        response = self._bulk(body)
+        if response.get('errors', False):
+            raise AssertionError(f"Bulk write failed for at least one of {len(records)} records")
+
+    def flush(self) -> None:
+        if self._write_queue is None:
+            return
+        if not self._write_queue.flush(timeout=self.WRITE_BEHIND_FLUSH_TIMEOUT):
+            echo(f"Database unavailable, {len(self._write_queue)} records are still queued "
+                 f"and will be written once it is available again", color='yellow')
+
+    def refresh(self) -> None:
+        self.flush()
+        # documents are only searchable after the index has been refreshed, which happens once per second
+        self._es.indices.refresh(index=self._el_index)
+
+    def _create_metadata_dict(self, image_file_path: str) -> dict:
+        image_data = super()._create_metadata_dict(image_file_path)
+        if self._canonical_orientation:
+            image_data[MetadataKey.CANONICAL_ORIENTATION.value] = True
+        return image_data
+
+    def _create_record(self, image_file_path: str, image_data: dict) -> dict:
+        """
+        Analyzes the given image file
+        :param image_file_path: image file path
+        :param image_data: metadata for the image
+        :return: image_match record (signature, words and metadata) to store
+        """
+        record = make_record(image_file_path, self._store.gis, self._store.k, self._store.N, metadata=image_data)
+        if self._canonical_orientation:
+            record = self._orient_record(record, canonical_orientations(record[MetadataKey.SIGNATURE.value])[0])
+        record['timestamp'] = datetime.now()
+        if self._namespace is not None:
+            record[MetadataKey.NAMESPACE.value] = self._namespace
+        return record
+
+    def _orient_record(self, record: dict, orientation: int) -> dict:
+        """
+        :param record: image_match record
+        :param orientation: index into ORIENTATION_PERMUTATIONS
+        :return: copy of the record with the signature (and words) of the rotated and/or mirrored image
+        """
+        signature = np.array(record[MetadataKey.SIGNATURE.value])[ORIENTATION_PERMUTATIONS[orientation]]
+        words = signature_words(signature[None, :], self._store.k, self._store.N)[0]
+
+        record = dict(record)
+        record[MetadataKey.SIGNATURE.value] = signature.tolist()
+        for i, word in enumerate(words.tolist()):
+            record[f"{MetadataKey.WORD_PREFIX.value}{i}"] = word
+        return record
+
+    def _search(self, body: dict, **params) -> dict:
+        return self._es.search(index=self._el_index, body=body, **params)
+
+    def _msearch(self, body: List[dict]) -> dict:
+        return self._es.msearch(body=body, index=self._el_index)
+
+    def _bulk(self, body: List[dict]) -> dict:
+        return self._es.bulk(body=body, index=self._el_index)
+
+    def _index(self, record: dict) -> None:
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        self._es.index(index=self._el_index, body=record, **(el6_params if self._el_version < 7 else {}))
+
+    def _delete_by_query(self, body: dict) -> dict:
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        return self._es.delete_by_query(
+            index=self._el_index,
+            body=body,
+            conflicts="proceed",
+            **(el6_params if self._el_version < 7 else {})
+        )
+
+    def _update_by_query(self, body: dict) -> dict:
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        return self._es.update_by_query(
+            index=self._el_index,
+            body=body,
+            conflicts="proceed",
+            **(el6_params if self._el_version < 7 else {})
+        )
+
+    def set_clusters(self, clusters: Dict[str, List[str]]) -> None:
+        self.flush()
+        paths = {
+            path: [self.cluster_id(representative), 1 if path == representative else 0]
+            for representative, members in clusters.items()
+            for path in [representative] + members
+        }
+        items = list(paths.items())
+        for start in range(0, len(items), self.BULK_SIZE):
+            chunk = dict(items[start:start + self.BULK_SIZE])
+            self._update_by_query({
+                'query': self._create_filter_query({'terms': {MetadataKey.PATH.value: list(chunk.keys())}}),
+                'script': {
+                    'source': self.SET_CLUSTER_SCRIPT,
+                    'lang': 'painless',
+                    'params': {'clusters': chunk}
+                }
+            })
 
     def get(self, image_file_path: str) -> dict or None:
         """
@@ -153,23 +427,18 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
         db_entity = self._get(image_file_path)
         return db_entity
 
-    def _get(self, image_file_path: str) -> dict or None:
+    def _get(self, image_file_path: str, source_excludes: [str] = None) -> dict or None:
         """
         Get a store entry by it's file_path
         :param image_file_path: file path to search for
+        :param source_excludes: fields to omit from the returned entry
         :return: elasticsearch result dictionary
         """
-        es_query = {
-            'query': {
-                "constant_score": {
-                    "filter": {
-                        "term": {'path': image_file_path}
-                    }
-                }
-            }
-        }
+        es_query = self._create_path_query(image_file_path)
+        if source_excludes is not None:
+            es_query['_source'] = {'excludes': source_excludes}
 
-        query_result = self._store.es.search(index=self._el_index, body=es_query)
+        query_result = self._search(es_query)
 
         hits = query_result['hits']['hits']
 
@@ -183,44 +452,380 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
         else:
             return hits[0]['_source']
 
-    def get_all(self) -> (int, object):
+    def get_all(self, fields: List[str] = None) -> (int, object):
         es_query = {
             "track_total_hits": True,
-            'query': {'match_all': {}}
+            'query': self._create_filter_query()
         }
 
-        item_count = self._store.es.search(index=self._el_index, body=es_query, size=0)['hits']['total']
+        item_count = self._search(es_query, size=0)['hits']['total']
         if self._el_version >= 7:
             item_count = item_count['value']
 
+        if fields is not None:
+            es_query['_source'] = {'includes': fields}
+
         from elasticsearch.helpers import scan
 
         el6_params = {
             "doc_type": self._el_doctype
         }
         return item_count, scan(
-            self._store.es,
+            self._es,
             index=self._el_index,
             preserve_order=True,
             query=es_query,
             **(el6_params if self._el_version < 7 else {})
         )
 
-    def find_similar(self, reference_image_file_path: str) -> []:
+    def get_paths_of_generation(self, generation: int = None) -> List[str]:
+        self.flush()
+        field = _metadata_field(MetadataKey.GENERATION)
+        if generation is None:
+            es_query = {
+                'query': self._create_filter_query(),
+                'aggs': {
+                    'generation': {'max': {'field': field}}
+                }
+            }
+            generation = self._search(es_query, size=0)['aggregations']['generation']['value']
+            if generation is None:
+                return []
+            generation = int(generation)
+
+        from elasticsearch.helpers import scan
+
+        el6_params = {
+            "doc_type": self._el_doctype
+        }
+        hits = scan(
+            self._es,
+            index=self._el_index,
+            query={
+                'query': self._create_filter_query({'range': {field: {'gte': generation}}}),
+                '_source': [MetadataKey.PATH.value]
+            },
+            **(el6_params if self._el_version < 7 else {})
+        )
+        return [hit['_source'][MetadataKey.PATH.value] for hit in hits]
+
+    def find_similar(self, reference_image_file_path: str, across_namespaces: bool = False) -> []:
         try:
-            entry = self._get(reference_image_file_path)
+            entry = self._get(reference_image_file_path, source_excludes=self.REFERENCE_EXCLUDED_FIELDS)
             if entry is not None:
-                result = []
-                rec = self._store.search_single_record(entry)
-                result.extend(rec)
-
-                return result
-            else:
-                return self._store.search_image(reference_image_file_path, all_orientations=True)
+                return self._search_records([entry], across_namespaces)[0]
+            # without an entry, rotated and mirrored copies are searched too (like image_match's search_image),
+            # unless the stored signatures are oriented, so the ones of such copies can be found directly
+            record = make_record(reference_image_file_path, self._store.gis, self._store.k, self._store.N)
+            return self._search_records([record], across_namespaces,
+                                        all_orientations=not self._canonical_orientation)[0]
         except Exception as e:
             echo(f"Error querying database for similar images of '{reference_image_file_path}': {e}", color="red")
             return []
 
+    def find_similar_batch(self, reference_image_file_paths: List[str]) -> Dict[str, list]:
+        try:
+            entries = self._get_many(reference_image_file_paths, source_excludes=self.REFERENCE_EXCLUDED_FIELDS)
+        except Exception as e:
+            echo(f"Error querying database for multiple entries: {e}", color="red")
+            entries = {}
+
+        result = {}
+        try:
+            paths = list(entries.keys())
+            for path, similar in zip(paths, self._search_records([entries[path] for path in paths])):
+                result[path] = similar
+        except Exception as e:
+            echo(f"Error querying database for similar images of multiple files: {e}", color="red")
+
+        # fallback for files without a (unique) entry and failed queries
+        for path in reference_image_file_paths:
+            if path not in result:
+                result[path] = self.find_similar(path)
+        return result
+
+    def _get_many(self, image_file_paths: List[str], source_excludes: [str] = None) -> Dict[str, dict]:
+        """
+        Get multiple store entries by their file_path using a single request.
+        Paths with none or more than a single entry are omitted from the result.
+
+        :param image_file_paths: file paths to search for
+        :param source_excludes: fields to omit from the returned entries
+        :return: map of file path -> elasticsearch result dictionary
+        """
+        if len(image_file_paths) <= 0:
+            return {}
+
+        hits = self._search(self._create_get_many_query(image_file_paths, source_excludes))['hits']['hits']
+        return self._get_unique_entries(hits)
+
+    def _create_get_many_query(self, image_file_paths: List[str], source_excludes: [str] = None) -> dict:
+        """
+        :param image_file_paths: file paths to search for
+        :param source_excludes: fields to omit from the returned entries
+        :return: query for all entries of the given file paths
+        """
+        es_query = {
+            'query': self._create_filter_query({"terms": {'path': image_file_paths}}),
+            'size': len(image_file_paths)
+        }
+        if source_excludes is not None:
+            es_query['_source'] = {'excludes': source_excludes}
+        return es_query
+
+    @staticmethod
+    def _get_unique_entries(hits: List[dict]) -> Dict[str, dict]:
+        """
+        :param hits: elasticsearch hits of entries
+        :return: map of file path -> entry, for all paths with a single entry
+        """
+        result = {}
+        duplicates = set()
+        for hit in hits:
+            path = hit['_source'][MetadataKey.PATH.value]
+            if path in result:
+                duplicates.add(path)
+            result[path] = hit['_source']
+        for path in duplicates:
+            result.pop(path)
+        return result
+
+    def _search_records(self, records: List[dict], across_namespaces: bool = False,
+                        all_orientations: bool = False) -> List[list]:
+        """
+        Searches for entries similar to each of the given records using a single request.
+        Only the fields necessary to compute the distance and to rank a hit are fetched,
+        the signature is dropped again once the distance is known.
+
+        :param records: image_match records (signature and words) of the reference images
+        :param across_namespaces: whether to search the entries of all namespaces
+        :param all_orientations: whether to search all rotated and mirrored versions of the records
+        :return: list of hits within the configured maximum distance, for each record
+        """
+        if len(records) <= 0:
+            return []
+        if not self._canonical_orientation and not all_orientations:
+            return self._search_oriented_records(records, across_namespaces)
+
+        # search all orientations, or the canonical orientation of each record and the ones that are nearly canonical
+        oriented_records = []
+        owners = []
+        for owner, record in enumerate(records):
+            signature = record[MetadataKey.SIGNATURE.value]
+            orientations = range(len(ORIENTATION_PERMUTATIONS)) if all_orientations \
+                else canonical_orientations(signature, self.ORIENTATION_MARGIN)
+            for orientation in orientations:
+                oriented_records.append(self._orient_record(record, orientation))
+                owners.append(owner)
+
+        result = [[] for _ in records]
+        found_ids = [set() for _ in records]
+        for owner, similar in zip(owners, self._search_oriented_records(oriented_records, across_namespaces)):
+            for hit in similar:
+                if hit['id'] not in found_ids[owner]:
+                    found_ids[owner].add(hit['id'])
+                    result[owner].append(hit)
+        return result
+
+    def _search_oriented_records(self, records: List[dict], across_namespaces: bool = False) -> List[list]:
+        """
+        Searches for entries similar to each of the given records, as they are.
+        Only the hits within the maximum distance (and at most max_results of them) are kept.
+        Queries with a full page of hits are continued (using search_after) until max_results hits
+        are kept or a page doesn't contain any hit within the maximum distance (the following ones
+        share even less words). Queries that still have more hits after max_pages are reported as truncated.
+        :param records: image_match records (signature and words) of the reference images
+        :param across_namespaces: whether to search the entries of all namespaces
+        :return: list of hits within the configured maximum distance, for each record
+        """
+        queries = [self._create_similarity_query(record, across_namespaces) for record in records]
+        # heap of (-distance, rank, hit) tuples for each record, so the farthest hit is dropped first
+        kept_hits = [[] for _ in records]
+        ranks = [0] * len(records)
+
+        pending = list(range(len(records)))
+        page_count = 0
+        while len(pending) > 0:
+            pages = self._search_similar_hits([queries[i] for i in pending])
+            page_count += 1
+
+            # compute all distances of this page at once, the reference row is repeated for each of its hits
+            signatures = [hit['_source'][MetadataKey.SIGNATURE.value] for page in pages for hit in page]
+            if len(signatures) <= 0:
+                break
+            references = np.repeat(
+                np.array([records[i][MetadataKey.SIGNATURE.value] for i in pending]),
+                [len(page) for page in pages],
+                axis=0
+            )
+            distances = normalized_distances(np.array(signatures), references)
+
+            offset = 0
+            next_pending = []
+            for i, page in zip(pending, pages):
+                page_distances = distances[offset:offset + len(page)]
+                offset += len(page)
+                similar_hits = self._create_similarity_result(page, page_distances)
+                for hit in similar_hits:
+                    item = (-hit[MetadataKey.DISTANCE.value], ranks[i], hit)
+                    ranks[i] += 1
+                    if self._max_results is None or len(kept_hits[i]) < self._max_results:
+                        heapq.heappush(kept_hits[i], item)
+                    else:
+                        heapq.heappushpop(kept_hits[i], item)
+
+                # a full page might be followed by more (less similar) hits
+                if not self._may_have_more_hits(page, queries[i]['size'], len(similar_hits), len(kept_hits[i])):
+                    continue
+                if page_count < self._max_pages:
+                    queries[i]['search_after'] = page[-1]['sort']
+                    next_pending.append(i)
+                else:
+                    self._add_truncated_query(records[i][MetadataKey.PATH.value])
+            pending = next_pending
+
+        # keep the order of elasticsearch
+        return [[hit for _, _, hit in sorted(hits, key=lambda item: item[1])] for hits in kept_hits]
+
+    def _may_have_more_hits(self, page: List[dict], page_size: int, similar_count: int, kept_count: int) -> bool:
+        """
+        :param page: hits of the last page of a query
+        :param page_size: maximum number of hits per page
+        :param similar_count: number of hits of the page within the maximum distance
+        :param kept_count: number of hits kept so far
+        :return: True if the next page of the query might contain more hits that would be kept
+        """
+        return len(page) >= page_size \
+            and similar_count > 0 \
+            and (self._max_results is None or kept_count < self._max_results)
+
+    def _search_similar_hits(self, queries: List[dict]) -> List[List[dict]]:
+        """
+        Runs the given similarity queries using a single multi search request
+        :param queries: similarity queries of the reference images
+        :return: list of elasticsearch hits, for each query
+        """
+        responses = self._msearch(self._create_msearch_body(queries))['responses']
+
+        for response in responses:
+            if 'error' in response:
+                raise AssertionError(f"Similarity search failed: {response['error']}")
+        return [response['hits']['hits'] for response in responses]
+
+    def _create_msearch_body(self, queries: List[dict]) -> List[dict]:
+        """
+        :param queries: similarity queries of the reference images
+        :return: multi search request body containing all queries
+        """
+        body = []
+        for query in queries:
+            body.append({'index': self._el_index})
+            body.append(query)
+        return body
+
+    def _create_similarity_query(self, record: dict, across_namespaces: bool = False) -> dict:
+        """
+        Creates a query for entries that share at least one signature word with the given record.
+
+        :param record: image_match record of the reference image
+        :param across_namespaces: whether to search the entries of all namespaces
+        :return: elasticsearch query
+        """
+        words = [(key, value) for key, value in record.items() if key.startswith(MetadataKey.WORD_PREFIX.value)]
+
+        # leave out words that occur in a large share of all documents (like stop words in text search)
+        hot_words = self._get_hot_words()
+        relevant_words = [word for word in words if word not in hot_words]
+        if len(relevant_words) > 0:
+            words = relevant_words
+
+        should = [{'term': {key: value}} for key, value in words]
+        query = {
+            'bool': {
+                'should': should,
+                'minimum_should_match': min(self._min_should_match, len(should))
+            }
+        }
+        if not across_namespaces:
+            query['bool']['filter'] = self._create_namespace_filter()
+        return {
+            'query': query,
+            '_source': {'includes': self.SIMILARITY_SEARCH_FIELDS},
+            'size': self._store.size,
+            # a unique sort order allows to continue the query with search_after
+            'sort': [
+                {'_score': 'desc'},
+                {MetadataKey.PATH.value: 'asc'},
+                {MetadataKey.NAMESPACE.value: {'order': 'asc', 'unmapped_type': 'keyword'}},
+            ],
+            'timeout': self._store.timeout
+        }
+
+    def _create_similarity_result(self, hits: List[dict], distances: np.ndarray) -> []:
+        """
+        :param hits: elasticsearch hits of a similarity query
+        :param distances: distances of the hits to the reference image
+        :return: list of hits within the configured maximum distance
+        """
+        result = []
+        for hit, distance in zip(hits, distances):
+            if distance >= self._store.distance_cutoff:
+                continue
+
+            source = hit['_source']
+            result.append({
+                'id': hit['_id'],
+                MetadataKey.SCORE.value: hit['_score'],
+                MetadataKey.PATH.value: source[MetadataKey.PATH.value],
+                MetadataKey.NAMESPACE.value: source.get(MetadataKey.NAMESPACE.value),
+                MetadataKey.METADATA.value: source.get(MetadataKey.METADATA.value, {}),
+                MetadataKey.DISTANCE.value: distance,
+            })
+        return result
+
+    def _get_hot_words(self) -> set:
+        """
+        :return: set of (word field, word value) tuples with a document frequency above the hot word threshold
+        """
+        if self._hot_word_threshold is None:
+            return set()
+
+        if self._hot_words is None or datetime.now() - self._hot_words_time > self.HOT_WORDS_MAX_AGE:
+            # at most 1/threshold values of a word position can exceed the threshold
+            count = math.ceil(1 / self._hot_word_threshold)
+            item_count, statistics = self.get_word_statistics(count)
+
+            hot_words = set()
+            if item_count > 0:
+                for field, buckets in statistics.items():
+                    for value, doc_count in buckets:
+                        if doc_count / item_count > self._hot_word_threshold:
+                            hot_words.add((field, value))
+
+            self._hot_words = hot_words
+            self._hot_words_time = datetime.now()
+
+        return self._hot_words
+
+    def get_word_statistics(self, count: int) -> (int, Dict[str, List[tuple]]):
+        fields = [f"{MetadataKey.WORD_PREFIX.value}{i}" for i in range(self._store.N)]
+        es_query = {
+            "track_total_hits": True,
+            'query': self._create_filter_query(),
+            'aggs': {field: {'terms': {'field': field, 'size': count}} for field in fields}
+        }
+
+        response = self._search(es_query, size=0)
+        item_count = response['hits']['total']
+        if self._el_version >= 7:
+            item_count = item_count['value']
+
+        statistics = {}
+        for field in fields:
+            buckets = response['aggregations'][field]['buckets']
+            statistics[field] = [(bucket['key'], bucket['doc_count']) for bucket in buckets]
+        return item_count, statistics
+
     def search_metadata(self, metadata: dict) -> []:
         """
         Search for images with metadata properties.
@@ -237,9 +842,17 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
             'query': {'match': search_dict}
         }
 
-        return self._store.es.search(index=self._el_index, body=es_query)
+        return self._search(es_query)
 
     def remove(self, image_file_path: str) -> None:
+        if self._write_queue is not None:
+            # queued in order with pending writes of the same file, so none of them restores the entry afterwards
+            self._write_queue.put({
+                MetadataKey.PATH.value: image_file_path,
+                self.REMOVAL_RECORD_KEY: True,
+            })
+            return
+
         # NOTE: this query will only work if the index has been created
         # with a custom mapping for the path property:
 
@@ -263,33 +876,51 @@ class ElasticSearchStoreBackend(ImageSignatureStore):
         # }
         # "
 
-        es_query = {
-            'query': {
-                "constant_score": {
-                    "filter": {
-                        "term": {'path': image_file_path}
+        es_query = self._create_path_query(image_file_path)
+
+        self._remove_by_query(es_query)
+
+    def _create_path_query(self, image_file_path: str) -> dict:
+        """
+        :param image_file_path: the path of an image file
+        :return: query for all entries with the given file path
+        """
+        return {
+            'query': self._create_filter_query({"term": {'path': image_file_path}})
+        }
+
+    def _create_namespace_filter(self) -> List[dict]:
+        """
+        :return: filter clauses limiting a query to the entries of the configured namespace
+        """
+        if self._namespace is None:
+            return []
+        return [{"term": {MetadataKey.NAMESPACE.value: self._namespace}}]
+
+    def _create_filter_query(self, *clauses: dict) -> dict:
+        """
+        :param clauses: filter clauses all entries have to match
+        :return: (non scoring) query for all entries of the configured namespace matching all of the given clauses
+        """
+        clauses = list(clauses) + self._create_namespace_filter()
+        if len(clauses) <= 0:
+            return {'match_all': {}}
+        return {
+            "constant_score": {
+                "filter": {
+                    "bool": {
+                        "filter": clauses
                     }
                 }
             }
         }
 
-        self._remove_by_query(es_query)
-
     def remove_all(self) -> None:
         es_query = {
-            'query': {'match_all': {}}
+            'query': self._create_filter_query()
         }
 
         self._remove_by_query(es_query)
 
     def _remove_by_query(self, es_query: dict):
-        el6_params = {
-            "doc_type": self._el_doctype
-        }
-
-        return self._store.es.delete_by_query(
-            index=self._el_index,
-            body=es_query,
-            conflicts="proceed",
-            **(el6_params if self._el_version < 7 else {})
-        )
+        return self._delete_by_query(es_query)
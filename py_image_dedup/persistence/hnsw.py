@@ -0,0 +1,341 @@
+import heapq
+import json
+import math
+import shutil
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+
+class HNSW:
+    """
+    Hierarchical navigable small world graph (Malkov & Yashunin) over the (euclidean)
+    distance between signature rows.
+
+    Each row is linked to its (approximately) nearest neighbours on layer 0 and on a random
+    number of sparser upper layers, which are used to quickly find an entry point close to
+    the query. Rows are inserted incrementally, removed rows are only marked (tombstones)
+    and keep routing queries until the graph is rebuilt. Rows identical to a row of the graph
+    are attached to it and returned along with it.
+
+    Layer 0 is a fixed width matrix of neighbour rows, which is stored as a .npy file and
+    memory mapped (copy on write) on load.
+    """
+
+    HEADER_FILE = "header.json"
+    LINKS_FILE = "links0.npy"
+    LEVELS_FILE = "levels.npy"
+    LAYERS_FILE = "layers.npz"
+
+    # minimum number of rows to allocate
+    MIN_CAPACITY = 1024
+
+    def __init__(self, vectors: Callable[[np.ndarray], np.ndarray], m: int = 16, ef_construction: int = 100,
+                 ef: int = 64, seed: int = 0):
+        """
+        :param vectors: function returning the (float32) signature rows for an array of row indices
+        :param m: number of neighbours per row on the upper layers, twice as many are kept on layer 0
+        :param ef: size of the candidate list when querying, higher values increase recall and query time
+        :param ef_construction: size of the candidate list when inserting, higher values result in a better graph
+        :param seed: seed for choosing the layers of rows
+        """
+        self._vectors = vectors
+        self._m = m
+        self._ef_construction = ef_construction
+        self._ef = ef
+        self._level_factor = 1 / math.log(m)
+        self._random = np.random.default_rng(seed)
+        self._clear()
+
+    def _clear(self):
+        # neighbours on layer 0, by row, padded with -1
+        self._links0 = np.full((0, 2 * self._m), -1, dtype=np.int32)
+        # neighbours on the upper layers, by layer - 1 and row
+        self._links: List[dict] = []
+        # top layer of each row, -1 if the row is not part of the graph, -2 if it is attached to an identical row
+        self._levels = np.zeros(0, dtype=np.int8)
+        # rows attached to identical rows, by the row that is part of the graph
+        self._duplicates = {}
+        self._entry = -1
+        self._size = 0
+        self._removed = set()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, row: int):
+        capacity = len(self._levels)
+        if row < capacity:
+            return
+        capacity = max(row + 1, 2 * capacity, self.MIN_CAPACITY)
+
+        links0 = np.full((capacity, 2 * self._m), -1, dtype=np.int32)
+        links0[:len(self._links0)] = self._links0
+        self._links0 = links0
+        levels = np.full(capacity, -1, dtype=np.int8)
+        levels[:len(self._levels)] = self._levels
+        self._levels = levels
+
+    def _distances(self, rows: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        differences = self._vectors(rows) - reference[None, :]
+        return np.sqrt(np.einsum('ij,ij->i', differences, differences))
+
+    def _neighbours(self, row: int, layer: int) -> list:
+        if layer == 0:
+            links = self._links0[row]
+            return links[links >= 0].tolist()
+        return self._links[layer - 1].get(row, [])
+
+    def _set_neighbours(self, row: int, layer: int, neighbours: list):
+        if layer == 0:
+            self._links0[row] = -1
+            self._links0[row, :len(neighbours)] = neighbours
+        else:
+            self._links[layer - 1][row] = list(neighbours)
+
+    def _search_layer(self, reference: np.ndarray, entry_points: list, ef: int, layer: int) -> (list, int):
+        """
+        Best first search for the nearest rows on a single layer
+        :param reference: signature
+        :param entry_points: list of (distance, row) to start from
+        :param ef: number of nearest rows to keep track of
+        :param layer: layer to search
+        :return: list of up to ef (distance, row) tuples sorted by distance, number of distance computations
+        """
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        nearest = [(-distance, row) for distance, row in entry_points]
+        heapq.heapify(nearest)
+        visited = {row for _, row in entry_points}
+        evaluations = 0
+
+        while len(candidates) > 0:
+            distance, row = heapq.heappop(candidates)
+            if distance > -nearest[0][0]:
+                break
+
+            neighbours = [neighbour for neighbour in self._neighbours(row, layer) if neighbour not in visited]
+            if len(neighbours) == 0:
+                continue
+            visited.update(neighbours)
+            distances = self._distances(np.array(neighbours), reference).tolist()
+            evaluations += len(neighbours)
+
+            for neighbour_distance, neighbour in zip(distances, neighbours):
+                if len(nearest) < ef or neighbour_distance < -nearest[0][0]:
+                    heapq.heappush(candidates, (neighbour_distance, neighbour))
+                    heapq.heappush(nearest, (-neighbour_distance, neighbour))
+                    if len(nearest) > ef:
+                        heapq.heappop(nearest)
+
+        return sorted((-distance, row) for distance, row in nearest), evaluations
+
+    def _select_neighbours(self, candidates: list, count: int) -> list:
+        """
+        Selects neighbours that are closer to the row than to any other selected neighbour,
+        which keeps the graph connected across clusters
+        :param candidates: list of (distance, row) sorted by distance
+        :param count: maximum number of neighbours
+        :return: list of rows
+        """
+        if len(candidates) <= count:
+            return [row for _, row in candidates]
+
+        rows = np.array([row for _, row in candidates])
+        vectors = self._vectors(rows)
+        squared_norms = (vectors ** 2).sum(axis=1)
+        pairwise = squared_norms[:, None] + squared_norms[None, :] - 2 * vectors @ vectors.T
+        distances = np.array([distance for distance, _ in candidates], dtype=np.float32)
+        # whether candidate i is closer to candidate j than to the row
+        is_closer = (pairwise < (distances ** 2)[:, None]).tolist()
+
+        selected = []
+        pruned = []
+        for index in range(len(candidates)):
+            if len(selected) >= count:
+                break
+            closer = is_closer[index]
+            if any(closer[other] for other in selected):
+                pruned.append(index)
+            else:
+                selected.append(index)
+        return rows[selected + pruned[:count - len(selected)]].tolist()
+
+    def _connect(self, row: int, neighbour: int, layer: int):
+        """
+        Adds a link from row to neighbour, dropping the least useful links if there are too many
+        """
+        neighbours = self._neighbours(row, layer) + [neighbour]
+        max_count = 2 * self._m if layer == 0 else self._m
+        if len(neighbours) > max_count:
+            distances = self._distances(np.array(neighbours), self._vectors(np.array([row]))[0]).tolist()
+            neighbours = self._select_neighbours(sorted(zip(distances, neighbours)), max_count)
+        self._set_neighbours(row, layer, neighbours)
+
+    def build(self, rows: np.ndarray):
+        """
+        (Re-)builds the graph for the given rows
+        :param rows: row indices
+        """
+        self._clear()
+        for row in np.asarray(rows, dtype=np.int64).tolist():
+            self.insert(row)
+
+    def insert(self, row: int):
+        """
+        Adds a row to the graph
+        :param row: row index
+        """
+        self._ensure_capacity(row)
+        if self._levels[row] != -1:
+            return
+
+        vector = self._vectors(np.array([row]))[0]
+        level = min(int(-math.log(1.0 - self._random.random()) * self._level_factor), 127)
+        self._size += 1
+
+        if self._entry < 0:
+            self._set_level(row, level)
+            self._entry = row
+            return
+
+        entry_level = int(self._levels[self._entry])
+        nearest = [(float(self._distances(np.array([self._entry]), vector)[0]), self._entry)]
+        for layer in range(entry_level, level, -1):
+            nearest, _ = self._search_layer(vector, nearest[:1], 1, layer)
+        for layer in range(min(level, entry_level), -1, -1):
+            nearest, _ = self._search_layer(vector, nearest, self._ef_construction, layer)
+            if level == 0 and nearest[0][0] == 0:
+                # identical signatures would crowd out each other's links, so they are attached to the
+                # first one instead of being linked
+                self._levels[row] = -2
+                self._duplicates.setdefault(nearest[0][1], []).append(row)
+                return
+            self._set_level(row, level)
+            neighbours = self._select_neighbours(nearest, self._m)
+            self._set_neighbours(row, layer, neighbours)
+            for neighbour in neighbours:
+                self._connect(neighbour, row, layer)
+
+        if level > entry_level:
+            self._entry = row
+
+    def _set_level(self, row: int, level: int):
+        self._levels[row] = level
+        while len(self._links) < level:
+            self._links.append({})
+
+    def remove(self, row: int):
+        """
+        Marks a row as removed, it is still used to route queries until the graph is rebuilt
+        :param row: row index
+        """
+        self._removed.add(row)
+
+    def _search(self, reference: np.ndarray, ef: int) -> (list, int):
+        """
+        :param reference: signature
+        :param ef: number of nearest rows to search for
+        :return: list of up to ef (distance, row) tuples sorted by distance, number of distance computations
+        """
+        if self._entry < 0:
+            return [], 0
+
+        nearest = [(float(self._distances(np.array([self._entry]), reference)[0]), self._entry)]
+        evaluations = 1
+        for layer in range(int(self._levels[self._entry]), 0, -1):
+            nearest, layer_evaluations = self._search_layer(reference, nearest, 1, layer)
+            evaluations += layer_evaluations
+        nearest, layer_evaluations = self._search_layer(reference, nearest, ef, 0)
+        return nearest, evaluations + layer_evaluations
+
+    def query_radius(self, reference: np.ndarray, radius: float) -> (np.ndarray, int):
+        """
+        Finds (approximately) all rows within the given (euclidean) distance of the reference signature.
+        The candidate list is enlarged as long as all of its rows are within the radius.
+        :param reference: signature
+        :param radius: maximum euclidean distance (inclusive)
+        :return: row indices, number of distance computations
+        """
+        reference = np.asarray(reference, dtype=np.float32)
+        ef = self._ef
+        evaluations = 0
+        while True:
+            nearest, search_evaluations = self._search(reference, ef)
+            evaluations += search_evaluations
+            if len(nearest) < ef or nearest[-1][0] > radius or ef >= self._size:
+                break
+            ef *= 2
+
+        rows = [
+            duplicate
+            for distance, row in nearest if distance <= radius
+            for duplicate in [row] + self._duplicates.get(row, []) if duplicate not in self._removed
+        ]
+        return np.array(rows, dtype=np.int64), evaluations
+
+    def save(self, directory: Path):
+        """
+        Writes the graph to a directory, replacing it
+        :param directory: target directory
+        """
+        tmp_directory = directory.parent / f"{directory.name}.tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        tmp_directory.mkdir()
+
+        np.save(tmp_directory / self.LINKS_FILE, self._links0)
+        np.save(tmp_directory / self.LEVELS_FILE, self._levels)
+        layers = {
+            "removed": np.array(sorted(self._removed), dtype=np.int64),
+            "duplicate_rows": np.array([row for rows in self._duplicates.values() for row in rows], dtype=np.int64),
+            "duplicate_sizes": np.array([len(rows) for rows in self._duplicates.values()], dtype=np.int64),
+            "duplicate_targets": np.array(list(self._duplicates.keys()), dtype=np.int64),
+        }
+        for layer, links in enumerate(self._links):
+            rows = sorted(links.keys())
+            layers[f"{layer}_rows"] = np.array(rows, dtype=np.int64)
+            layers[f"{layer}_sizes"] = np.array([len(links[row]) for row in rows], dtype=np.int64)
+            layers[f"{layer}_links"] = np.array([link for row in rows for link in links[row]], dtype=np.int64)
+        np.savez(tmp_directory / self.LAYERS_FILE, **layers)
+        (tmp_directory / self.HEADER_FILE).write_text(json.dumps({
+            "m": self._m,
+            "entry": self._entry,
+            "size": self._size,
+            "layer_count": len(self._links),
+        }))
+
+        # a missing directory just causes a rebuild, a partially written one would be worse
+        old_directory = directory.parent / f"{directory.name}.old"
+        if directory.exists():
+            directory.rename(old_directory)
+        tmp_directory.rename(directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: Path, vectors: Callable[[np.ndarray], np.ndarray], **kwargs) -> 'HNSW':
+        """
+        Reads a graph written by save()
+        :param directory: graph directory
+        :param vectors: function returning the (float32) signature rows for an array of row indices
+        :param kwargs: constructor arguments, the ones that define the structure of the graph are read from disk
+        :return: the graph
+        """
+        header = json.loads((directory / cls.HEADER_FILE).read_text())
+        graph = cls(vectors, **{**kwargs, "m": header["m"]})
+        graph._links0 = np.load(directory / cls.LINKS_FILE, mmap_mode='c')
+        graph._levels = np.load(directory / cls.LEVELS_FILE)
+        graph._entry = header["entry"]
+        graph._size = header["size"]
+        with np.load(directory / cls.LAYERS_FILE) as layers:
+            graph._removed = set(layers["removed"].tolist())
+            duplicates = np.split(layers["duplicate_rows"], np.cumsum(layers["duplicate_sizes"])[:-1])
+            graph._duplicates = {
+                row: rows.tolist() for row, rows in zip(layers["duplicate_targets"].tolist(), duplicates)
+            }
+            for layer in range(header["layer_count"]):
+                links = np.split(layers[f"{layer}_links"], np.cumsum(layers[f"{layer}_sizes"])[:-1])
+                graph._links.append({
+                    row: row_links.tolist() for row, row_links in zip(layers[f"{layer}_rows"].tolist(), links)
+                })
+        return graph
@@ -0,0 +1,699 @@
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+from image_match.goldberg import ImageSignature
+from image_match.signature_database_base import make_record
+
+from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.hnsw import HNSW
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.persistence.vptree import VPTree, euclidean_radius
+from py_image_dedup.util import echo, image
+from py_image_dedup.util.signature import signature_words, normalized_distances, hamming_distances
+
+INDEX_TYPE_VPTREE = "vptree"
+INDEX_TYPE_HNSW = "hnsw"
+
+
+class MemoryStoreBackend(ImageSignatureStore):
+    """
+    Image signature persistence keeping all signatures in a single contiguous int8 matrix.
+
+    Queries are answered by an exact, vectorized scan over the whole matrix, which is
+    faster than any index lookup for libraries that fit into memory. The matrix, the
+    signature norms and the metadata columns are memory mapped files, so starting up
+    only maps them. Replaced and removed entries are marked as deleted and compacted
+    away once they make up a large share of all rows.
+
+    Optionally, an index can be used to answer queries without comparing them to every row:
+    a vantage point tree (exact) or a HNSW graph (approximate). The index references rows
+    of the matrix and is updated incrementally.
+
+    Without an index, the scan can be restricted to rows whose 64 bit difference hash is
+    within a maximum hamming distance of the one of the reference image. Hashes are compared
+    with a XOR/popcount over a single uint64 column, so only the shortlisted rows are compared
+    by signature. Rows (and reference images) without a hash are always compared.
+
+    Since there is no text search involved, the score of a hit is its similarity (1 - distance).
+    """
+
+    # image_match defaults
+    SIGNATURE_LENGTH = 648
+    WORD_WIDTH = 16
+    WORD_COUNT = 63
+
+    # number of rows compared to the reference images at once
+    BLOCK_SIZE = 8192
+    # minimum number of rows to allocate
+    MIN_CAPACITY = 1024
+    # share of deleted rows above which the store is compacted on flush
+    COMPACTION_THRESHOLD = 0.25
+
+    # metadata columns and their type, missing values are stored as -1
+    METADATA_COLUMNS = {
+        MetadataKey.DATAMODEL_VERSION.value: np.int16,
+        MetadataKey.FILE_SIZE.value: np.int64,
+        MetadataKey.FILE_MODIFICATION_DATE.value: np.float64,
+        MetadataKey.PIXELCOUNT.value: np.int64,
+        MetadataKey.EXIF_DATA_COUNT.value: np.int32,
+        # -1 is a valid (signed) hash, whether a row has one is stored separately (see _has_dhash)
+        MetadataKey.DHASH.value: np.int64,
+        MetadataKey.GENERATION.value: np.int64,
+        MetadataKey.CLUSTER.value: np.int64,
+        MetadataKey.REPRESENTATIVE.value: np.int8,
+    }
+
+    HEADER_FILE = "header.json"
+    PATHS_FILE = "paths.txt"
+    # index type -> (index class, file name)
+    INDEX_TYPES = {
+        INDEX_TYPE_VPTREE: (VPTree, "vptree.npz"),
+        INDEX_TYPE_HNSW: (HNSW, "hnsw"),
+    }
+
+    def __init__(self,
+                 directory: Path,
+                 max_dist: float = 0.03,
+                 index: str = None,
+                 index_options: dict = None,
+                 dhash_max_distance: int = None,
+                 cluster_margin: float = None,
+                 use_exif_data: bool = True,
+                 ):
+        """
+        :param directory: directory to store the memory mapped files in, created if it does not exist
+        :param max_dist: maximum "difference" allowed, ranging from [0 .. 1] where 0.2 is still a pretty similar image
+        :param index: (optional) type of index to use for queries, one of INDEX_TYPES,
+                      all rows are compared to each query if unset
+        :param index_options: (optional) constructor arguments of the index
+        :param dhash_max_distance: (optional) maximum hamming distance between the difference hashes of
+                                   a row and a reference image for the row to be compared by signature
+        :param cluster_margin: (optional) when set, members of duplicate clusters (see set_clusters) are
+                               only compared to a reference image if the distance of their representative
+                               is within this margin of max_dist
+        """
+        super().__init__(use_exif_data)
+
+        self._directory = directory
+        self._max_dist = max_dist
+        self._index_type = index
+        self._index_options = index_options or {}
+        self._dhash_max_distance = dhash_max_distance
+        self._cluster_margin = cluster_margin
+
+        self._gis = ImageSignature()
+        self._lock = threading.RLock()
+
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        """
+        Maps the files of an existing store, or creates an empty one
+        """
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        header_file = self._directory / self.HEADER_FILE
+        header = {}
+        if header_file.exists():
+            header = json.loads(header_file.read_text())
+        self._row_count = header.get("row_count", 0)
+
+        if self._row_count > 0:
+            self._signatures = self._open_array("signatures")
+            self._norms = self._open_array("norms")
+            self._deleted = self._open_array("deleted")
+            self._columns = {key: self._open_column(key, dtype) for key, dtype in self.METADATA_COLUMNS.items()}
+            self._has_dhash = self._open_has_dhash()
+        else:
+            self._allocate(self.MIN_CAPACITY)
+
+        # rows that have been appended after the last flush are lost
+        paths_file = self._directory / self.PATHS_FILE
+        lines = paths_file.read_text().splitlines() if paths_file.exists() else []
+        # each line is a json string, parse all of them at once
+        self._paths = json.loads("[" + ",".join(lines[:self._row_count]) + "]")
+        if paths_file.exists() and len(lines) == len(self._paths):
+            self._paths_file = open(paths_file, 'a')
+        else:
+            self._write_paths_file()
+
+        deleted = self._deleted[:len(self._paths)].tolist()
+        self._rows = {path: row for row, path in enumerate(self._paths) if not deleted[row]}
+        self._deleted_count = self._row_count - len(self._rows)
+        self._dirty = False
+
+        self._index = self._load_index(header.get("index_row_count"))
+
+    def _vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        :param rows: row indices
+        :return: signatures of the given rows
+        """
+        return self._signatures[rows].astype(np.float32)
+
+    def _load_index(self, index_row_count: int or None):
+        """
+        :param index_row_count: number of rows the persisted index covers
+        :return: the configured index, loaded from disk if it is up to date, otherwise rebuilt
+        """
+        if self._index_type is None:
+            return None
+
+        index_class, index_file_name = self.INDEX_TYPES[self._index_type]
+        index_file = self._directory / index_file_name
+        if index_file.exists() and index_row_count == self._row_count:
+            return index_class.load(index_file, self._vectors, **self._index_options)
+
+        echo(f"Building {self._index_type} index for {len(self._rows)} signatures...")
+        index = index_class(self._vectors, **self._index_options)
+        index.build(np.flatnonzero(~self._deleted[:self._row_count]))
+        self._dirty = True
+        return index
+
+    def _array_file(self, name: str) -> Path:
+        return self._directory / f"{name}.npy"
+
+    def _open_array(self, name: str) -> np.ndarray:
+        return np.lib.format.open_memmap(self._array_file(name), mode='r+')
+
+    def _open_column(self, key: str, dtype) -> np.ndarray:
+        """
+        Maps a metadata column, columns added after the store was created are filled with missing values
+        :param key: metadata key
+        :param dtype: type of the column
+        :return: the memory mapped column
+        """
+        if self._array_file(key).exists():
+            return self._open_array(key)
+        column = self._create_array(key, dtype, (len(self._signatures),))
+        column[:] = -1
+        return column
+
+    def _open_has_dhash(self) -> np.ndarray:
+        """
+        Maps whether each row has a difference hash, stores created before this was stored
+        treated the hash -1 as missing
+        :return: the memory mapped array
+        """
+        if self._array_file("has_dhash").exists():
+            return self._open_array("has_dhash")
+        return self._create_array("has_dhash", np.bool_, (len(self._signatures),),
+                                  self._columns[MetadataKey.DHASH.value] != -1)
+
+    def _create_array(self, name: str, dtype, shape: tuple, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Creates (or replaces) a memory mapped array file
+        :param name: name of the array
+        :param dtype: type of the array
+        :param shape: shape of the array
+        :param rows: (optional) initial content of the first rows
+        :return: the memory mapped array
+        """
+        tmp_file = self._directory / f"{name}.tmp.npy"
+        array = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype, shape=shape)
+        if rows is not None:
+            array[:len(rows)] = rows
+        array.flush()
+        del array
+        os.replace(tmp_file, self._array_file(name))
+        return self._open_array(name)
+
+    def _allocate(self, capacity: int, keep: np.ndarray = None):
+        """
+        (Re-)creates all arrays with the given capacity
+        :param capacity: number of rows
+        :param keep: (optional) indices of the existing rows to keep, in order
+        """
+        def rows(array):
+            return array[keep] if keep is not None else None
+
+        self._signatures = self._create_array(
+            "signatures", np.int8, (capacity, self.SIGNATURE_LENGTH), rows(getattr(self, '_signatures', None)))
+        self._norms = self._create_array("norms", np.float32, (capacity,), rows(getattr(self, '_norms', None)))
+        self._deleted = self._create_array("deleted", np.bool_, (capacity,), rows(getattr(self, '_deleted', None)))
+        self._has_dhash = self._create_array(
+            "has_dhash", np.bool_, (capacity,), rows(getattr(self, '_has_dhash', None)))
+        old_columns = getattr(self, '_columns', {})
+        self._columns = {
+            key: self._create_array(key, dtype, (capacity,), rows(old_columns.get(key)))
+            for key, dtype in self.METADATA_COLUMNS.items()
+        }
+
+    def _ensure_capacity(self, row_count: int):
+        capacity = len(self._signatures)
+        if row_count <= capacity:
+            return
+        while capacity < row_count:
+            capacity *= 2
+        self._allocate(capacity, keep=np.arange(self._row_count))
+
+    def _write_paths_file(self):
+        paths_file = self._directory / self.PATHS_FILE
+        tmp_file = self._directory / f"{self.PATHS_FILE}.tmp"
+        with open(tmp_file, 'w') as f:
+            for path in self._paths:
+                f.write(json.dumps(path) + "\n")
+        os.replace(tmp_file, paths_file)
+        self._paths_file = open(paths_file, 'a')
+
+    def _add(self, image_file_path: str, image_data: dict) -> None:
+        record = make_record(image_file_path, self._gis, self.WORD_WIDTH, self.WORD_COUNT, metadata=image_data)
+        self.import_records([record])
+
+    def import_records(self, records: List[dict]) -> None:
+        if len(records) <= 0:
+            return
+
+        signatures = np.array([record[MetadataKey.SIGNATURE.value] for record in records], dtype=np.int8)
+        norms = np.linalg.norm(signatures.astype(np.float32), axis=1)
+        columns = {
+            key: np.array([record.get(MetadataKey.METADATA.value, {}).get(key, -1) for record in records],
+                          dtype=dtype)
+            for key, dtype in self.METADATA_COLUMNS.items()
+        }
+        has_dhash = np.array([MetadataKey.DHASH.value in record.get(MetadataKey.METADATA.value, {})
+                              for record in records], dtype=np.bool_)
+
+        with self._lock:
+            start = self._row_count
+            end = start + len(records)
+            self._ensure_capacity(end)
+
+            self._signatures[start:end] = signatures
+            self._norms[start:end] = norms
+            self._deleted[start:end] = False
+            self._has_dhash[start:end] = has_dhash
+            for key, values in columns.items():
+                self._columns[key][start:end] = values
+
+            for row, record in enumerate(records, start=start):
+                path = record[MetadataKey.PATH.value]
+                self._mark_deleted(path)
+                self._paths.append(path)
+                self._rows[path] = row
+                self._paths_file.write(json.dumps(path) + "\n")
+                if self._index is not None:
+                    self._index.insert(row)
+            self._row_count = end
+            self._dirty = True
+
+    def _mark_deleted(self, image_file_path: str):
+        row = self._rows.pop(image_file_path, None)
+        if row is not None:
+            self._deleted[row] = True
+            self._deleted_count += 1
+            self._dirty = True
+            if self._index is not None:
+                self._index.remove(row)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+
+            if self._deleted_count > self._row_count * self.COMPACTION_THRESHOLD:
+                self._compact()
+
+            for array in [self._signatures, self._norms, self._deleted, self._has_dhash] + \
+                    list(self._columns.values()):
+                array.flush()
+            self._paths_file.flush()
+            os.fsync(self._paths_file.fileno())
+
+            header_file = self._directory / self.HEADER_FILE
+            tmp_file = self._directory / f"{self.HEADER_FILE}.tmp"
+            header = {"row_count": self._row_count}
+            if self._index is not None:
+                self._index.save(self._directory / self.INDEX_TYPES[self._index_type][1])
+                header["index_row_count"] = self._row_count
+            tmp_file.write_text(json.dumps(header))
+            os.replace(tmp_file, header_file)
+            self._dirty = False
+
+    def _compact(self):
+        """
+        Removes all deleted rows
+        """
+        keep = np.flatnonzero(~self._deleted[:self._row_count])
+        self._paths_file.close()
+        self._allocate(max(self.MIN_CAPACITY, len(keep) * 2), keep=keep)
+        self._paths = [self._paths[row] for row in keep]
+        self._write_paths_file()
+        self._rows = {path: row for row, path in enumerate(self._paths)}
+        self._row_count = len(keep)
+        self._deleted_count = 0
+        if self._index is not None:
+            self._index.build(np.arange(self._row_count))
+
+    def get(self, image_file_path: str) -> dict or None:
+        """
+        Get a store entry by it's file_path
+        :param image_file_path: file path to search for
+        :return:
+        """
+        with self._lock:
+            row = self._rows.get(image_file_path)
+            if row is None:
+                return None
+            return self._create_entries(np.array([row]))[0]
+
+    def _create_entries(self, rows: np.ndarray) -> List[dict]:
+        """
+        :param rows: row indices
+        :return: image_match records of the given rows
+        """
+        signatures = np.asarray(self._signatures[rows])
+        words = signature_words(signatures, self.WORD_WIDTH, self.WORD_COUNT).tolist()
+        result = []
+        for i, row in enumerate(rows.tolist()):
+            entry = {
+                MetadataKey.PATH.value: self._paths[row],
+                MetadataKey.SIGNATURE.value: signatures[i].tolist(),
+                MetadataKey.METADATA.value: self._create_metadata(row),
+            }
+            for position, word in enumerate(words[i]):
+                entry[f"{MetadataKey.WORD_PREFIX.value}{position}"] = word
+            result.append(entry)
+        return result
+
+    def _create_metadata(self, row: int, columns: Dict[str, np.ndarray] = None,
+                         has_dhash: np.ndarray = None) -> dict:
+        """
+        :param row: row index
+        :param columns: (optional) metadata columns to use
+        :param has_dhash: (optional) whether each row has a difference hash, to use along with the columns
+        :return: metadata of the given row
+        """
+        columns = columns if columns is not None else self._columns
+        has_dhash = has_dhash if has_dhash is not None else self._has_dhash
+        metadata = {}
+        for key, column in columns.items():
+            value = column[row].item()
+            if key == MetadataKey.DHASH.value:
+                if has_dhash[row]:
+                    metadata[key] = value
+            elif value != -1:
+                metadata[key] = value
+        return metadata
+
+    def get_all(self, fields: List[str] = None) -> (int, object):
+        # all fields are held in memory anyway
+        with self._lock:
+            count = len(self._rows)
+            row_count = self._row_count
+
+        def entries():
+            for start in range(0, row_count, self.BLOCK_SIZE):
+                with self._lock:
+                    rows = np.arange(start, min(start + self.BLOCK_SIZE, row_count))
+                    rows = rows[~self._deleted[rows]]
+                    block = self._create_entries(rows)
+                for row, entry in zip(rows.tolist(), block):
+                    yield {'_id': row, '_source': entry}
+
+        return count, entries()
+
+    def get_paths_of_generation(self, generation: int = None) -> List[str]:
+        with self._lock:
+            rows = np.flatnonzero(~self._deleted[:self._row_count])
+            generations = self._columns[MetadataKey.GENERATION.value][rows]
+            paths = self._paths
+
+        if generation is None:
+            if not np.any(generations != -1):
+                return []
+            generation = generations.max().item()
+        return [paths[row] for row in rows[generations >= generation].tolist()]
+
+    def uses_dhash(self) -> bool:
+        return self._dhash_max_distance is not None
+
+    def uses_clusters(self) -> bool:
+        return self._cluster_margin is not None
+
+    def set_clusters(self, clusters: Dict[str, List[str]]) -> None:
+        with self._lock:
+            cluster_column = self._columns[MetadataKey.CLUSTER.value]
+            representative_column = self._columns[MetadataKey.REPRESENTATIVE.value]
+            for representative, members in clusters.items():
+                cluster_id = self.cluster_id(representative)
+                for path in [representative] + members:
+                    row = self._rows.get(path)
+                    if row is None:
+                        continue
+                    cluster_column[row] = cluster_id
+                    representative_column[row] = 1 if path == representative else 0
+            self._dirty = True
+
+    def get_word_statistics(self, count: int) -> (int, Dict[str, List[tuple]]):
+        with self._lock:
+            rows = np.flatnonzero(~self._deleted[:self._row_count])
+            signatures = self._signatures
+
+        words = np.concatenate([
+            signature_words(signatures[rows[i:i + self.BLOCK_SIZE]], self.WORD_WIDTH, self.WORD_COUNT)
+            for i in range(0, len(rows), self.BLOCK_SIZE)
+        ] or [np.zeros((0, self.WORD_COUNT), dtype=np.int64)])
+
+        statistics = {}
+        for position in range(self.WORD_COUNT):
+            values, counts = np.unique(words[:, position], return_counts=True)
+            top = np.argsort(-counts, kind='stable')[:count]
+            statistics[f"{MetadataKey.WORD_PREFIX.value}{position}"] = list(
+                zip(values[top].tolist(), counts[top].tolist()))
+        return len(rows), statistics
+
+    def find_similar(self, reference_image_file_path: str, across_namespaces: bool = False) -> []:
+        """
+        Search for similar images to the specified one
+
+        :param reference_image_file_path: the reference image file
+        :param across_namespaces: ignored, namespaces are only supported by the elasticsearch backend
+        :return: list of images that are similar to the reference file
+        """
+        return self.find_similar_batch([reference_image_file_path])[reference_image_file_path]
+
+    def find_similar_batch(self, reference_image_file_paths: List[str]) -> Dict[str, list]:
+        references = []
+        reference_hashes = []
+        for path in reference_image_file_paths:
+            try:
+                with self._lock:
+                    row = self._rows.get(path)
+                    signature = np.array(self._signatures[row]) if row is not None else None
+                    dhash = self._columns[MetadataKey.DHASH.value][row].item() \
+                        if row is not None and self._has_dhash[row] else None
+                if signature is None:
+                    signature = np.array(self._gis.generate_signature(path), dtype=np.int8)
+                    dhash = image.get_dhash(path) if self.uses_dhash() else None
+                references.append(signature)
+                reference_hashes.append(dhash)
+            except Exception as e:
+                echo(f"Error computing signature of '{path}': {e}", color="red")
+                references.append(None)
+
+        valid = [signature for signature in references if signature is not None]
+        similar = iter(
+            self._search_signatures(np.array(valid), reference_hashes)
+            if len(valid) > 0 else []
+        )
+        return {
+            path: next(similar) if signature is not None else []
+            for path, signature in zip(reference_image_file_paths, references)
+        }
+
+    def _search_signatures(self, references: np.ndarray, reference_hashes: List[int or None]) -> List[list]:
+        """
+        :param references: b x m matrix of reference signatures
+        :param reference_hashes: difference hashes of the reference images, None if unknown
+        :return: list of hits within the configured maximum distance, for each reference
+        """
+        max_dist = self._max_dist
+        excluded = None
+        with self._lock:
+            columns = dict(self._columns)
+            has_dhash = self._has_dhash
+            paths = self._paths
+            if self._cluster_margin is not None:
+                max_dist += self._cluster_margin
+                excluded = self._cluster_members()
+            if self._index is not None:
+                hit_rows, hit_distances = self._search_index(references, max_dist, excluded)
+        if self._index is None:
+            hit_rows, hit_distances = self._search_matrix(references, reference_hashes, max_dist, excluded)
+        if self._cluster_margin is not None:
+            hit_rows, hit_distances = self._search_cluster_members(references, hit_rows, hit_distances, excluded)
+
+        result = []
+        for rows, distances in zip(hit_rows, hit_distances):
+            result.append([
+                {
+                    'id': row,
+                    MetadataKey.SCORE.value: 1.0 - float(distance),
+                    MetadataKey.PATH.value: paths[row],
+                    MetadataKey.METADATA.value: self._create_metadata(row, columns, has_dhash),
+                    MetadataKey.DISTANCE.value: float(distance),
+                }
+                for row, distance in zip(rows, distances)
+            ])
+        return result
+
+    def _cluster_members(self) -> np.ndarray:
+        """
+        :return: whether each row is a member (but not the representative) of a duplicate cluster.
+                 Rows of clusters whose representative has been removed or changed are not members anymore.
+        """
+        clusters = self._columns[MetadataKey.CLUSTER.value][:self._row_count]
+        representatives = self._columns[MetadataKey.REPRESENTATIVE.value][:self._row_count]
+        is_representative = (representatives == 1) & ~self._deleted[:self._row_count]
+        return (representatives == 0) & np.isin(clusters, clusters[is_representative])
+
+    def _search_cluster_members(self, references: np.ndarray, hit_rows: List[list], hit_distances: List[list],
+                                members: np.ndarray) -> (List[list], List[list]):
+        """
+        Compares the members of all clusters whose representative is close to max_dist to the references,
+        members of clusters whose representative is clearly similar or different are skipped.
+        :param references: b x m matrix of reference signatures
+        :param hit_rows: hit rows within max_dist + cluster_margin, for each reference (members excluded)
+        :param hit_distances: hit distances, for each reference
+        :param members: whether each row is a member of a cluster
+        :return: hit rows, hit distances within max_dist, for each reference
+        """
+        with self._lock:
+            clusters = self._columns[MetadataKey.CLUSTER.value]
+            representatives = self._columns[MetadataKey.REPRESENTATIVE.value]
+            signatures = self._signatures
+            deleted = self._deleted
+
+        result_rows = []
+        result_distances = []
+        for reference, rows, distances in zip(references, hit_rows, hit_distances):
+            rows, distances = np.array(rows, dtype=np.int64), np.array(distances)
+            is_near = (representatives[rows] == 1) & (np.abs(distances - self._max_dist) < self._cluster_margin)
+            member_rows = np.flatnonzero(np.isin(clusters[:len(members)], clusters[rows[is_near]]) & members)
+            member_rows = member_rows[~deleted[member_rows]]
+            member_distances = normalized_distances(
+                signatures[member_rows], np.repeat(reference[None, :], len(member_rows), axis=0))
+
+            rows, distances = np.concatenate([rows, member_rows]), np.concatenate([distances, member_distances])
+            is_hit = distances < self._max_dist
+            result_rows.append(rows[is_hit].tolist())
+            result_distances.append(distances[is_hit].tolist())
+        return result_rows, result_distances
+
+    def _search_index(self, references: np.ndarray, max_dist: float,
+                      excluded: np.ndarray = None) -> (List[list], List[list]):
+        """
+        Queries the index for rows within the euclidean radius that contains all hits, and verifies them
+        :param references: b x m matrix of reference signatures
+        :param max_dist: maximum distance of hits
+        :param excluded: (optional) whether each row is skipped
+        :return: hit rows, hit distances, for each reference
+        """
+        hit_rows = []
+        hit_distances = []
+        for reference in references:
+            radius = euclidean_radius(max_dist, float(np.linalg.norm(reference.astype(np.float32))))
+            rows, _ = self._index.query_radius(reference, radius)
+            rows = rows[~self._deleted[rows]]
+            if excluded is not None:
+                rows = rows[~excluded[rows]]
+            distances = normalized_distances(self._signatures[rows], np.repeat(reference[None, :], len(rows), axis=0))
+            is_hit = distances < max_dist
+            hit_rows.append(rows[is_hit].tolist())
+            hit_distances.append(distances[is_hit].tolist())
+        return hit_rows, hit_distances
+
+    def _search_matrix(self, references: np.ndarray, reference_hashes: List[int or None], max_dist: float,
+                       excluded: np.ndarray = None) -> (List[list], List[list]):
+        """
+        Compares the given signatures to all (shortlisted) rows, one block of rows at a time
+        :param references: b x m matrix of reference signatures
+        :param reference_hashes: difference hashes of the reference images, None if unknown
+        :param max_dist: maximum distance of hits
+        :param excluded: (optional) whether each row is skipped
+        :return: hit rows, hit distances, for each reference
+        """
+        with self._lock:
+            row_count = self._row_count
+            signatures = self._signatures
+            norms = self._norms
+            deleted = self._deleted
+            hashes = self._columns[MetadataKey.DHASH.value]
+            has_dhash = self._has_dhash
+
+        has_reference_hash = np.array([dhash is not None for dhash in reference_hashes], dtype=np.bool_)
+        reference_hashes = np.array([dhash if dhash is not None else 0 for dhash in reference_hashes], dtype=np.int64)
+        references = references.astype(np.float32)
+        reference_norms = np.linalg.norm(references, axis=1)
+
+        hit_rows = [[] for _ in references]
+        hit_distances = [[] for _ in references]
+        for start in range(0, row_count, self.BLOCK_SIZE):
+            end = min(start + self.BLOCK_SIZE, row_count)
+            skipped = deleted[start:end]
+            if excluded is not None:
+                skipped = skipped | excluded[start:end]
+            if self._dhash_max_distance is not None:
+                rows, reference_indices = np.nonzero(
+                    self._shortlist(hashes[start:end], has_dhash[start:end], reference_hashes, has_reference_hash)
+                    & ~skipped[:, None])
+                rows += start
+                # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b, for each shortlisted pair
+                products = np.einsum('ij,ij->i', signatures[rows].astype(np.float32), references[reference_indices])
+                squared = norms[rows] ** 2 + reference_norms[reference_indices] ** 2 - 2 * products
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    distances = np.sqrt(np.maximum(squared, 0)) / (norms[rows] + reference_norms[reference_indices])
+                distances[np.isnan(distances)] = 1.0
+
+                is_hit = distances < max_dist
+                for row, reference, distance in zip(rows[is_hit], reference_indices[is_hit], distances[is_hit]):
+                    hit_rows[reference].append(row)
+                    hit_distances[reference].append(distance)
+                continue
+
+            # only rows that aren't skipped are compared
+            rows = np.flatnonzero(~skipped) + start
+            block = signatures[rows].astype(np.float32)
+            block_norms = norms[rows]
+
+            # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+            squared = (block_norms ** 2)[:, None] + (reference_norms ** 2)[None, :] - 2 * (block @ references.T)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                distances = np.sqrt(np.maximum(squared, 0)) / (block_norms[:, None] + reference_norms[None, :])
+            distances[np.isnan(distances)] = 1.0
+
+            for row, reference in zip(*np.nonzero(distances < max_dist)):
+                hit_rows[reference].append(rows[row])
+                hit_distances[reference].append(distances[row, reference])
+        return hit_rows, hit_distances
+
+    def _shortlist(self, hashes: np.ndarray, has_hash: np.ndarray, reference_hashes: np.ndarray,
+                   has_reference_hash: np.ndarray) -> np.ndarray:
+        """
+        :param hashes: difference hashes of a block of rows
+        :param has_hash: whether each row of the block has a difference hash
+        :param reference_hashes: difference hashes of the reference images
+        :param has_reference_hash: whether each reference image has a difference hash
+        :return: rows x references matrix of whether a row has to be compared to a reference image
+        """
+        is_close = hamming_distances(hashes[:, None], reference_hashes[None, :]) <= self._dhash_max_distance
+        return is_close | ~has_hash[:, None] | ~has_reference_hash[None, :]
+
+    def remove(self, image_file_path: str) -> None:
+        with self._lock:
+            self._mark_deleted(image_file_path)
+
+    def remove_all(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self._deleted[:self._row_count] = True
+            self._deleted_count = self._row_count
+            self._dirty = True
+            self.flush()
@@ -7,11 +7,21 @@ class MetadataKey(Enum):
     DATAMODEL_VERSION = "py-image-dedup_datamodel-version"
 
     PATH = "path"
+    NAMESPACE = "namespace"
     DISTANCE = "dist"
     SCORE = "score"
 
+    SIGNATURE = "signature"
+    WORD_PREFIX = "simple_word_"
+
     FILE_SIZE = "filesize"
     FILE_MODIFICATION_DATE = "file_modification_date"
 
     PIXELCOUNT = "pixelcount"
+    DHASH = "dhash"
+    GENERATION = "generation"
+    CLUSTER = "cluster"
+    REPRESENTATIVE = "representative"
+    CANONICAL_ORIENTATION = "canonical_orientation"
     EXIF_DATA = "exif_data"
+    EXIF_DATA_COUNT = "exif_data_count"
@@ -0,0 +1,212 @@
+import json
+import zipfile
+from pathlib import Path
+from typing import Iterator, Dict, List
+
+import numpy as np
+
+from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+# version 1 stored the text columns as fixed width unicode arrays, padded to their longest value
+SNAPSHOT_FORMAT_VERSION = 2
+
+# name of the member holding general information about the snapshot
+HEADER_MEMBER = "header"
+
+COLUMN_PATH = "path"
+COLUMN_METADATA = "metadata"
+COLUMN_SIGNATURE = "signature"
+COLUMN_WORDS = "words"
+COLUMNS = [COLUMN_PATH, COLUMN_METADATA, COLUMN_SIGNATURE, COLUMN_WORDS]
+# columns of variable length text, stored as concatenated UTF-8 ("_data") and the offset of each value ("_offsets")
+TEXT_COLUMNS = [COLUMN_PATH, COLUMN_METADATA]
+
+
+def _member_name(chunk: int, column: str) -> str:
+    return f"{chunk:06d}_{column}"
+
+
+def _json_default(value):
+    return str(value)
+
+
+def _write_array(archive: zipfile.ZipFile, name: str, array: np.ndarray):
+    with archive.open(f"{name}.npy", 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def _encode_texts(texts: List[str]) -> (np.ndarray, np.ndarray):
+    """
+    :param texts: values of a text column
+    :return: concatenated UTF-8 of all values, offset of each value into it (and the end of the last one)
+    """
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_texts(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """
+    :param data: concatenated UTF-8 of all values of a text column
+    :param offsets: offset of each value into data (and the end of the last one)
+    :return: values of the text column
+    """
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _create_chunk(records: List[dict], word_count: int) -> Dict[str, np.ndarray]:
+    """
+    :param records: image_match records
+    :param word_count: number of signature words per record
+    :return: map of member name suffix -> array, containing the columns of the records
+    """
+    path_data, path_offsets = _encode_texts([record[MetadataKey.PATH.value] for record in records])
+    metadata_data, metadata_offsets = _encode_texts([
+        json.dumps(record.get(MetadataKey.METADATA.value, {}), default=_json_default) for record in records
+    ])
+    return {
+        f"{COLUMN_PATH}_data": path_data,
+        f"{COLUMN_PATH}_offsets": path_offsets,
+        f"{COLUMN_METADATA}_data": metadata_data,
+        f"{COLUMN_METADATA}_offsets": metadata_offsets,
+        # signature values are in [-2 .. 2]
+        COLUMN_SIGNATURE: np.array([record[MetadataKey.SIGNATURE.value] for record in records], dtype=np.int8),
+        COLUMN_WORDS: np.array([
+            [record[f"{MetadataKey.WORD_PREFIX.value}{i}"] for i in range(word_count)] for record in records
+        ], dtype=np.int32),
+    }
+
+
+def export_snapshot(store: ImageSignatureStore, file_path: Path, chunk_size: int = 10000,
+                    progress=None) -> int:
+    """
+    Writes all entries of the given store to a compressed snapshot file.
+
+    The snapshot is a regular (zip64) numpy .npz file containing the column arrays
+    of each chunk of at most chunk_size entries, f.ex. "000000_signature", so
+    only a single chunk has to be held in memory when writing or reading it.
+    Text columns are stored as concatenated UTF-8 ("000000_path_data") and the
+    offset of each value ("000000_path_offsets"), so long values don't pad all others.
+
+    :param store: the store to export
+    :param file_path: target file
+    :param chunk_size: maximum number of entries per chunk
+    :param progress: (optional) function called with the number of exported entries after each chunk
+    :return: number of exported entries
+    """
+    count, entries = store.get_all()
+
+    word_count = None
+    chunk_count = 0
+    exported = 0
+    with zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        def write_chunk(records: List[dict]):
+            nonlocal chunk_count
+            for name, array in _create_chunk(records, word_count).items():
+                _write_array(archive, _member_name(chunk_count, name), array)
+            chunk_count += 1
+            if progress is not None:
+                progress(len(records))
+
+        chunk = []
+        for entry in entries:
+            record = entry['_source']
+            if word_count is None:
+                word_count = len(list(filter(lambda x: x.startswith(MetadataKey.WORD_PREFIX.value), record.keys())))
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                exported += len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            write_chunk(chunk)
+            exported += len(chunk)
+
+        header = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "datamodel_version": store.DATAMODEL_VERSION,
+            "chunk_count": chunk_count,
+            "entry_count": exported,
+        }
+        _write_array(archive, HEADER_MEMBER, np.array(json.dumps(header)))
+
+    return exported
+
+
+def read_snapshot_header(file_path: Path) -> dict:
+    """
+    :param file_path: snapshot file
+    :return: general information about the snapshot
+    """
+    with np.load(file_path, allow_pickle=False) as snapshot:
+        header = json.loads(str(snapshot[HEADER_MEMBER]))
+
+    if header["format_version"] > SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version: {header['format_version']}")
+    return header
+
+
+def iter_snapshot_chunks(file_path: Path) -> Iterator[Dict[str, np.ndarray or List[str]]]:
+    """
+    Reads a snapshot file one chunk at a time. This can be used for
+    offline analysis as well, f.ex. computing distances on the signature matrix.
+
+    :param file_path: snapshot file
+    :return: generator of maps of column name -> array (list of strings for text columns), one per chunk
+    """
+    header = read_snapshot_header(file_path)
+    with np.load(file_path, allow_pickle=False) as snapshot:
+        for chunk in range(header["chunk_count"]):
+            columns = {}
+            for column in COLUMNS:
+                if column not in TEXT_COLUMNS:
+                    columns[column] = snapshot[_member_name(chunk, column)]
+                elif header["format_version"] < 2:
+                    columns[column] = snapshot[_member_name(chunk, column)].tolist()
+                else:
+                    columns[column] = _decode_texts(snapshot[_member_name(chunk, f"{column}_data")],
+                                                    snapshot[_member_name(chunk, f"{column}_offsets")])
+            yield columns
+
+
+def iter_snapshot_records(file_path: Path) -> Iterator[List[dict]]:
+    """
+    Reads a snapshot file one chunk at a time
+    :param file_path: snapshot file
+    :return: generator of lists of image_match records, one per chunk
+    """
+    for chunk in iter_snapshot_chunks(file_path):
+        records = []
+        for path, metadata, signature, words in zip(
+            chunk[COLUMN_PATH], chunk[COLUMN_METADATA], chunk[COLUMN_SIGNATURE], chunk[COLUMN_WORDS]):
+            record = {
+                MetadataKey.PATH.value: path,
+                MetadataKey.SIGNATURE.value: signature.tolist(),
+                MetadataKey.METADATA.value: json.loads(metadata),
+            }
+            for i, word in enumerate(words.tolist()):
+                record[f"{MetadataKey.WORD_PREFIX.value}{i}"] = word
+            records.append(record)
+        yield records
+
+
+def import_snapshot(store: ImageSignatureStore, file_path: Path, progress=None) -> int:
+    """
+    Adds all entries of a snapshot file to the given store, replacing existing entries of the same files
+    :param store: the store to import to
+    :param file_path: snapshot file
+    :param progress: (optional) function called with the number of imported entries after each chunk
+    :return: number of imported entries
+    """
+    imported = 0
+    for records in iter_snapshot_records(file_path):
+        store.import_records(records)
+        imported += len(records)
+        if progress is not None:
+            progress(len(records))
+    store.flush()
+    return imported
@@ -0,0 +1,458 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+from image_match.goldberg import ImageSignature
+from image_match.signature_database_base import make_record
+
+from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.util import echo
+from py_image_dedup.util.signature import normalized_distances, pack_signatures, unpack_signatures
+
+
+def _json_default(value):
+    return str(value)
+
+
+class SQLiteStoreBackend(ImageSignatureStore):
+    """
+    Image signature persistence backed by an embedded SQLite database file.
+
+    Signatures are stored as packed BLOBs, duplicate candidates are looked up
+    using an indexed table of (word position, word) pairs.
+    """
+
+    # image_match defaults
+    SIGNATURE_LENGTH = 648
+    WORD_WIDTH = 16
+    WORD_COUNT = 63
+
+    # maximum number of records written in a single transaction
+    TRANSACTION_SIZE = 500
+    # number of entries fetched at once when iterating over all entries
+    PAGE_SIZE = 1000
+
+    def __init__(self,
+                 file_path: Path,
+                 max_dist: float = 0.03,
+                 min_should_match: int = 1,
+                 max_candidates: int = 100,
+                 use_exif_data: bool = True,
+                 ):
+        """
+        :param file_path: the database file, created if it does not exist
+        :param max_dist: maximum "difference" allowed, ranging from [0 .. 1] where 0.2 is still a pretty similar image
+        :param min_should_match: minimum number of signature words a candidate has to share with the reference image
+        :param max_candidates: maximum number of candidates to compute the distance for, per query.
+                               Queries that might have left out similar images because of this limit
+                               are reported by pop_truncated_queries.
+        """
+        super().__init__(use_exif_data)
+
+        self._file_path = file_path
+        self._max_dist = max_dist
+        self._min_should_match = min_should_match
+        self._max_candidates = max_candidates
+
+        self._gis = ImageSignature()
+
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+        # connections of all threads, to close them
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        # records that have not been committed yet, by path
+        self._pending = {}
+
+        self._setup_database()
+        atexit.register(self.flush)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return: the database connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # transactions are handled explicitly
+            # each connection is only used by its thread, but closed by the one calling close()
+            connection = sqlite3.connect(str(self._file_path), timeout=60, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        self.flush()
+        atexit.unregister(self.flush)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _setup_database(self):
+        """
+        Creates the expected tables, if they don't exist
+        """
+        self._file_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                signature BLOB NOT NULL,
+                words BLOB NOT NULL,
+                metadata TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS words (
+                position INTEGER NOT NULL,
+                word INTEGER NOT NULL,
+                image_id INTEGER NOT NULL,
+                PRIMARY KEY (position, word, image_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS words_image_id ON words (image_id);
+        """)
+
+    def _add(self, image_file_path: str, image_data: dict) -> None:
+        record = self._create_record(image_file_path, image_data)
+        self.import_records([record])
+
+    def _create_record(self, image_file_path: str, image_data: dict) -> dict:
+        """
+        Analyzes the given image file
+        :param image_file_path: image file path
+        :param image_data: metadata for the image
+        :return: image_match record (signature, words and metadata) to store
+        """
+        return make_record(image_file_path, self._gis, self.WORD_WIDTH, self.WORD_COUNT, metadata=image_data)
+
+    def import_records(self, records: List[dict]) -> None:
+        with self._write_lock:
+            for record in records:
+                self._pending[record[MetadataKey.PATH.value]] = record
+            if len(self._pending) >= self.TRANSACTION_SIZE:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            if len(self._pending) <= 0:
+                return
+            records = list(self._pending.values())
+            self._write_records(records)
+            self._pending.clear()
+
+    def _write_records(self, records: List[dict]) -> None:
+        """
+        Writes multiple records in a single transaction, replacing existing entries of the same files
+        :param records: the records to write
+        """
+        signatures = pack_signatures(np.array([record[MetadataKey.SIGNATURE.value] for record in records]))
+        words = np.array([self._get_words(record) for record in records], dtype=np.int32)
+        timestamp = time.time()
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for record, signature, record_words in zip(records, signatures, words):
+                path = record[MetadataKey.PATH.value]
+                self._delete(connection, path)
+                cursor = connection.execute(
+                    "INSERT INTO images (path, signature, words, metadata, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        signature.tobytes(),
+                        record_words.tobytes(),
+                        json.dumps(record.get(MetadataKey.METADATA.value, {}), default=_json_default),
+                        timestamp
+                    )
+                )
+                image_id = cursor.lastrowid
+                connection.executemany(
+                    "INSERT OR IGNORE INTO words (position, word, image_id) VALUES (?, ?, ?)",
+                    [(position, word, image_id) for position, word in enumerate(record_words.tolist())]
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _get_words(self, record: dict) -> List[int]:
+        """
+        :param record: image_match record
+        :return: signature words of the record, by position
+        """
+        return [record[f"{MetadataKey.WORD_PREFIX.value}{i}"] for i in range(self.WORD_COUNT)]
+
+    @staticmethod
+    def _delete(connection: sqlite3.Connection, image_file_path: str):
+        connection.execute("DELETE FROM words WHERE image_id IN (SELECT id FROM images WHERE path = ?)",
+                           (image_file_path,))
+        connection.execute("DELETE FROM images WHERE path = ?", (image_file_path,))
+
+    def get(self, image_file_path: str) -> dict or None:
+        """
+        Get a store entry by it's file_path
+        :param image_file_path: file path to search for
+        :return:
+        """
+        with self._write_lock:
+            if image_file_path in self._pending:
+                return self._pending[image_file_path]
+
+        row = self._connection().execute(
+            "SELECT id, path, signature, words, metadata FROM images WHERE path = ?", (image_file_path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._create_entry(*row[1:])
+
+    def _create_entry(self, path: str, signature: bytes, words: bytes or None, metadata: str) -> dict:
+        """
+        :return: image_match record of a database row, without words if they haven't been read
+        """
+        entry = {
+            MetadataKey.PATH.value: path,
+            MetadataKey.SIGNATURE.value: self._unpack_signatures([signature])[0].tolist(),
+            MetadataKey.METADATA.value: json.loads(metadata),
+        }
+        if words is None:
+            return entry
+        for position, word in enumerate(np.frombuffer(words, dtype=np.int32).tolist()):
+            entry[f"{MetadataKey.WORD_PREFIX.value}{position}"] = word
+        return entry
+
+    def _unpack_signatures(self, signatures: List[bytes]) -> np.ndarray:
+        packed = np.frombuffer(b"".join(signatures), dtype=np.uint8).reshape(len(signatures), -1)
+        return unpack_signatures(packed, self.SIGNATURE_LENGTH)
+
+    def get_all(self, fields: List[str] = None) -> (int, object):
+        self.flush()
+        count = self._connection().execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+        words_column = "words"
+        metadata_column = "metadata"
+        if fields is not None:
+            if not any(field.startswith(MetadataKey.WORD_PREFIX.value) for field in fields):
+                words_column = "NULL"
+            exif_field = f"{MetadataKey.METADATA.value}.{MetadataKey.EXIF_DATA.value}"
+            if exif_field not in fields and MetadataKey.METADATA.value not in fields:
+                # the exif data is by far the largest part of the metadata, so it isn't even decoded
+                metadata_column = f"json_remove(metadata, '$.{MetadataKey.EXIF_DATA.value}')"
+
+        def entries():
+            # paged, so entries can be removed while iterating
+            last_id = -1
+            while True:
+                rows = self._connection().execute(
+                    f"SELECT id, path, signature, {words_column}, {metadata_column} FROM images "
+                    f"WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, self.PAGE_SIZE)
+                ).fetchall()
+                if len(rows) <= 0:
+                    return
+                for row in rows:
+                    yield {'_id': row[0], '_source': self._create_entry(*row[1:])}
+                last_id = rows[-1][0]
+
+        return count, entries()
+
+    def get_paths_of_generation(self, generation: int = None) -> List[str]:
+        self.flush()
+        connection = self._connection()
+        json_path = f"$.{MetadataKey.GENERATION.value}"
+        if generation is None:
+            generation = connection.execute(
+                "SELECT MAX(json_extract(metadata, ?)) FROM images", (json_path,)).fetchone()[0]
+            if generation is None:
+                return []
+        rows = connection.execute(
+            "SELECT path FROM images WHERE json_extract(metadata, ?) >= ? ORDER BY id", (json_path, generation)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def set_clusters(self, clusters: Dict[str, List[str]]) -> None:
+        self.flush()
+        rows = [
+            (self.cluster_id(representative), 1 if path == representative else 0, path)
+            for representative, members in clusters.items()
+            for path in [representative] + members
+        ]
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    f"UPDATE images SET metadata = json_set(metadata, "
+                    f"'$.{MetadataKey.CLUSTER.value}', ?, '$.{MetadataKey.REPRESENTATIVE.value}', ?) WHERE path = ?",
+                    rows
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def get_word_statistics(self, count: int) -> (int, Dict[str, List[tuple]]):
+        self.flush()
+        connection = self._connection()
+        item_count = connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        rows = connection.execute("""
+            SELECT position, word, matches FROM (
+                SELECT position, word, COUNT(*) AS matches,
+                       ROW_NUMBER() OVER (PARTITION BY position ORDER BY COUNT(*) DESC) AS rank
+                FROM words GROUP BY position, word
+            ) WHERE rank <= ? ORDER BY position, matches DESC
+        """, (count,)).fetchall()
+
+        statistics = {f"{MetadataKey.WORD_PREFIX.value}{i}": [] for i in range(self.WORD_COUNT)}
+        for position, word, matches in rows:
+            statistics[f"{MetadataKey.WORD_PREFIX.value}{position}"].append((word, matches))
+        return item_count, statistics
+
+    def find_similar(self, reference_image_file_path: str, across_namespaces: bool = False) -> []:
+        """
+        Search for similar images to the specified one
+
+        :param reference_image_file_path: the reference image file
+        :param across_namespaces: ignored, namespaces are only supported by the elasticsearch backend
+        :return: list of images that are similar to the reference file
+        """
+        return self.find_similar_batch([reference_image_file_path])[reference_image_file_path]
+
+    def find_similar_batch(self, reference_image_file_paths: List[str]) -> Dict[str, list]:
+        self.flush()
+
+        records = []
+        for path in reference_image_file_paths:
+            try:
+                record = self.get(path)
+                if record is None:
+                    record = self._create_record(path, {})
+                records.append(record)
+            except Exception as e:
+                echo(f"Error querying database for similar images of '{path}': {e}", color="red")
+                records.append(None)
+
+        try:
+            similar = iter(self._search_records([record for record in records if record is not None]))
+        except Exception as e:
+            echo(f"Error querying database for similar images of multiple files: {e}", color="red")
+            return {path: [] for path in reference_image_file_paths}
+
+        return {
+            path: next(similar) if record is not None else []
+            for path, record in zip(reference_image_file_paths, records)
+        }
+
+    def _search_records(self, records: List[dict]) -> List[list]:
+        """
+        Searches for entries similar to each of the given records
+        :param records: image_match records (signature and words) of the reference images
+        :return: list of hits within the configured maximum distance, for each record
+        """
+        connection = self._connection()
+        candidates = []
+        # whether each record has more candidates than the limit
+        limited = []
+        for record in records:
+            # one more than the limit, to know if there are more
+            record_candidates = self._find_candidates(connection, self._get_words(record), self._max_candidates + 1)
+            limited.append(len(record_candidates) > self._max_candidates)
+            candidates.append(record_candidates[:self._max_candidates])
+
+        image_ids = list({image_id for record_candidates in candidates for image_id, _ in record_candidates})
+        rows = {}
+        for i in range(0, len(image_ids), self.PAGE_SIZE):
+            chunk = image_ids[i:i + self.PAGE_SIZE]
+            for row in connection.execute(
+                f"SELECT id, path, signature, metadata FROM images WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ):
+                rows[row[0]] = row
+
+        # compute all distances at once, the reference row is repeated for each of its candidates
+        candidates = [[(image_id, score) for image_id, score in record_candidates if image_id in rows]
+                      for record_candidates in candidates]
+        if sum(map(len, candidates)) <= 0:
+            return [[] for _ in records]
+        signatures = self._unpack_signatures(
+            [rows[image_id][2] for record_candidates in candidates for image_id, _ in record_candidates])
+        references = np.repeat(
+            np.array([record[MetadataKey.SIGNATURE.value] for record in records]),
+            [len(record_candidates) for record_candidates in candidates],
+            axis=0
+        )
+        distances = normalized_distances(signatures, references)
+
+        result = []
+        offset = 0
+        for record, record_limited, record_candidates in zip(records, limited, candidates):
+            record_distances = distances[offset:offset + len(record_candidates)]
+            # if even the candidate sharing the least words is similar, the ones left out might be too
+            if record_limited and len(record_distances) > 0 and record_distances[-1] < self._max_dist:
+                self._add_truncated_query(record[MetadataKey.PATH.value])
+            record_result = []
+            for (image_id, score), distance in zip(record_candidates, record_distances):
+                if distance >= self._max_dist:
+                    continue
+                _, path, _, metadata = rows[image_id]
+                record_result.append({
+                    'id': image_id,
+                    MetadataKey.SCORE.value: score,
+                    MetadataKey.PATH.value: path,
+                    MetadataKey.METADATA.value: json.loads(metadata),
+                    MetadataKey.DISTANCE.value: distance,
+                })
+            offset += len(record_candidates)
+            result.append(record_result)
+        return result
+
+    def _find_candidates(self, connection: sqlite3.Connection, words: List[int], limit: int) -> List[tuple]:
+        """
+        :param connection: database connection
+        :param words: signature words of the reference image, by position
+        :param limit: maximum number of candidates
+        :return: list of (image id, number of shared words) tuples, most shared words first
+        """
+        clauses = " OR ".join(["(position = ? AND word = ?)"] * len(words))
+        parameters = [value for position, word in enumerate(words) for value in (position, word)]
+        return connection.execute(
+            f"SELECT image_id, COUNT(*) AS matches FROM words WHERE {clauses} "
+            f"GROUP BY image_id HAVING matches >= ? ORDER BY matches DESC LIMIT ?",
+            parameters + [min(self._min_should_match, len(words)), limit]
+        ).fetchall()
+
+    def remove(self, image_file_path: str) -> None:
+        with self._write_lock:
+            self._pending.pop(image_file_path, None)
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete(connection, image_file_path)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def remove_all(self) -> None:
+        with self._write_lock:
+            self._pending.clear()
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM words")
+                connection.execute("DELETE FROM images")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
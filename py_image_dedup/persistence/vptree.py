@@ -0,0 +1,230 @@
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+
+def euclidean_radius(max_dist: float, reference_norm: float) -> float:
+    """
+    image_match's normalized distance d(a, b) = ||a - b|| / (||a|| + ||b||) is not a metric,
+    so metric indices are built on the euclidean distance instead. Since ||b|| <= ||a|| + ||a - b||,
+    d(a, b) < max_dist implies ||a - b|| < 2 * max_dist * ||a|| / (1 - max_dist), so a euclidean
+    radius query with that radius returns a superset of all hits, which just have to be verified.
+
+    :param max_dist: maximum normalized distance
+    :param reference_norm: euclidean norm of the reference signature
+    :return: euclidean radius containing all signatures within max_dist of the reference
+    """
+    return 2 * max_dist * reference_norm / (1 - max_dist)
+
+
+class VPTree:
+    """
+    Vantage point tree over the (euclidean) distance between signature rows.
+
+    Each inner node splits its rows into the ones closer to its vantage point than the
+    median distance (mu) and all others, leaves hold small buckets of rows. New rows are
+    inserted into the bucket of the leaf they belong to, which is split once it grows too big.
+    Removed vantage points are kept for routing but excluded from results.
+    """
+
+    def __init__(self, vectors: Callable[[np.ndarray], np.ndarray], leaf_size: int = 64, seed: int = 0):
+        """
+        :param vectors: function returning the (float32) signature rows for an array of row indices
+        :param leaf_size: number of rows per leaf, leaves are split once they hold twice as many
+        :param seed: seed for choosing vantage points
+        """
+        self._vectors = vectors
+        self._leaf_size = leaf_size
+        self._random = np.random.default_rng(seed)
+        self._clear()
+
+    def _clear(self):
+        # nodes, by index. leaves have a bucket (list of rows) and a vantage point of -1
+        self._vantage: List[int] = []
+        self._mu: List[float] = []
+        self._inside: List[int] = []
+        self._outside: List[int] = []
+        self._buckets: List[list or None] = []
+        self._removed = set()
+
+        self._new_node(bucket=[])
+
+    def __len__(self) -> int:
+        return len(self._vantage)
+
+    def _new_node(self, vantage: int = -1, mu: float = 0.0, inside: int = -1, outside: int = -1,
+                  bucket: list = None) -> int:
+        self._vantage.append(vantage)
+        self._mu.append(mu)
+        self._inside.append(inside)
+        self._outside.append(outside)
+        self._buckets.append(bucket)
+        return len(self._vantage) - 1
+
+    def _distances(self, rows: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(self._vectors(rows) - reference[None, :], axis=1)
+
+    def build(self, rows: np.ndarray):
+        """
+        (Re-)builds the tree for the given rows
+        :param rows: row indices
+        """
+        self._clear()
+        self._build(np.asarray(rows, dtype=np.int64), node=0)
+
+    def _build(self, rows: np.ndarray, node: int):
+        """
+        Builds a subtree for the given rows, replacing the given node
+        :param rows: row indices
+        :param node: index of the node to replace with the root of the subtree
+        """
+        stack = [(rows, node)]
+        while len(stack) > 0:
+            rows, node = stack.pop()
+            if len(rows) <= self._leaf_size:
+                self._set_node(node, bucket=rows.tolist())
+                continue
+
+            vantage_index = self._random.integers(len(rows))
+            vantage = rows[vantage_index]
+            rows = np.delete(rows, vantage_index)
+
+            distances = self._distances(rows, self._vectors(np.array([vantage]))[0])
+            mu = float(np.median(distances))
+            is_inside = distances < mu
+            if not is_inside.any():
+                # f.ex. many identical signatures, which can't be split
+                self._set_node(node, bucket=np.append(rows, vantage).tolist())
+                continue
+
+            inside = self._new_node()
+            outside = self._new_node()
+            self._set_node(node, vantage=int(vantage), mu=mu, inside=inside, outside=outside)
+
+            stack.append((rows[is_inside], inside))
+            stack.append((rows[~is_inside], outside))
+
+    def _set_node(self, node: int, vantage: int = -1, mu: float = 0.0, inside: int = -1, outside: int = -1,
+                  bucket: list = None):
+        self._vantage[node] = vantage
+        self._mu[node] = mu
+        self._inside[node] = inside
+        self._outside[node] = outside
+        self._buckets[node] = bucket
+
+    def _find_leaf(self, vector: np.ndarray) -> int:
+        """
+        :param vector: signature
+        :return: index of the leaf the given signature belongs to
+        """
+        node = 0
+        while self._buckets[node] is None:
+            vantage_vector = self._vectors(np.array([self._vantage[node]]))[0]
+            distance = np.linalg.norm(vector - vantage_vector)
+            node = self._inside[node] if distance < self._mu[node] else self._outside[node]
+        return node
+
+    def insert(self, row: int):
+        """
+        Adds a row to the tree
+        :param row: row index
+        """
+        leaf = self._find_leaf(self._vectors(np.array([row]))[0])
+        bucket = self._buckets[leaf]
+        bucket.append(row)
+        # leaves that can't be split are only retried whenever their size doubles
+        if len(bucket) >= 2 * self._leaf_size and len(bucket) & (len(bucket) - 1) == 0:
+            self._build(np.array(bucket, dtype=np.int64), node=leaf)
+
+    def remove(self, row: int):
+        """
+        Removes a row from the tree
+        :param row: row index
+        """
+        leaf = self._find_leaf(self._vectors(np.array([row]))[0])
+        if row in self._buckets[leaf]:
+            self._buckets[leaf].remove(row)
+        else:
+            # a vantage point on the way to the leaf
+            self._removed.add(row)
+
+    def query_radius(self, reference: np.ndarray, radius: float) -> (np.ndarray, int):
+        """
+        Finds all rows within the given (euclidean) distance of the reference signature
+        :param reference: signature
+        :param radius: maximum euclidean distance (inclusive)
+        :return: row indices, number of distance computations
+        """
+        reference = np.asarray(reference, dtype=np.float32)
+        result = []
+        visited = 0
+
+        stack = [0]
+        while len(stack) > 0:
+            node = stack.pop()
+            bucket = self._buckets[node]
+            if bucket is not None:
+                if len(bucket) > 0:
+                    rows = np.array(bucket, dtype=np.int64)
+                    visited += len(rows)
+                    result.append(rows[self._distances(rows, reference) <= radius])
+                continue
+
+            vantage = self._vantage[node]
+            distance = float(np.linalg.norm(self._vectors(np.array([vantage]))[0] - reference))
+            visited += 1
+            if distance <= radius and vantage not in self._removed:
+                result.append(np.array([vantage], dtype=np.int64))
+
+            mu = self._mu[node]
+            if distance - radius < mu:
+                stack.append(self._inside[node])
+            if distance + radius >= mu:
+                stack.append(self._outside[node])
+
+        rows = np.concatenate(result) if len(result) > 0 else np.zeros(0, dtype=np.int64)
+        return rows, visited
+
+    def save(self, file_path: Path):
+        """
+        Writes the tree to a file
+        :param file_path: target file
+        """
+        buckets = [bucket if bucket is not None else [] for bucket in self._buckets]
+        tmp_file = file_path.parent / f"{file_path.stem}.tmp.npz"
+        np.savez(
+            tmp_file,
+            vantage=np.array(self._vantage, dtype=np.int64),
+            mu=np.array(self._mu, dtype=np.float64),
+            inside=np.array(self._inside, dtype=np.int64),
+            outside=np.array(self._outside, dtype=np.int64),
+            is_leaf=np.array([bucket is not None for bucket in self._buckets], dtype=np.bool_),
+            bucket_sizes=np.array([len(bucket) for bucket in buckets], dtype=np.int64),
+            bucket_rows=np.array([row for bucket in buckets for row in bucket], dtype=np.int64),
+            removed=np.array(sorted(self._removed), dtype=np.int64),
+            leaf_size=np.array(self._leaf_size),
+        )
+        tmp_file.replace(file_path)
+
+    @classmethod
+    def load(cls, file_path: Path, vectors: Callable[[np.ndarray], np.ndarray], **kwargs) -> 'VPTree':
+        """
+        Reads a tree written by save()
+        :param file_path: tree file
+        :param vectors: function returning the (float32) signature rows for an array of row indices
+        :param kwargs: constructor arguments, the leaf size is read from disk
+        :return: the tree
+        """
+        with np.load(file_path) as data:
+            tree = cls(vectors, **{**kwargs, "leaf_size": int(data["leaf_size"])})
+            tree._vantage = data["vantage"].tolist()
+            tree._mu = data["mu"].tolist()
+            tree._inside = data["inside"].tolist()
+            tree._outside = data["outside"].tolist()
+            bucket_rows = np.split(data["bucket_rows"], np.cumsum(data["bucket_sizes"])[:-1])
+            tree._buckets = [
+                rows.tolist() if is_leaf else None for rows, is_leaf in zip(bucket_rows, data["is_leaf"])
+            ]
+            tree._removed = set(data["removed"].tolist())
+        return tree
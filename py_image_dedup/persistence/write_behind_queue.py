@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List
+
+from py_image_dedup.stats import WRITE_BEHIND_QUEUE_MEMORY_SIZE, WRITE_BEHIND_QUEUE_SPILL_SIZE
+from py_image_dedup.util import echo
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class WriteBehindQueue:
+    """
+    Buffers records between the analysis phase and a (possibly slow or unavailable) store.
+
+    Records are held in memory up to a given limit, everything beyond that is appended
+    to a local spill file. A background thread writes records to the store in batches,
+    retrying with an exponential backoff if the store is unavailable. Records that could
+    not be written when the queue is closed are spilled too and, like all other records
+    still in the spill file, replayed on the next start.
+    """
+
+    def __init__(self, write: Callable[[List[dict]], None], spill_file: Path, max_memory_items: int = 1000,
+                 batch_size: int = 500, max_backoff: float = 60):
+        """
+        :param write: function that persists a batch of records, raising an exception on failure
+        :param spill_file: file to spill records to
+        :param max_memory_items: maximum number of records to hold in memory
+        :param batch_size: maximum number of records to write at once
+        :param max_backoff: maximum time in seconds to wait before retrying a failed write
+        """
+        self._write = write
+        self._spill_file = spill_file
+        self._max_memory_items = max_memory_items
+        self._batch_size = batch_size
+        self._max_backoff = max_backoff
+
+        self._memory = deque()
+        # number of records in the spill file that have not been written yet
+        self._spilled_count = 0
+        # byte offset of the first record in the spill file that has not been written yet
+        self._spill_offset = 0
+        # records currently being written, and whether they have been read from the spill file
+        self._writing = []
+        self._writing_from_spill_file = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._spill_file.parent.mkdir(parents=True, exist_ok=True)
+        if self._spill_file.exists():
+            last_line = b""
+            with open(self._spill_file, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        self._spilled_count += 1
+                    last_line = line
+            if len(last_line) > 0 and not last_line.endswith(b"\n"):
+                # an incomplete line written right before a crash, don't continue it with the next record
+                with open(self._spill_file, 'a') as f:
+                    f.write("\n")
+            if self._spilled_count > 0:
+                echo(f"Replaying {self._spilled_count} spilled records from '{self._spill_file}'", color='yellow')
+        self._update_stats()
+
+        self._thread = threading.Thread(target=self._run, name="py-image-dedup-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, record: dict):
+        """
+        Queues a record to be written to the store. This never waits for the store.
+        :param record: the record to write
+        """
+        with self._condition:
+            # once spilling has started, later records have to be spilled too to retain their order
+            if self._closed or self._spilled_count > 0 or len(self._memory) >= self._max_memory_items:
+                with open(self._spill_file, 'a') as f:
+                    f.write(json.dumps(record, default=_json_default) + "\n")
+                self._spilled_count += 1
+            else:
+                self._memory.append(record)
+            self._update_stats()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until all queued records have been written to the store
+        :param timeout: maximum time in seconds to wait, None to wait until the store is available again
+        :return: True if all records have been written, False if the timeout expired before
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while len(self._memory) + self._spilled_count + len(self._writing) > 0:
+                if self._closed:
+                    return False
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def __len__(self) -> int:
+        """
+        :return: number of records that have not been written yet
+        """
+        with self._condition:
+            return len(self._memory) + self._spilled_count + len(self._writing)
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Waits until all queued records have been written to the store and stops writing.
+        Records that have not been written until then are spilled, to be replayed on the next start.
+        :param timeout: maximum time in seconds to wait, None to wait until the store is available again
+        :return: True if all records have been written, False if some of them have been spilled
+        """
+        written = self.flush(timeout)
+        with self._condition:
+            if not self._closed:
+                self._closed = True
+                self._spill_memory()
+                self._update_stats()
+            self._condition.notify_all()
+        return written
+
+    def _spill_memory(self):
+        """
+        Moves the records held in memory, including the ones currently being written,
+        in front of the records in the spill file
+        """
+        records = ([] if self._writing_from_spill_file else self._writing) + list(self._memory)
+        if len(records) <= 0:
+            return
+        # a write that is still in progress may succeed after all, which only writes these records again
+        temp_file = self._spill_file.with_name(self._spill_file.name + ".tmp")
+        with open(temp_file, 'wb') as f:
+            for record in records:
+                f.write((json.dumps(record, default=_json_default) + "\n").encode())
+            if self._spilled_count > 0:
+                with open(self._spill_file, 'rb') as spilled:
+                    spilled.seek(self._spill_offset)
+                    for line in spilled:
+                        f.write(line)
+        os.replace(temp_file, self._spill_file)
+        self._memory.clear()
+        self._spilled_count += len(records)
+        self._spill_offset = 0
+
+    def _run(self):
+        backoff = 0
+        while True:
+            with self._condition:
+                while not self._closed and len(self._memory) + self._spilled_count <= 0:
+                    self._condition.wait()
+                if self._closed:
+                    return
+
+                from_spill_file = len(self._memory) <= 0
+                skipped_count = 0
+                if from_spill_file:
+                    batch, skipped_count, next_spill_offset = self._read_spilled_batch()
+                else:
+                    batch = [self._memory.popleft() for _ in range(min(self._batch_size, len(self._memory)))]
+                self._writing = batch
+                self._writing_from_spill_file = from_spill_file
+
+            try:
+                if len(batch) > 0:
+                    self._write(batch)
+            except Exception as e:
+                LOGGER.exception(e)
+                backoff = min(max(backoff * 2, 1), self._max_backoff)
+                echo(f"Error writing {len(batch)} records, retrying in {backoff}s: {e}", color='red')
+                with self._condition:
+                    if self._closed:
+                        # the batch has been spilled already
+                        return
+                    if not from_spill_file:
+                        self._memory.extendleft(reversed(batch))
+                    self._writing = []
+                    self._condition.notify_all()
+                time.sleep(backoff)
+                continue
+
+            backoff = 0
+            with self._condition:
+                if self._closed:
+                    return
+                if from_spill_file:
+                    self._spill_offset = next_spill_offset
+                    # lines that could not be read are only skipped once the batch following them has been written
+                    self._spilled_count -= len(batch) + skipped_count
+                    if self._spilled_count <= 0:
+                        # everything has been replayed, start over with an empty file
+                        open(self._spill_file, 'w').close()
+                        self._spilled_count = 0
+                        self._spill_offset = 0
+                self._writing = []
+                self._update_stats()
+                self._condition.notify_all()
+
+    def _read_spilled_batch(self) -> (List[dict], int, int):
+        """
+        :return: the next batch of records from the spill file, number of lines in between that could not be read,
+                 offset of the record following the batch
+        """
+        batch = []
+        skipped_count = 0
+        with open(self._spill_file, 'rb') as f:
+            f.seek(self._spill_offset)
+            while len(batch) < self._batch_size:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except Exception as e:
+                    # f.ex. an incomplete line written right before a crash
+                    LOGGER.exception(e)
+                    skipped_count += 1
+            return batch, skipped_count, f.tell()
+
+    def _update_stats(self):
+        WRITE_BEHIND_QUEUE_MEMORY_SIZE.set(len(self._memory))
+        WRITE_BEHIND_QUEUE_SPILL_SIZE.set(self._spilled_count)
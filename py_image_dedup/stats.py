@@ -18,3 +18,11 @@ FILE_EVENT_COUNT = Gauge(
 ANALYSIS_TIME = Summary('analyse_file_summary', 'Time spent analysing a file')
 
 FIND_DUPLICATES_TIME = Summary('find_duplicates_summary', 'Time spent finding duplicates of a file')
+
+WRITE_BEHIND_QUEUE_SIZE = Gauge(
+    'write_behind_queue_size',
+    'Number of analysed files waiting to be written to the database',
+    ['location']
+)
+WRITE_BEHIND_QUEUE_MEMORY_SIZE = WRITE_BEHIND_QUEUE_SIZE.labels(location="memory")
+WRITE_BEHIND_QUEUE_SPILL_SIZE = WRITE_BEHIND_QUEUE_SIZE.labels(location="spill_file")
@@ -1,4 +1,5 @@
 import PIL.ExifTags
+import numpy as np
 from PIL import Image
 
 
@@ -26,6 +27,24 @@ def get_exif_data(image_file_path: str) -> {}:
     return result
 
 
+def get_dhash(image_file_path: str) -> int or None:
+    """
+    Computes the difference hash of an image: each of its 64 bits tells whether a pixel
+    of a 9x8 grayscale thumbnail is brighter than its right neighbour
+    :param image_file_path: path of the image file
+    :return: the hash as a signed 64 bit integer (to fit into a database "long" field), None if it can't be computed
+    """
+    try:
+        with Image.open(image_file_path) as img:
+            thumbnail = img.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = np.asarray(thumbnail, dtype=np.int16)
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        return int(np.packbits(bits).view('>i8')[0])
+    except Exception as e:
+        pass
+    return None
+
+
 def get_pixel_count(image_file_path: str) -> int:
     try:
         img = Image.open(image_file_path)
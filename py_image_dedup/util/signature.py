@@ -0,0 +1,168 @@
+from typing import List
+
+import numpy as np
+
+
+def hamming_distances(hashes: np.ndarray, references: np.ndarray) -> np.ndarray:
+    """
+    Counts the differing bits of (broadcast) pairs of 64 bit hashes
+
+    :param hashes: array of signed 64 bit hashes
+    :param references: array of signed 64 bit hashes, broadcast against hashes
+    :return: array of bit counts
+    """
+    differences = np.bitwise_xor(hashes, references).astype(np.int64).view(np.uint64)
+    return np.bitwise_count(differences)
+
+
+def normalized_distances(signatures: np.ndarray, references: np.ndarray, nan_value: float = 1.0) -> np.ndarray:
+    """
+    Computes the image_match normalized distance ||a - b|| / (||a|| + ||b||)
+    between each row of the given signature matrix and the corresponding row
+    of the reference matrix.
+
+    :param signatures: N x m signature matrix
+    :param references: N x m matrix of reference signatures (one per row of signatures)
+    :param nan_value: value to use for 0/0 (featureless images)
+    :return: array of N distances
+    """
+    signatures = signatures.astype(int)
+    references = references.astype(int)
+    numerator = np.linalg.norm(references - signatures, axis=1)
+    denominator = np.linalg.norm(references, axis=1) + np.linalg.norm(signatures, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = numerator / denominator
+    distances[np.isnan(distances)] = nan_value
+    return distances
+
+
+# signature values are in [-2 .. 2], so 3 of them fit into a single byte (5^3 = 125)
+_PACK_BASE = 5
+_PACK_VALUES_PER_BYTE = 3
+
+
+def pack_signatures(signatures: np.ndarray) -> np.ndarray:
+    """
+    Packs image_match signatures into 3 values per byte
+    :param signatures: N x m signature matrix with values in [-2 .. 2]
+    :return: N x ceil(m / 3) uint8 matrix
+    """
+    signatures = np.asarray(signatures, dtype=np.int16) + 2
+    padding = -signatures.shape[1] % _PACK_VALUES_PER_BYTE
+    if padding > 0:
+        signatures = np.pad(signatures, ((0, 0), (0, padding)), constant_values=0)
+    digits = signatures.reshape(signatures.shape[0], -1, _PACK_VALUES_PER_BYTE)
+    packed = digits[:, :, 0] * _PACK_BASE ** 2 + digits[:, :, 1] * _PACK_BASE + digits[:, :, 2]
+    return packed.astype(np.uint8)
+
+
+def unpack_signatures(packed: np.ndarray, length: int) -> np.ndarray:
+    """
+    Reverses pack_signatures
+    :param packed: N x ceil(m / 3) uint8 matrix
+    :param length: number of values per signature (m)
+    :return: N x m int8 signature matrix
+    """
+    packed = np.asarray(packed, dtype=np.int16)
+    digits = np.stack([
+        packed // _PACK_BASE ** 2,
+        packed // _PACK_BASE % _PACK_BASE,
+        packed % _PACK_BASE
+    ], axis=2)
+    signatures = digits.reshape(packed.shape[0], -1)[:, :length] - 2
+    return signatures.astype(np.int8)
+
+
+def signature_words(signatures: np.ndarray, k: int = 16, n: int = 63) -> np.ndarray:
+    """
+    Computes the image_match words of multiple signatures at once.
+    The result is identical to the words image_match computes when creating a record.
+
+    :param signatures: N x m signature matrix
+    :param k: word length
+    :param n: number of words per signature
+    :return: N x n matrix of integer encoded words
+    """
+    signatures = np.asarray(signatures, dtype=np.int8)
+    length = signatures.shape[1]
+    word_positions = np.linspace(0, length, n, endpoint=False).astype(int)
+
+    # words starting near the end are padded with zeros
+    padded = np.pad(np.sign(signatures), ((0, 0), (0, k)), constant_values=0)
+    words = padded[:, word_positions[:, None] + np.arange(k)]
+    return np.dot(words.astype(np.int64) + 1, 3 ** np.arange(k, dtype=np.int64))
+
+
+# image_match signatures consist of the differences of the grey levels at each point of a 9 x 9 grid
+# to those of its 8 neighbours, in this order (as (row, column) offsets)
+_GRID_SIZE = 9
+_NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def _orientation_permutations() -> np.ndarray:
+    """
+    Rotating or mirroring an image (approximately) permutes the values of its signature:
+    grid points move and so do the neighbours they are compared to.
+
+    :return: 8 x 648 matrix of value indices, one permutation for each rotation (0, 90, 180, 270 degrees)
+             of the image and its mirror image
+    """
+    def transform(indices: np.ndarray, grid_transform, neighbour_transform) -> np.ndarray:
+        grid = grid_transform(indices)
+        result = np.empty_like(grid)
+        for neighbour, offset in enumerate(_NEIGHBOURS):
+            result[:, :, _NEIGHBOURS.index(neighbour_transform(*offset))] = grid[:, :, neighbour]
+        return result
+
+    def rotate(indices: np.ndarray) -> np.ndarray:
+        # 90 degrees counterclockwise, like np.rot90
+        return transform(indices, lambda grid: np.rot90(grid, axes=(0, 1)), lambda dy, dx: (-dx, dy))
+
+    def mirror(indices: np.ndarray) -> np.ndarray:
+        return transform(indices, lambda grid: grid[:, ::-1], lambda dy, dx: (dy, -dx))
+
+    identity = np.arange(_GRID_SIZE * _GRID_SIZE * len(_NEIGHBOURS)).reshape(_GRID_SIZE, _GRID_SIZE, -1)
+    permutations = []
+    for indices in [identity, mirror(identity)]:
+        for _ in range(4):
+            permutations.append(indices.ravel())
+            indices = rotate(indices)
+    return np.array(permutations)
+
+
+ORIENTATION_PERMUTATIONS = _orientation_permutations()
+_NEIGHBOUR_DIRECTIONS = np.array([(dx, dy) for dy, dx in _NEIGHBOURS]) / np.linalg.norm(_NEIGHBOURS, axis=1)[:, None]
+
+
+def orientation_gradients(signature: np.ndarray) -> np.ndarray:
+    """
+    Estimates the overall grey level gradient (x, y) of the image in each orientation.
+
+    :param signature: image_match signature
+    :return: 8 x 2 matrix of gradients, one for each orientation (see ORIENTATION_PERMUTATIONS)
+    """
+    oriented = np.asarray(signature, dtype=np.float64)[ORIENTATION_PERMUTATIONS]
+    neighbour_sums = oriented.reshape(len(ORIENTATION_PERMUTATIONS), -1, len(_NEIGHBOURS)).sum(axis=1)
+    return neighbour_sums @ _NEIGHBOUR_DIRECTIONS
+
+
+def canonical_orientations(signature: np.ndarray, margin: float = 0.0) -> List[int]:
+    """
+    Determines the orientation that turns the overall gradient of an image into the first octant
+    (0 <= y <= x). Rotated and mirrored copies of an image have the same canonical orientation.
+
+    :param signature: image_match signature
+    :param margin: tolerance, relative to the length of the gradient. Near the boundaries of the octant,
+                   (slightly modified) copies of an image might be turned into neighbouring octants,
+                   this includes all orientations within the given tolerance.
+    :return: orientations (indices into ORIENTATION_PERMUTATIONS), the canonical one first
+    """
+    gradients = orientation_gradients(signature)
+    x, y = gradients[:, 0], gradients[:, 1]
+    tolerance = margin * np.linalg.norm(gradients[0])
+    # distance of each gradient to the octant, 0 if it is inside
+    outside = np.maximum(np.maximum(-y, y - x), 0)
+    orientations = np.argsort(outside, kind='stable')
+    return [int(orientations[0])] + [
+        int(orientation) for orientation in orientations[1:] if outside[orientation] <= tolerance
+    ]
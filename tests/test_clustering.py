@@ -0,0 +1,47 @@
+import random
+import unittest
+
+from py_image_dedup.library.clustering import DisjointSet, cluster, LINKAGE_COMPLETE
+
+
+class ClusteringTest(unittest.TestCase):
+
+    def test_disjoint_set(self):
+        disjoint_set = DisjointSet()
+        for item in range(6):
+            disjoint_set.add(item)
+        disjoint_set.union(0, 1)
+        disjoint_set.union(2, 1)
+        disjoint_set.union(4, 5)
+
+        self.assertEqual(disjoint_set.find(0), disjoint_set.find(2))
+        self.assertNotEqual(disjoint_set.find(0), disjoint_set.find(4))
+        self.assertEqual(3, disjoint_set.size(2))
+        self.assertEqual([[0, 1, 2], [3], [4, 5]], disjoint_set.sets())
+
+    def test_result_does_not_depend_on_edge_order(self):
+        edges = [("a", "b", 0.05), ("b", "c", 0.02), ("c", "d", 0.08), ("e", "f", 0.01), ("d", "e", 0.09)]
+        expected = sorted(map(sorted, cluster("abcdef", edges, max_size=4)))
+
+        for _ in range(10):
+            random.shuffle(edges)
+            self.assertEqual(expected, sorted(map(sorted, cluster("abcdef", edges, max_size=4))))
+        self.assertEqual([["a", "b", "c", "d"], ["e", "f"]], expected)
+
+    def test_complete_linkage_prevents_chaining(self):
+        # a chain of images, each one only similar to its neighbours
+        edges = [("a", "b", 0.05), ("b", "c", 0.05), ("c", "d", 0.05), ("a", "c", 0.08)]
+
+        self.assertEqual([["a", "b", "c", "d"]], cluster("abcd", edges))
+        self.assertEqual([["a", "b", "c"], ["d"]], cluster("abcd", edges, linkage=LINKAGE_COMPLETE))
+
+    def test_size_limited_edges(self):
+        edges = [("a", "b", 0.05), ("b", "c", 0.05), ("c", "d", 0.05), ("a", "c", 0.08)]
+
+        size_limited_edges = []
+        components = cluster("abcd", edges, max_size=2, linkage=LINKAGE_COMPLETE,
+                             size_limited_edges=size_limited_edges)
+
+        self.assertEqual([["a", "b"], ["c", "d"]], components)
+        # a and d aren't similar, so (a, c) is ignored because of the linkage, not the size limit
+        self.assertEqual([("b", "c")], size_limited_edges)
@@ -0,0 +1,24 @@
+import unittest
+
+from py_image_dedup.config import DeduplicatorConfig, BACKEND_TYPE_SQLITE
+
+
+class ConfigTest(unittest.TestCase):
+
+    def test_backend_must_match_completely(self):
+        entry = DeduplicatorConfig().BACKEND
+
+        self.assertEqual(BACKEND_TYPE_SQLITE, entry._value_to_type(BACKEND_TYPE_SQLITE))
+        for value in ["xsqlitex", "sqlitex", "xsqlite", "sqlite|memory"]:
+            with self.assertRaises(ValueError):
+                entry._value_to_type(value)
+
+    def test_hot_word_threshold_range(self):
+        entry = DeduplicatorConfig().ELASTICSEARCH_HOT_WORD_THRESHOLD
+        previous = entry.value
+        self.addCleanup(setattr, entry, "value", previous)
+
+        entry.value = 0.05
+        for value in [0, 1, -0.1, 1.5]:
+            with self.assertRaises(ValueError):
+                entry.value = value
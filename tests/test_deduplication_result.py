@@ -0,0 +1,36 @@
+import unittest
+from pathlib import Path
+
+from py_image_dedup.library.deduplication_result import DeduplicationResult
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+
+class DeduplicationResultTest(unittest.TestCase):
+
+    def test_file_duplicates_are_dictionaries(self):
+        result = DeduplicationResult()
+        reference = self._create_candidate("/images/a.jpg", 0.0)
+        duplicate = self._create_candidate("/images/b.jpg", 0.01)
+        result.set_file_duplicates([reference], [duplicate])
+
+        duplicates = result.get_file_duplicates()[Path("/images/a.jpg")]
+
+        self.assertEqual(1, len(duplicates))
+        self.assertIsInstance(duplicates[0], dict)
+        self.assertEqual("/images/b.jpg", duplicates[0][MetadataKey.PATH.value])
+        self.assertEqual(0.01, duplicates[0][MetadataKey.DISTANCE.value])
+        self.assertEqual(2000, duplicates[0][MetadataKey.METADATA.value][MetadataKey.FILE_SIZE.value])
+        self.assertEqual(["/images/b.jpg"],
+                         [record.path for record in result.get_duplicate_records()[Path("/images/a.jpg")]])
+
+    @staticmethod
+    def _create_candidate(path: str, distance: float) -> dict:
+        return {
+            MetadataKey.PATH.value: path,
+            MetadataKey.DISTANCE.value: distance,
+            MetadataKey.SCORE.value: 63,
+            MetadataKey.METADATA.value: {
+                MetadataKey.FILE_SIZE.value: 2000,
+                MetadataKey.EXIF_DATA.value: {"Make": "Google"},
+            },
+        }
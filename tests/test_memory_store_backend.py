@@ -0,0 +1,145 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from py_image_dedup.persistence.memorystorebackend import MemoryStoreBackend
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+
+class MemoryStoreBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self._tmp_dir.name, "memory")
+        self.store = MemoryStoreBackend(self.directory, max_dist=0.1)
+
+    def tearDown(self):
+        self.store.flush()
+        self._tmp_dir.cleanup()
+
+    def test_find_similar(self):
+        self.store.import_records([
+            self._create_record("/images/a.jpg", [1] * 648),
+            self._create_record("/images/b.jpg", [1] * 647 + [0]),
+            self._create_record("/images/c.jpg", [-1] * 648),
+        ])
+
+        result = self.store.find_similar_batch(["/images/a.jpg", "/images/c.jpg"])
+
+        self.assertEqual(
+            ["/images/a.jpg", "/images/b.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/a.jpg"])
+        )
+        self.assertEqual(
+            ["/images/c.jpg"],
+            [candidate[MetadataKey.PATH.value] for candidate in result["/images/c.jpg"]]
+        )
+
+    def test_persistence(self):
+        records = [self._create_record(f"/images/{i}.jpg", [i % 5 - 2] * 648) for i in range(2000)]
+        self.store.import_records(records)
+        self.store.import_records([self._create_record("/images/0.jpg", [2] * 648)])
+        self.store.remove("/images/1.jpg")
+        self.store.flush()
+
+        store = MemoryStoreBackend(self.directory, max_dist=0.1)
+
+        self.assertEqual(1999, store.get_all()[0])
+        self.assertIsNone(store.get("/images/1.jpg"))
+        self.assertEqual([2] * 648, store.get("/images/0.jpg")[MetadataKey.SIGNATURE.value])
+        self.assertEqual(100, store.get("/images/5.jpg")[MetadataKey.METADATA.value][MetadataKey.FILE_SIZE.value])
+
+    def test_dhash_prefilter(self):
+        store = MemoryStoreBackend(self.directory, max_dist=0.1, dhash_max_distance=4)
+        store.import_records([
+            self._create_record("/images/a.jpg", [1] * 648, dhash=0b1111),
+            self._create_record("/images/close.jpg", [1] * 648, dhash=0b0000),
+            self._create_record("/images/far.jpg", [1] * 648, dhash=-2),
+            # all bits set, which is a valid hash as well
+            self._create_record("/images/all-bits.jpg", [1] * 648, dhash=-1),
+            self._create_record("/images/unknown.jpg", [1] * 648),
+        ])
+
+        result = store.find_similar_batch(["/images/a.jpg", "/images/unknown.jpg"])
+
+        self.assertEqual(
+            ["/images/a.jpg", "/images/close.jpg", "/images/unknown.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/a.jpg"])
+        )
+        self.assertEqual(5, len(result["/images/unknown.jpg"]))
+        self.assertEqual(-1, store.get("/images/all-bits.jpg")[MetadataKey.METADATA.value][MetadataKey.DHASH.value])
+        self.assertNotIn(MetadataKey.DHASH.value, store.get("/images/unknown.jpg")[MetadataKey.METADATA.value])
+        store.flush()
+
+    def test_cluster_representatives(self):
+        def flipped(positions) -> [int]:
+            return [-1 if i in positions else 1 for i in range(648)]
+
+        store = MemoryStoreBackend(self.directory, max_dist=0.1, cluster_margin=0.05)
+        self.assertTrue(store.uses_clusters())
+        store.import_records([
+            self._create_record("/images/representative.jpg", flipped([])),
+            self._create_record("/images/member.jpg", flipped(range(0, 4))),
+            # clearly similar to the representative, so its members are skipped
+            self._create_record("/images/close.jpg", flipped([4])),
+            # just beyond max_dist of the representative, but close to its member
+            self._create_record("/images/near.jpg", flipped(range(0, 7))),
+        ])
+        store.set_clusters({"/images/representative.jpg": ["/images/member.jpg"]})
+
+        result = store.find_similar_batch(["/images/close.jpg", "/images/near.jpg"])
+
+        self.assertEqual(
+            ["/images/close.jpg", "/images/near.jpg", "/images/representative.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/close.jpg"])
+        )
+        self.assertEqual(
+            ["/images/close.jpg", "/images/member.jpg", "/images/near.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/near.jpg"])
+        )
+
+        # members of a changed representative are compared again
+        store.import_records([self._create_record("/images/representative.jpg", flipped([]))])
+        result = store.find_similar("/images/close.jpg")
+        self.assertIn("/images/member.jpg", [candidate[MetadataKey.PATH.value] for candidate in result])
+        store.flush()
+
+    def test_vptree_index(self):
+        self._test_index("vptree")
+
+    def test_hnsw_index(self):
+        self._test_index("hnsw")
+
+    def _test_index(self, index: str):
+        records = [self._create_record(f"/images/{i}.jpg", [i % 5 - 2] * 647 + [i % 3]) for i in range(1000)]
+        self.store.import_records(records)
+        self.store.flush()
+        expected = self.store.find_similar_batch(["/images/0.jpg", "/images/7.jpg"])
+
+        store = MemoryStoreBackend(self.directory, max_dist=0.1, index=index)
+        store.import_records([self._create_record("/images/new.jpg", [-2] * 648)])
+        store.remove("/images/5.jpg")
+        store.flush()
+        store = MemoryStoreBackend(self.directory, max_dist=0.1, index=index)
+        result = store.find_similar_batch(["/images/0.jpg", "/images/7.jpg"])
+
+        self.assertEqual(
+            sorted(candidate[MetadataKey.PATH.value] for candidate in expected["/images/0.jpg"]
+                   if candidate[MetadataKey.PATH.value] != "/images/5.jpg") + ["/images/new.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/0.jpg"])
+        )
+        self.assertEqual(
+            sorted(candidate[MetadataKey.PATH.value] for candidate in expected["/images/7.jpg"]),
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result["/images/7.jpg"])
+        )
+
+    @staticmethod
+    def _create_record(path: str, signature: [int], dhash: int = None) -> dict:
+        metadata = {MetadataKey.FILE_SIZE.value: 100}
+        if dhash is not None:
+            metadata[MetadataKey.DHASH.value] = dhash
+        return {
+            MetadataKey.PATH.value: path,
+            MetadataKey.SIGNATURE.value: signature,
+            MetadataKey.METADATA.value: metadata
+        }
@@ -0,0 +1,30 @@
+import unittest
+
+import numpy as np
+
+from py_image_dedup.util.signature import ORIENTATION_PERMUTATIONS, canonical_orientations
+
+
+class OrientationTest(unittest.TestCase):
+
+    def test_rotating_four_times_is_identity(self):
+        rotation = ORIENTATION_PERMUTATIONS[1]
+        indices = np.arange(len(rotation))
+        for _ in range(4):
+            indices = indices[rotation]
+        self.assertTrue(np.array_equal(np.arange(len(rotation)), indices))
+
+    def test_canonical_signature_is_independent_of_orientation(self):
+        signature = np.random.default_rng(0).integers(-2, 3, size=648, dtype=np.int8)
+        canonical = signature[ORIENTATION_PERMUTATIONS[canonical_orientations(signature)[0]]]
+
+        for permutation in ORIENTATION_PERMUTATIONS:
+            oriented = signature[permutation]
+            orientation = canonical_orientations(oriented)[0]
+            self.assertTrue(np.array_equal(canonical, oriented[ORIENTATION_PERMUTATIONS[orientation]]))
+
+    def test_margin_includes_nearly_canonical_orientations(self):
+        signature = np.random.default_rng(0).integers(-2, 3, size=648, dtype=np.int8)
+
+        self.assertEqual(1, len(canonical_orientations(signature)))
+        self.assertEqual(list(range(8)), sorted(canonical_orientations(signature, margin=10.0)))
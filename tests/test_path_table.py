@@ -0,0 +1,34 @@
+import unittest
+from pathlib import Path
+
+from py_image_dedup.library.path_table import PathTable, PathSet
+
+
+class PathTableTest(unittest.TestCase):
+
+    def test_ids_are_assigned_in_order(self):
+        table = PathTable()
+
+        self.assertEqual(0, table.add("/images/a.jpg"))
+        self.assertEqual(1, table.add(Path("/images/b.jpg")))
+        self.assertEqual(0, table.add(Path("/images/a.jpg")))
+        self.assertEqual(1, table.get("/images/b.jpg"))
+        self.assertIsNone(table.get("/images/c.jpg"))
+        self.assertEqual(["/images/a.jpg", "/images/b.jpg"], list(table))
+
+    def test_set(self):
+        table = PathTable()
+        processed = PathSet(table)
+        claimed = PathSet(table)
+        for i in range(100):
+            table.add(f"/images/{i}.jpg")
+            if i % 3 == 0:
+                processed.add(Path(f"/images/{i}.jpg"))
+        claimed.add("/images/200.jpg")
+
+        self.assertEqual(34, len(processed))
+        self.assertIn("/images/99.jpg", processed)
+        self.assertNotIn(Path("/images/98.jpg"), processed)
+        self.assertNotIn("/images/200.jpg", processed)
+        self.assertIn("/images/200.jpg", claimed)
+        self.assertEqual([f"/images/{i}.jpg" for i in range(0, 100, 3)], list(processed))
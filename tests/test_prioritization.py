@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from py_image_dedup.library.prioritization import Prioritization, RULES
+from py_image_dedup.persistence.metadata_key import MetadataKey
+
+
+class PrioritizationTest(unittest.TestCase):
+
+    def test_rank_matches_key(self):
+        random.seed(0)
+        candidates = [self._create_candidate(random) for _ in range(200)]
+        rule_names = list(RULES.keys())
+
+        for _ in range(20):
+            random.shuffle(rule_names)
+            prioritization = Prioritization([{"name": name} for name in rule_names[:4]])
+
+            expected = sorted(candidates, key=prioritization.key)
+            self.assertEqual(expected, prioritization.sort(candidates))
+            self.assertEqual(expected[0], prioritization.best(candidates))
+
+    def test_unknown_rules_are_ignored(self):
+        prioritization = Prioritization([{"name": "longer-path"}, {"name": "bigger-file-size"}])
+        small = self._create_candidate(random, path="/b.jpg", filesize=1)
+        big = self._create_candidate(random, path="/a-copy.jpg", filesize=2)
+
+        self.assertEqual([big, small], prioritization.sort([small, big]))
+
+    def test_path_features(self):
+        prioritization = Prioritization([{"name": "contains-copy-in-file-name"}, {"name": "longer-file-name"},
+                                         {"name": "shorter-folder-path"}])
+        candidate = self._create_candidate(random, path="/images/2020/IMG_1 - Copy.jpg")
+
+        self.assertEqual((1.0, -16.0, 12.0, "/images/2020/IMG_1 - Copy.jpg"), prioritization.key(candidate))
+
+    @staticmethod
+    def _create_candidate(random, path: str = None, filesize: int = None) -> dict:
+        if path is None:
+            copy = random.choice(["", " - Copy"])
+            path = f"/images/{'x' * random.randint(0, 2)}/{random.randint(0, 5)}{copy}.jpg"
+        return {
+            MetadataKey.PATH.value: path,
+            MetadataKey.DISTANCE.value: random.choice([0.0, 0.01, 0.02]),
+            MetadataKey.SCORE.value: random.randint(0, 3),
+            MetadataKey.METADATA.value: {
+                MetadataKey.FILE_SIZE.value: filesize if filesize is not None else random.randint(0, 3),
+                MetadataKey.FILE_MODIFICATION_DATE.value: random.choice([1.5, 2.5]),
+                MetadataKey.PIXELCOUNT.value: random.randint(0, 3),
+                MetadataKey.EXIF_DATA_COUNT.value: random.randint(0, 3),
+            },
+        }
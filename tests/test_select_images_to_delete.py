@@ -1,5 +1,6 @@
 import random
 import unittest
+from pathlib import Path
 from random import shuffle
 from random import uniform
 
@@ -67,6 +68,16 @@ class SelectImagesToDeleteTest(TestBase):
 
         self._run_test(keep, dont_keep)
 
+    def test_select_images_to_delete__more_exif_data(self):
+        keep = [self._create_default_candidate(exif_tags={"Make": "Google", "Model": "Pixel"})]
+
+        dont_keep = []
+        for i in range(50):
+            c = self._create_default_candidate(exif_tags={"Make": "Google"})
+            dont_keep.append(c)
+
+        self._run_test(keep, dont_keep)
+
     def test_select_images_to_delete__all_the_same(self):
         keep = [self._create_default_candidate(path="C:/00000.jpg")]
 
@@ -121,6 +132,24 @@ class SelectImagesToDeleteTest(TestBase):
 
         self._run_test(keep, dont_keep)
 
+    def test_limit_group_size(self):
+        self.under_test.reset_result()
+        self.config.DEDUPLICATION_MAX_GROUP_SIZE.value = 10
+        self.addCleanup(setattr, self.config.DEDUPLICATION_MAX_GROUP_SIZE, "value", None)
+        candidates = [self._create_default_candidate(path=f"C:/{i}.jpg", dist=i / 100) for i in range(50)]
+        shuffle(candidates)
+
+        limited = self.under_test._limit_group_size("C:/0.jpg", candidates)
+
+        self.assertEqual([f"C:/{i}.jpg" for i in range(10)], [c[MetadataKey.PATH.value] for c in limited])
+        self.assertEqual({Path("C:/0.jpg"): 40}, self.under_test._deduplication_result.get_truncated_groups())
+
+    def test_dry_run_does_not_store_clusters(self):
+        self.addCleanup(setattr, self.config.DRY_RUN, "value", self.config.DRY_RUN.value)
+        self.config.DRY_RUN.value = True
+
+        self.assertFalse(self.under_test._stores_clusters())
+
     def _run_test(
         self, keep: [{}], dont_keep: [{}], test_reversed_order: bool = True,
         test_random_input_order: bool = True
@@ -160,7 +189,8 @@ class SelectImagesToDeleteTest(TestBase):
                 MetadataKey.FILE_SIZE.value: filesize,
                 MetadataKey.FILE_MODIFICATION_DATE.value: modification_date,
                 MetadataKey.PIXELCOUNT.value: pixel_count,
-                MetadataKey.EXIF_DATA.value: exif_tags
+                MetadataKey.EXIF_DATA.value: exif_tags,
+                MetadataKey.EXIF_DATA_COUNT.value: len(exif_tags)
             },
             MetadataKey.SCORE.value: score
         }
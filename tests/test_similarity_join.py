@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from py_image_dedup.library.similarity_join import similarity_join
+from py_image_dedup.util.signature import signature_words, normalized_distances
+
+
+class SimilarityJoinTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.default_rng(0)
+        # groups of slightly modified copies of random signatures
+        originals = random.integers(-2, 3, size=(40, 648), dtype=np.int8)
+        signatures = np.repeat(originals, 3, axis=0)
+        noise = random.random(signatures.shape) < 0.05
+        signatures[noise] = random.integers(-2, 3, size=noise.sum(), dtype=np.int8)
+        self.signatures = signatures
+
+    def _brute_force(self, max_dist: float, min_should_match: int) -> set:
+        words = signature_words(self.signatures)
+        result = set()
+        for a in range(len(self.signatures)):
+            others = np.arange(a + 1, len(self.signatures))
+            matches = (words[others] == words[a]).sum(axis=1)
+            distances = normalized_distances(self.signatures[others],
+                                             np.repeat(self.signatures[a:a + 1], len(others), axis=0))
+            result.update((a, b) for b in others[(matches >= min_should_match) & (distances < max_dist)].tolist())
+        return result
+
+    def test_finds_the_same_pairs_as_brute_force(self):
+        for max_dist, min_should_match in [(0.3, 1), (0.3, 5), (0.6, 1)]:
+            pairs, distances, matches = similarity_join(self.signatures, max_dist, min_should_match, chunk_size=100)
+
+            self.assertEqual(self._brute_force(max_dist, min_should_match), set(map(tuple, pairs.tolist())))
+            self.assertTrue(np.all(distances < max_dist))
+            self.assertTrue(np.all(matches >= min_should_match))
+
+    def test_worker_processes_find_the_same_pairs(self):
+        pairs, distances, matches = similarity_join(self.signatures, 0.3, chunk_size=100)
+        parallel_pairs, parallel_distances, parallel_matches = similarity_join(self.signatures, 0.3, chunk_size=100,
+                                                                               processes=2)
+
+        np.testing.assert_array_equal(pairs, parallel_pairs)
+        np.testing.assert_array_equal(distances, parallel_distances)
+        np.testing.assert_array_equal(matches, parallel_matches)
+
+    def test_ignores_large_buckets(self):
+        signatures = np.ones((20, 648), dtype=np.int8)
+
+        self.assertEqual(190, len(similarity_join(signatures, 0.1)[0]))
+        self.assertEqual(0, len(similarity_join(signatures, 0.1, max_bucket_size=10)[0]))
@@ -0,0 +1,77 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.persistence.snapshot import export_snapshot, import_snapshot, iter_snapshot_chunks
+
+
+class RecordListStore(ImageSignatureStore):
+
+    def __init__(self, records: [dict] = None):
+        super().__init__()
+        self.records = records if records is not None else []
+
+    def get_all(self) -> (int, object):
+        return len(self.records), ({'_id': str(i), '_source': record} for i, record in enumerate(self.records))
+
+    def import_records(self, records: [dict]) -> None:
+        self.records.extend(records)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_export_import(self):
+        records = [self._create_record(i) for i in range(25)]
+        source = RecordListStore(records)
+        target = RecordListStore()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = Path(tmp_dir, "snapshot.npz")
+            self.assertEqual(25, export_snapshot(source, file_path, chunk_size=10))
+
+            chunks = list(iter_snapshot_chunks(file_path))
+            self.assertEqual([10, 10, 5], [len(chunk["path"]) for chunk in chunks])
+            self.assertEqual((10, 648), chunks[0]["signature"].shape)
+
+            self.assertEqual(25, import_snapshot(target, file_path))
+
+        self.assertEqual(records, target.records)
+
+    def test_long_values_do_not_pad_other_rows(self):
+        records = [self._create_record(i) for i in range(100)]
+        records[0][MetadataKey.PATH.value] = "/images/größe/ 0.jpg"
+        records[1][MetadataKey.METADATA.value][MetadataKey.EXIF_DATA.value]["MakerNote"] = "x" * 100000
+        source = RecordListStore(records)
+        target = RecordListStore()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = Path(tmp_dir, "snapshot.npz")
+            export_snapshot(source, file_path)
+
+            with np.load(file_path, allow_pickle=False) as snapshot:
+                metadata_data = snapshot["000000_metadata_data"]
+                self.assertEqual(np.uint8, metadata_data.dtype)
+                self.assertLess(metadata_data.nbytes, 2 * 100000)
+                self.assertEqual(101, len(snapshot["000000_metadata_offsets"]))
+
+            import_snapshot(target, file_path)
+
+        self.assertEqual(records, target.records)
+
+    @staticmethod
+    def _create_record(i: int) -> dict:
+        record = {
+            MetadataKey.PATH.value: f"/images/{i}.jpg",
+            MetadataKey.SIGNATURE.value: [(i + j) % 5 - 2 for j in range(648)],
+            MetadataKey.METADATA.value: {
+                MetadataKey.FILE_SIZE.value: i * 100,
+                MetadataKey.EXIF_DATA.value: {"Make": "Google"}
+            }
+        }
+        for j in range(63):
+            record[f"{MetadataKey.WORD_PREFIX.value}{j}"] = i * j
+        return record
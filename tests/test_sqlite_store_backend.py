@@ -0,0 +1,114 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from py_image_dedup.library.similarity_join import ENTRY_FIELDS
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.persistence.sqlitestorebackend import SQLiteStoreBackend
+
+
+class SQLiteStoreBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SQLiteStoreBackend(Path(self._tmp_dir.name, "images.sqlite"), max_dist=0.1)
+
+    def tearDown(self):
+        self.store.close()
+        self._tmp_dir.cleanup()
+
+    def test_find_similar(self):
+        reference = self._create_record("/images/a.jpg", [1] * 648, word=1)
+        similar = self._create_record("/images/b.jpg", [1] * 647 + [0], word=1)
+        different = self._create_record("/images/c.jpg", [-1] * 648, word=1)
+        unrelated = self._create_record("/images/d.jpg", [1] * 648, word=2)
+        self.store.import_records([reference, similar, different, unrelated])
+
+        result = self.store.find_similar(reference[MetadataKey.PATH.value])
+
+        self.assertEqual(
+            ["/images/a.jpg", "/images/b.jpg"],
+            sorted(candidate[MetadataKey.PATH.value] for candidate in result)
+        )
+
+    def test_truncated_queries(self):
+        store = SQLiteStoreBackend(Path(self._tmp_dir.name, "limited.sqlite"), max_dist=0.1, max_candidates=2)
+        self.addCleanup(store.close)
+        store.import_records([self._create_record(f"/images/{i}.jpg", [1] * 648, word=1) for i in range(3)])
+        store.import_records([self._create_record(f"/images/{i}.jpg", [-1] * 648, word=2) for i in range(3, 6)])
+
+        self.assertEqual(2, len(store.find_similar("/images/0.jpg")))
+        self.assertEqual(["/images/0.jpg"], store.pop_truncated_queries())
+        self.assertEqual([], store.pop_truncated_queries())
+
+        # the candidates left out share less words than the last one, which isn't similar anymore
+        different = [self._create_record(f"/images/{i}.jpg", [-1] * 648, word=3) for i in range(7, 9)]
+        for record in different:
+            for position in range(10, 63):
+                record[f"{MetadataKey.WORD_PREFIX.value}{position}"] = 0
+        store.import_records([self._create_record("/images/6.jpg", [1] * 648, word=3)] + different)
+        self.assertEqual(1, len(store.find_similar("/images/6.jpg")))
+        self.assertEqual([], store.pop_truncated_queries())
+
+    def test_close(self):
+        self.store.import_records([self._create_record("/images/a.jpg", [1] * 648, word=1)])
+        thread = threading.Thread(target=self.store.get, args=("/images/a.jpg",))
+        thread.start()
+        thread.join()
+
+        self.store.close()
+
+        store = SQLiteStoreBackend(Path(self._tmp_dir.name, "images.sqlite"))
+        self.addCleanup(store.close)
+        self.assertIsNotNone(store.get("/images/a.jpg"))
+
+    def test_replace_and_remove(self):
+        self.store.import_records([self._create_record("/images/a.jpg", [1] * 648, word=1)])
+        self.store.flush()
+        self.store.import_records([self._create_record("/images/a.jpg", [2] * 648, word=1)])
+
+        count, entries = self.store.get_all()
+        self.assertEqual(1, count)
+        self.assertEqual([2] * 648, next(entries)['_source'][MetadataKey.SIGNATURE.value])
+
+        self.store.remove("/images/a.jpg")
+        self.assertIsNone(self.store.get("/images/a.jpg"))
+        self.assertEqual(0, self.store.get_all()[0])
+
+    def test_get_all_fields(self):
+        record = self._create_record("/images/a.jpg", [1] * 648, word=1)
+        record[MetadataKey.METADATA.value][MetadataKey.EXIF_DATA.value] = {"Make": "Camera"}
+        self.store.import_records([record])
+
+        _, entries = self.store.get_all(fields=ENTRY_FIELDS)
+        entry = next(entries)['_source']
+
+        self.assertEqual([1] * 648, entry[MetadataKey.SIGNATURE.value])
+        self.assertEqual({MetadataKey.FILE_SIZE.value: 100}, entry[MetadataKey.METADATA.value])
+        self.assertNotIn(f"{MetadataKey.WORD_PREFIX.value}0", entry)
+
+    def test_get_paths_of_generation(self):
+        self.assertEqual([], self.store.get_paths_of_generation())
+        self.store.import_records([
+            self._create_record("/images/a.jpg", [1] * 648, word=1),
+            self._create_record("/images/b.jpg", [1] * 648, word=1, generation=1),
+            self._create_record("/images/c.jpg", [1] * 648, word=1, generation=2),
+            self._create_record("/images/d.jpg", [1] * 648, word=1, generation=2),
+        ])
+
+        self.assertEqual(["/images/c.jpg", "/images/d.jpg"], self.store.get_paths_of_generation())
+        self.assertEqual(["/images/b.jpg", "/images/c.jpg", "/images/d.jpg"], self.store.get_paths_of_generation(1))
+
+    @staticmethod
+    def _create_record(path: str, signature: [int], word: int, generation: int = None) -> dict:
+        record = {
+            MetadataKey.PATH.value: path,
+            MetadataKey.SIGNATURE.value: signature,
+            MetadataKey.METADATA.value: {MetadataKey.FILE_SIZE.value: 100}
+        }
+        if generation is not None:
+            record[MetadataKey.METADATA.value][MetadataKey.GENERATION.value] = generation
+        for i in range(63):
+            record[f"{MetadataKey.WORD_PREFIX.value}{i}"] = word * 100 + i
+        return record
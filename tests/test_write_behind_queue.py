@@ -0,0 +1,148 @@
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from py_image_dedup.persistence import ImageSignatureStore
+from py_image_dedup.persistence.metadata_key import MetadataKey
+from py_image_dedup.persistence.write_behind_queue import WriteBehindQueue
+
+
+class UnavailableStore(ImageSignatureStore):
+    """
+    Store whose database is unavailable, queuing all writes
+    """
+
+    def __init__(self, write_queue: WriteBehindQueue):
+        super().__init__(use_exif_data=False)
+        self.write_queue = write_queue
+
+    def _queues_writes(self) -> bool:
+        return True
+
+    def get(self, image_file_path: str) -> dict or None:
+        raise ConnectionError("store is unavailable")
+
+    def _add(self, image_file_path: str, image_data: dict) -> None:
+        self.write_queue.put(image_data)
+
+
+class WriteBehindQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.spill_file = Path(self._tmp_dir.name, "test.spill")
+        self.written = []
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _write(self, records):
+        self.written.extend(records)
+
+    def test_write(self):
+        queue = WriteBehindQueue(self._write, self.spill_file, max_memory_items=10)
+        for i in range(5):
+            queue.put({"path": f"{i}.jpg"})
+        queue.flush()
+
+        self.assertEqual([f"{i}.jpg" for i in range(5)], [record["path"] for record in self.written])
+
+    def test_spill_when_store_is_unavailable(self):
+        available = threading.Event()
+
+        def write(records):
+            if not available.is_set():
+                raise ConnectionError("store is unavailable")
+            self._write(records)
+
+        queue = WriteBehindQueue(write, self.spill_file, max_memory_items=2, max_backoff=0.1)
+        for i in range(10):
+            queue.put({"path": f"{i}.jpg"})
+
+        self.assertGreater(len(self.spill_file.read_text().splitlines()), 0)
+
+        available.set()
+        queue.flush()
+
+        self.assertEqual([f"{i}.jpg" for i in range(10)], [record["path"] for record in self.written])
+        self.assertEqual("", self.spill_file.read_text())
+
+    def test_replay_spill_file(self):
+        self.spill_file.write_text('{"path": "0.jpg"}\n{"path": "1.jpg"}\n{"path": "2.j')
+
+        queue = WriteBehindQueue(self._write, self.spill_file)
+        queue.flush()
+
+        self.assertEqual(["0.jpg", "1.jpg"], [record["path"] for record in self.written])
+
+    def test_flush_timeout(self):
+        def write(records):
+            raise ConnectionError("store is unavailable")
+
+        queue = WriteBehindQueue(write, self.spill_file, max_memory_items=2, max_backoff=0.1)
+        for i in range(5):
+            queue.put({"path": f"{i}.jpg"})
+
+        self.assertFalse(queue.flush(timeout=0.2))
+        self.assertEqual(5, len(queue))
+
+    def test_close_spills_unwritten_records(self):
+        def write(records):
+            raise ConnectionError("store is unavailable")
+
+        queue = WriteBehindQueue(write, self.spill_file, max_memory_items=3, max_backoff=0.1)
+        for i in range(5):
+            queue.put({"path": f"{i}.jpg"})
+
+        self.assertFalse(queue.close(timeout=0.2))
+
+        spilled = [json.loads(line) for line in self.spill_file.read_text().splitlines()]
+        self.assertEqual([f"{i}.jpg" for i in range(5)], [record["path"] for record in spilled])
+
+        queue = WriteBehindQueue(self._write, self.spill_file)
+        self.assertTrue(queue.close())
+        self.assertEqual([f"{i}.jpg" for i in range(5)], [record["path"] for record in self.written])
+
+    def test_corrupt_lines_are_counted_once(self):
+        self.spill_file.write_text('{"path": "0.jpg"}\n{"path": "1.j\n{"path": "2.jpg"}\n{"path": "3.jpg"}\n')
+        failures = [ConnectionError("store is unavailable")] * 3
+
+        def write(records):
+            if len(failures) > 0:
+                raise failures.pop()
+            self._write(records)
+
+        queue = WriteBehindQueue(write, self.spill_file, batch_size=2, max_backoff=0.01)
+        self.assertTrue(queue.flush(timeout=5))
+
+        self.assertEqual(["0.jpg", "2.jpg", "3.jpg"], [record["path"] for record in self.written])
+
+    def test_put_after_incomplete_line(self):
+        self.spill_file.write_text('{"path": "0.jpg"}\n{"path": "1.j')
+
+        def write(records):
+            raise ConnectionError("store is unavailable")
+
+        queue = WriteBehindQueue(write, self.spill_file, max_memory_items=0, max_backoff=0.1)
+        queue.put({"path": "2.jpg"})
+        queue.close(timeout=0)
+
+        queue = WriteBehindQueue(self._write, self.spill_file)
+        queue.flush()
+
+        self.assertEqual(["0.jpg", "2.jpg"], [record["path"] for record in self.written])
+
+    def test_add_when_store_is_unavailable(self):
+        def write(records):
+            raise ConnectionError("store is unavailable")
+
+        queue = WriteBehindQueue(write, self.spill_file, max_memory_items=0, max_backoff=0.1)
+        store = UnavailableStore(queue)
+        image_file_path = str(next(Path(__file__).parent.joinpath("images").rglob("*.jpg")))
+
+        store.add(image_file_path)
+
+        spilled = [json.loads(line) for line in self.spill_file.read_text().splitlines()]
+        self.assertEqual([image_file_path], [record[MetadataKey.PATH.value] for record in spilled])